@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, redirect, g
+from flask import Flask, Response, request, jsonify, redirect, g, stream_with_context
 import os
 import json
 import logging
@@ -7,19 +7,28 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import requests
 import threading
 import uuid
-import base64
-from bs4 import BeautifulSoup
-import datetime
+import hashlib
+import random
+import resource
 import re
+import datetime
 import time
 from email.utils import parsedate_to_datetime
 
 from dotenv import load_dotenv
 
 import database
+import metrics
+from classifier import NaiveBayes, email_features
+from jobs import JobQueue
+from llm_client import LLMClient, LLMError
+from html_text import decode_base64_chunks, html_to_text, plain_to_text
+from pipeline import Pipeline
+from quota import QuotaLimiter, backoff_delay
+from sender_rules import RULE_KINDS, SenderRules, normalise_sender
+from store import BoundedStore
 
 load_dotenv()  # take environment variables
 
@@ -28,9 +37,19 @@ logging.basicConfig(level=logging.INFO)
 logger = app.logger
 logger.setLevel(logging.DEBUG)
 
-# CODEX: store per-user logs and user context for debugging
+# CODEX: store per-user logs and user context for debugging. Log buffers are
+# kept for the USER_LOG_USERS most recently active users, USER_LOG_LINES each
+USER_LOG_USERS = int(os.environ.get("USER_LOG_USERS", "100"))
+USER_LOG_LINES = int(os.environ.get("USER_LOG_LINES", "200"))
 user_context: ContextVar[str | None] = ContextVar("user_id", default=None)
-user_logs: dict[str, list[str]] = {}
+# CODEX: total log lines seen per user, so event streams can tell what is new
+user_log_counts: dict[str, int] = {}
+user_logs = BoundedStore(
+    max_entries=USER_LOG_USERS,
+    on_evict=lambda user_id, _: user_log_counts.pop(user_id, None),
+)
+# notified whenever a task or a user's logs change, used by event streams
+task_events = threading.Condition()
 
 
 class ContextFilter(logging.Filter):
@@ -46,8 +65,11 @@ class MemoryLogHandler(logging.Handler):
             return
         logs = user_logs.setdefault(user_id, [])
         logs.append(self.format(record))
-        if len(logs) > 200:
-            user_logs[user_id] = logs[-200:]
+        if len(logs) > USER_LOG_LINES:
+            user_logs[user_id] = logs[-USER_LOG_LINES:]
+        with task_events:
+            user_log_counts[user_id] = user_log_counts.get(user_id, 0) + 1
+            task_events.notify_all()
 
 
 handler = MemoryLogHandler()
@@ -75,7 +97,8 @@ def assign_user():
 @app.before_request
 def log_request_info():
     """Log basic info about incoming requests"""
-    if request.path != "/logs":  # CODEX: skip logging for log polling
+    # CODEX: skip logging for log polling and metrics scrapes
+    if request.path not in ("/logs", "/metrics"):
         logger.info("Inbound %s %s", request.method, request.path)
         if request.method in {"POST", "PUT", "PATCH"}:
             data = request.get_json(silent=True)
@@ -99,7 +122,8 @@ def set_user_cookie(resp):
 @app.after_request
 def log_response_info(resp):
     """Log info about outgoing responses"""
-    if request.path != "/logs":  # CODEX: skip logging for log polling
+    # CODEX: skip logging for log polling and metrics scrapes
+    if request.path not in ("/logs", "/metrics"):
         logger.info(
             "Outbound %s %s -> %s",
             request.method,
@@ -120,20 +144,288 @@ TOKEN_FILE = os.path.join(os.path.dirname(__file__), "token.json")
 OPENROUTER_KEY_FILE = os.path.join(os.path.dirname(__file__), "openrouter.key")
 # CODEX: Added constant for storing last used prompt
 PROMPT_FILE = os.path.join(os.path.dirname(__file__), "last_prompt.json")
+# CODEX: OpenRouter endpoint and model; the URL can point at a local stand-in
+OPENROUTER_BASE_URL = os.environ.get(
+    "OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"
+)
+OPENROUTER_MODEL = "deepseek/deepseek-chat-v3-0324:free"
+# number of LLM requests a scan keeps in flight at once
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "4"))
+# CODEX: cached LLM verdicts expire after this many seconds and the cache
+# is cut back to this many entries after each scan, least recently used first
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "50000"))
+# CODEX: most emails packed into one OpenRouter request, and the estimated
+# prompt tokens such a request may use. 1 sends every email on its own
+LLM_BATCH_MAX_EMAILS = int(os.environ.get("LLM_BATCH_MAX_EMAILS", "1"))
+LLM_BATCH_TOKENS = int(os.environ.get("LLM_BATCH_TOKENS", "8000"))
+# CODEX: OpenRouter requests share a keep-alive pool and give up after these
+# timeouts; 429s, 5xx and network errors are retried, and after
+# LLM_CIRCUIT_THRESHOLD failed calls in a row calls fail at once for
+# LLM_CIRCUIT_RESET seconds
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "90"))
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "3"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_CAP = float(os.environ.get("LLM_BACKOFF_CAP", "20"))
+LLM_CIRCUIT_THRESHOLD = int(os.environ.get("LLM_CIRCUIT_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET = float(os.environ.get("LLM_CIRCUIT_RESET", "60"))
+llm_cache_lock = threading.Lock()
+# CODEX: a per-user naive Bayes model settles emails it is at least this sure
+# about without the LLM, once it has learned this many emails of each kind
+CLASSIFIER_CONFIDENCE = float(os.environ.get("CLASSIFIER_CONFIDENCE", "0.99"))
+CLASSIFIER_MIN_EXAMPLES = int(os.environ.get("CLASSIFIER_MIN_EXAMPLES", "30"))
+# CODEX: this share of the emails the classifier is sure about still goes to
+# the LLM as a check. Once CLASSIFIER_MIN_CHECKS checks have been made, a
+# user's classifier stops settling emails while the LLM agrees with fewer
+# than CLASSIFIER_MIN_AGREEMENT of them; all its confident verdicts are
+# then checked, so it comes back once it agrees again
+CLASSIFIER_SHADOW_RATE = float(os.environ.get("CLASSIFIER_SHADOW_RATE", "0.05"))
+CLASSIFIER_MIN_AGREEMENT = float(os.environ.get("CLASSIFIER_MIN_AGREEMENT", "0.95"))
+CLASSIFIER_MIN_CHECKS = int(os.environ.get("CLASSIFIER_MIN_CHECKS", "20"))
+# checks after which older ones count for half
+CLASSIFIER_CHECK_WINDOW = 200
+CLASSIFIER_CACHE_USERS = int(os.environ.get("CLASSIFIER_CACHE_USERS", "100"))
+# models are rebuilt from their stored examples after eviction
+classifiers = BoundedStore(max_entries=CLASSIFIER_CACHE_USERS)
+classifiers_lock = threading.RLock()
+
+# CODEX: Gmail labels used to record filter decisions, keyed by email status
+FILTER_LABELS = ("shopify-spam", "whitelist", "spam-filter-ignore")
+STATUS_LABELS = {
+    "spam": "shopify-spam",
+    "whitelist": "whitelist",
+    "ignore": "spam-filter-ignore",
+}
+LABEL_CACHE_TTL = float(os.environ.get("LABEL_CACHE_TTL", "3600"))
+label_cache: dict[str, tuple[float, dict[str, str]]] = {}
+label_cache_lock = threading.Lock()
+
+# CODEX: Gmail allows 250 quota units per user per second; requests are paced
+# to GMAIL_QUOTA_HEADROOM of that. Failed fetches are retried up to
+# GMAIL_MAX_ATTEMPTS times with jittered backoff capped at GMAIL_BACKOFF_CAP
+GMAIL_QUOTA_PER_SECOND = float(os.environ.get("GMAIL_QUOTA_PER_SECOND", "250"))
+GMAIL_QUOTA_HEADROOM = float(os.environ.get("GMAIL_QUOTA_HEADROOM", "0.9"))
+GMAIL_MAX_CONCURRENCY = int(os.environ.get("GMAIL_MAX_CONCURRENCY", "4"))
+GMAIL_MAX_ATTEMPTS = int(os.environ.get("GMAIL_MAX_ATTEMPTS", "6"))
+GMAIL_BACKOFF_BASE = float(os.environ.get("GMAIL_BACKOFF_BASE", "1"))
+GMAIL_BACKOFF_CAP = float(os.environ.get("GMAIL_BACKOFF_CAP", "32"))
+GMAIL_QUOTA_UNITS = {"messages.get": 5, "messages.batchModify": 50}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+quota_limiters: dict[str, QuotaLimiter] = {}
+quota_limiters_lock = threading.Lock()
+
+# CODEX: finished tasks leave memory after TASK_CACHE_TTL seconds without a
+# request, or sooner once more than TASK_CACHE_MAX tasks are held. They are
+# saved first and load_task brings them back. Running tasks always stay
+TASK_CACHE_TTL = float(os.environ.get("TASK_CACHE_TTL", "1800"))
+TASK_CACHE_MAX = int(os.environ.get("TASK_CACHE_MAX", "200"))
+# closing summaries nobody fetched expire after TASK_SUMMARY_TTL seconds
+TASK_SUMMARY_TTL = float(os.environ.get("TASK_SUMMARY_TTL", "600"))
+# task fields stored in their own columns or tables, or rebuilt on load
+TASK_ROW_FIELDS = {"id", "user_id", "stage", "progress", "total", "emails", "log"}
 
 # in-memory store for background scan tasks
-tasks = {}
+tasks = BoundedStore(
+    max_entries=TASK_CACHE_MAX,
+    ttl=TASK_CACHE_TTL,
+    evictable=lambda task: task.get("stage") in database.FINISHED_TASK_STAGES,
+    on_evict=lambda task_id, task: spill_task(task_id, task),
+)
 # CODEX: retain brief summaries for closed tasks
-task_summaries: dict[str, dict] = {}
+task_summaries = BoundedStore(max_entries=1000, ttl=TASK_SUMMARY_TTL)
+# CODEX: guards task email lists shared by workers and status requests
+tasks_lock = threading.RLock()
+# versions at which emails were removed from each task, for delta responses
+task_removed: dict[str, dict[str, int]] = {}
+# tasks that already include unconfirmed emails from earlier scans
+task_synced: set[str] = set()
+
+
+# CODEX: seconds between keep-alive comments on idle event streams
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
+
+# CODEX: progress-only task updates are written at most this often, with a
+# trailing write once the interval ends so the last progress isn't lost
+TASK_SAVE_INTERVAL = float(os.environ.get("TASK_SAVE_INTERVAL", "1.0"))
+_task_saved_at: dict[str, float] = {}
+_task_save_timers: dict[str, threading.Timer] = {}
+_task_save_lock = threading.RLock()
+
+
+def register_task(task: dict) -> dict:
+    """Add a task to the in-memory store and start its version counter.
+
+    Versions start from the current time in milliseconds so they keep
+    increasing when a task is reloaded after a restart.
+    """
+    task.setdefault("emails", [])
+    task.setdefault("log", [])
+    if "resumable" not in task:
+        task["resumable"] = is_resumable(task)
+    task["version"] = max(task.get("version", 0), int(time.time() * 1000))
+    tasks[task["id"]] = task
+    return task
+
+
+def bump_task_version(info: dict) -> int:
+    """Increment and return the version of a task after a change."""
+    info["version"] = info.get("version", 0) + 1
+    with task_events:
+        task_events.notify_all()
+    return info["version"]
 
 
 def update_task_email_status(msg_id: str, status: str) -> None:
     """Update status of a message within any running scan task."""
-    for info in tasks.values():
-        for email in info.get("emails", []):
-            if email.get("id") == msg_id:
-                # CODEX: Persist manual status updates during a scan
-                email["status"] = status
+    with tasks_lock:
+        for task_id, info in tasks.items():
+            for email in info.get("emails", []):
+                if email.get("id") == msg_id:
+                    # CODEX: Persist manual status updates during a scan
+                    email["status"] = status
+                    email["version"] = bump_task_version(info)
+                    database.set_task_email_status(task_id, msg_id, status)
+
+
+def add_task_emails(task_id: str, emails: list[dict], *, persist=True) -> None:
+    """Append emails to a task in memory and, by default, in the database.
+
+    Emails already in the task are skipped.
+    """
+    info = tasks.get(task_id)
+    if not info or not emails:
+        return
+    with tasks_lock:
+        known = {e["id"] for e in info["emails"]}
+        emails = [e for e in emails if e["id"] not in known]
+        if not emails:
+            return
+        for email in emails:
+            email["version"] = bump_task_version(info)
+            task_removed.get(task_id, {}).pop(email["id"], None)
+        info["emails"].extend(emails)
+    if persist:
+        database.append_task_emails(task_id, emails)
+
+
+def remove_task_emails(task_id: str, email_ids) -> None:
+    """Drop emails from a task in memory so pollers see them removed."""
+    info = tasks.get(task_id)
+    email_ids = set(email_ids)
+    if not info or not email_ids:
+        return
+    with tasks_lock:
+        removed = task_removed.setdefault(task_id, {})
+        kept = []
+        for email in info["emails"]:
+            if email["id"] in email_ids:
+                removed[email["id"]] = bump_task_version(info)
+            else:
+                kept.append(email)
+        info["emails"] = kept
+
+
+def remove_emails_from_tasks(user_id: str, email_ids) -> None:
+    """Drop emails from every task belonging to a user."""
+    for task_id, info in list(tasks.items()):
+        if info.get("user_id") == user_id:
+            remove_task_emails(task_id, email_ids)
+
+
+def add_task_log(task_id: str, *entries: dict) -> None:
+    """Append log entries to a task in memory and in the database."""
+    info = tasks.get(task_id)
+    if not info:
+        return
+    with tasks_lock:
+        info["log"].extend(entries)
+        # full snapshots and event streams must see the longer log
+        bump_task_version(info)
+    database.append_task_log(task_id, list(entries))
+
+
+def record_llm_cache_lookup(task_id: str, *, hit: bool) -> None:
+    """Count a verdict cache hit or miss globally and on the task."""
+    key = "hits" if hit else "misses"
+    metrics.LLM_CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+    with llm_cache_lock:
+        info = tasks.get(task_id)
+        if info is not None:
+            stats = info.setdefault("llm_cache", {"hits": 0, "misses": 0})
+            stats[key] += 1
+
+
+def record_fetch_savings(task_id: str, count: int, size: int) -> None:
+    """Count full message downloads a scan skipped and their estimated bytes."""
+    if not count:
+        return
+    with tasks_lock:
+        info = tasks.get(task_id)
+        if info is not None:
+            stats = info.setdefault(
+                "fetch_savings", {"full_fetches_avoided": 0, "bytes_avoided": 0}
+            )
+            stats["full_fetches_avoided"] += count
+            stats["bytes_avoided"] += size
+
+
+def record_sender_rule_hits(task_id: str, checked: int, hits: dict) -> None:
+    """Add to a scan's count of emails checked against and matched by sender rules."""
+    for kind, count in hits.items():
+        if count:
+            metrics.SENDER_RULE_HITS.inc(count, kind=kind)
+    with tasks_lock:
+        info = tasks.get(task_id)
+        if info is None:
+            return
+        stats = info.setdefault(
+            "sender_rules",
+            {"checked": 0, "hits": 0, "by_kind": dict.fromkeys(RULE_KINDS, 0)},
+        )
+        stats["checked"] += checked
+        for kind, count in hits.items():
+            stats["hits"] += count
+            stats["by_kind"][kind] += count
+        stats["hit_rate"] = (
+            round(stats["hits"] / stats["checked"], 3) if stats["checked"] else 0.0
+        )
+
+
+def record_local_classifier(
+    task_id: str, *, enabled: bool | None = None, **counts: int
+) -> None:
+    """Add to a scan's local classifier counts and update its rates.
+
+    ``settled`` emails were decided by the classifier and ``uncertain`` ones
+    left to the LLM. ``shadowed`` ones it was sure about went to the LLM as
+    a check, and ``agreed`` of the ``compared`` LLM verdicts on them matched
+    the classifier. ``enabled`` is false while it may not settle emails.
+    """
+    with tasks_lock:
+        info = tasks.get(task_id)
+        if info is None:
+            return
+        stats = info.setdefault(
+            "local_classifier",
+            {
+                "enabled": True,
+                "settled": 0,
+                "uncertain": 0,
+                "shadowed": 0,
+                "compared": 0,
+                "agreed": 0,
+            },
+        )
+        if enabled is not None:
+            stats["enabled"] = enabled
+        for key, count in counts.items():
+            stats[key] += count
+        checked = stats["settled"] + stats["uncertain"] + stats["shadowed"]
+        stats["skip_rate"] = round(stats["settled"] / checked, 3) if checked else 0.0
+        stats["agreement_rate"] = (
+            round(stats["agreed"] / stats["compared"], 3) if stats["compared"] else None
+        )
 
 
 def update_task(
@@ -143,16 +435,25 @@ def update_task(
     progress: int | None = None,
     total: int | None = None,
 ) -> None:
-    """Update task info and persist to the database."""
+    """Update task info and persist to the database.
+
+    Stage and total changes are saved immediately while progress-only
+    updates are debounced by ``TASK_SAVE_INTERVAL`` seconds, the last of
+    them being saved once the interval ends.
+    """
     info = tasks.get(task_id)
     if not info:
         return
     if stage is not None:
         info["stage"] = stage
+        # CODEX: checked once here rather than on every snapshot
+        info["resumable"] = is_resumable(info)
     if progress is not None:
         info["progress"] = progress
     if total is not None:
         info["total"] = total
+    with tasks_lock:
+        bump_task_version(info)
     logger.debug(
         "Task %s stage=%s progress=%s/%s",
         task_id,
@@ -160,9 +461,104 @@ def update_task(
         info.get("progress"),
         info.get("total"),
     )
+    now = time.monotonic()
+    wait = TASK_SAVE_INTERVAL - (now - _task_saved_at.get(task_id, 0.0))
+    if stage is None and total is None and wait > 0:
+        with _task_save_lock:
+            if task_id not in _task_save_timers:
+                timer = threading.Timer(wait, _flush_task_save, (task_id,))
+                timer.daemon = True
+                _task_save_timers[task_id] = timer
+                timer.start()
+        return
+    _cancel_task_save(task_id)
+    _task_saved_at[task_id] = now
     database.save_task(info)
 
 
+def _flush_task_save(task_id: str) -> None:
+    """Write a task whose last progress update was debounced."""
+    # CODEX: saved under the lock so a task forgotten meanwhile, which
+    # cancels the save first, isn't written back after its deletion
+    with _task_save_lock:
+        if _task_save_timers.pop(task_id, None) is None:
+            return
+        info = tasks.get(task_id)
+        if info is not None:
+            _task_saved_at[task_id] = time.monotonic()
+            database.save_task(info)
+
+
+def _cancel_task_save(task_id: str) -> None:
+    with _task_save_lock:
+        timer = _task_save_timers.pop(task_id, None)
+    if timer is not None:
+        timer.cancel()
+
+
+def load_task(task_id: str, user_id: str) -> dict | None:
+    """Return a task from memory, loading it from the database if needed."""
+    task = tasks.get(task_id)
+    if not task:
+        task = database.load_user_task(user_id, task_id)
+        if task:
+            register_task(task)
+    return task
+
+
+def spill_task(task_id: str, task: dict) -> None:
+    """Save a task evicted from memory so :func:`load_task` can restore it.
+
+    Event streams holding the evicted task are woken to load it again.
+    """
+    database.save_task(task)
+    database.save_task_extra(
+        task_id,
+        {k: v for k, v in task.items() if k not in TASK_ROW_FIELDS | {"version"}},
+    )
+    _cancel_task_save(task_id)
+    _task_saved_at.pop(task_id, None)
+    task_removed.pop(task_id, None)
+    # re-merged with the stored email statuses when it is loaded again
+    task_synced.discard(task_id)
+    bump_task_version(task)
+    logger.debug("Evicted finished task %s from memory", task_id)
+
+
+def enqueue_task_job(task_id: str, kind: str, payload: dict):
+    """Queue the job for a new task and return the task id to poll.
+
+    If the same job is already queued or running the new task is dropped and
+    the task of the existing job is returned instead.
+    """
+    job, created = job_queue.enqueue(g.user_id, kind, payload, task_id)
+    if not created:
+        logger.info("Identical %s job already queued for task %s", kind, job["task_id"])
+        forget_task(task_id)
+    return jsonify({"task_id": job["task_id"]})
+
+
+def fail_job_task(job: dict) -> None:
+    """Mark the task of a failed job as failed unless it already finished."""
+    task_id = job.get("task_id")
+    info = load_task(task_id, job["user_id"]) if task_id else None
+    if info and info.get("stage") not in database.FINISHED_TASK_STAGES:
+        update_task(task_id, stage="failed")
+
+
+def forget_task(task_id: str) -> None:
+    """Drop a task from memory and the database."""
+    info = tasks.pop(task_id, None)
+    _cancel_task_save(task_id)
+    _task_saved_at.pop(task_id, None)
+    task_removed.pop(task_id, None)
+    task_synced.discard(task_id)
+    database.delete_task(task_id)
+    if info:
+        # wakes event streams so they see the task has gone
+        bump_task_version(info)
+
+
 # Google OAuth client credentials
 CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
@@ -232,9 +628,9 @@ def last_prompt():
     return jsonify({"prompt": load_last_prompt()})
 
 
-def get_credentials():
-    """Load OAuth credentials for the current user."""
-    token_json = database.load_token(g.user_id)
+def get_credentials(user_id: str):
+    """Load a user's OAuth credentials."""
+    token_json = database.load_token(user_id)
     if not token_json:
         return None
     try:
@@ -269,16 +665,100 @@ def save_last_prompt(prompt: str) -> None:
         logger.error("Failed to save prompt: %s", e)
 
 
-def get_label_id(service, name):
+def get_quota_limiter(user_id: str) -> QuotaLimiter:
+    """Return the Gmail quota limiter shared by all of a user's requests."""
+    with quota_limiters_lock:
+        limiter = quota_limiters.get(user_id)
+        if limiter is None:
+            limiter = QuotaLimiter(
+                GMAIL_QUOTA_PER_SECOND * GMAIL_QUOTA_HEADROOM,
+                max_concurrency=GMAIL_MAX_CONCURRENCY,
+            )
+            quota_limiters[user_id] = limiter
+        return limiter
+
+
+def get_label_ids(service, user_id: str, names=FILTER_LABELS) -> dict[str, str]:
+    """Return Gmail label ids by name, creating any labels that are missing.
+
+    Ids are cached per user for ``LABEL_CACHE_TTL`` seconds so one
+    ``labels.list`` call resolves all of the filter labels.
+    """
+    now = time.monotonic()
+    with label_cache_lock:
+        expires, ids = label_cache.get(user_id, (0.0, {}))
+        if expires <= now:
+            ids = {}
+    if all(name.lower() in ids for name in names):
+        return {name: ids[name.lower()] for name in names}
+
     logger.debug("Gmail request: list labels")
     labels = service.users().labels().list(userId="me").execute().get("labels", [])
-    for lbl in labels:
-        if lbl["name"].lower() == name.lower():
-            return lbl["id"]
-    # create label if not exists
-    logger.debug("Gmail request: create label %s", name)
-    label = service.users().labels().create(userId="me", body={"name": name}).execute()
-    return label["id"]
+    ids = {lbl["name"].lower(): lbl["id"] for lbl in labels}
+    for name in names:
+        if name.lower() not in ids:
+            # create label if not exists
+            logger.debug("Gmail request: create label %s", name)
+            label = (
+                service.users()
+                .labels()
+                .create(userId="me", body={"name": name})
+                .execute()
+            )
+            ids[name.lower()] = label["id"]
+    with label_cache_lock:
+        label_cache[user_id] = (now + LABEL_CACHE_TTL, ids)
+    return {name: ids[name.lower()] for name in names}
+
+
+def get_label_id(service, name, user_id: str):
+    return get_label_ids(service, user_id, [name])[name]
+
+
+def invalidate_label_cache(user_id: str) -> None:
+    """Forget cached label ids, e.g. after Gmail reports a label missing."""
+    with label_cache_lock:
+        label_cache.pop(user_id, None)
+
+
+def execute_gmail_change(method: str, req):
+    """Execute a Gmail label or filter change, recording its time and errors."""
+    try:
+        with metrics.GMAIL_REQUEST_SECONDS.time(method=method):
+            return req.execute()
+    except HttpError as e:
+        metrics.GMAIL_REQUEST_ERRORS.inc(method=method, status=e.resp.status)
+        raise
+
+
+def modify_message_labels(service, user_id: str, msg_id: str, add, remove) -> None:
+    """Add and remove labels by name on one message.
+
+    A 404 may mean a cached label was deleted, so the cache is refreshed and
+    the change retried once.
+    """
+    for attempt in range(2):
+        ids = get_label_ids(service, user_id, list(add) + list(remove))
+        try:
+            execute_gmail_change(
+                "messages.modify",
+                service.users()
+                .messages()
+                .modify(
+                    userId="me",
+                    id=msg_id,
+                    body={
+                        "addLabelIds": [ids[n] for n in add],
+                        "removeLabelIds": [ids[n] for n in remove],
+                    },
+                ),
+            )
+            return
+        except HttpError as e:
+            if e.resp.status != 404 or attempt:
+                raise
+            logger.warning("Label update for %s returned 404, reloading labels", msg_id)
+            invalidate_label_cache(user_id)
 
 
 # CODEX: Added helper to fetch all messages across pages
@@ -292,7 +772,8 @@ def list_all_messages(service, user_id="me", q=None):
         if page_token:
             params["pageToken"] = page_token
         logger.debug("Gmail request: list messages %s", params)
-        resp = service.users().messages().list(**params).execute()
+        with metrics.GMAIL_LIST_PAGE_SECONDS.time(source="messages"):
+            resp = service.users().messages().list(**params).execute()
         logger.debug("Gmail response: %s", resp)
         messages.extend(resp.get("messages", []))
         page_token = resp.get("nextPageToken")
@@ -302,34 +783,151 @@ def list_all_messages(service, user_id="me", q=None):
     return messages
 
 
+def list_history_messages(service, start_history_id: str):
+    """Return unread inbox messages added since a history id.
+
+    Returns ``(messages, history_id)`` where ``history_id`` is the mailbox's
+    latest history id. Raises ``HttpError`` 404 if the start id has expired.
+    """
+    messages = {}
+    history_id = start_history_id
+    params = {
+        "userId": "me",
+        "startHistoryId": start_history_id,
+        "historyTypes": ["messageAdded"],
+        "labelId": "INBOX",
+    }
+    while True:
+        logger.debug("Gmail request: list history %s", params)
+        with metrics.GMAIL_LIST_PAGE_SECONDS.time(source="history"):
+            resp = service.users().history().list(**params).execute()
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg = added["message"]
+                label_ids = msg.get("labelIds", [])
+                if "INBOX" in label_ids and "UNREAD" in label_ids:
+                    messages[msg["id"]] = {"id": msg["id"]}
+        history_id = resp.get("historyId", history_id)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+        params["pageToken"] = page_token
+    logger.info("Retrieved %d new messages from gmail history", len(messages))
+    return list(messages.values()), history_id
+
+
+def list_new_messages(service, user_id: str, date_after: datetime.datetime, query):
+    """Return messages to scan and the sync state to store afterwards.
+
+    If the previous scan covered at least this date range the History API is
+    used to list only messages added since then. Otherwise, or when the stored
+    history id has expired, every message matching ``query`` is listed.
+    Returns ``(messages, history_id, synced_after)``.
+    """
+    after = date_after.date().isoformat()
+    state = database.get_sync_state(user_id)
+    if state and state["synced_after"] <= after:
+        try:
+            messages, history_id = list_history_messages(service, state["history_id"])
+            return messages, history_id, state["synced_after"]
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.info(
+                "History id %s expired, listing all messages", state["history_id"]
+            )
+    # CODEX: read the history id before listing so nothing added meanwhile is missed
+    logger.debug("Gmail request: get profile")
+    history_id = service.users().getProfile(userId="me").execute()["historyId"]
+    return list_all_messages(service, q=query), history_id, after
+
+
+def http_error_reason(error: HttpError) -> str:
+    """Return the first ``reason`` in a Gmail error response, if any."""
+    try:
+        details = json.loads(error.content or b"{}")
+        return details["error"]["errors"][0].get("reason", "")
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+
+def retry_after_seconds(error: HttpError) -> float | None:
+    """Return the ``Retry-After`` delay of an error response in seconds."""
+    value = error.resp.get("retry-after") if error.resp else None
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return max(0.0, (retry_at - now).total_seconds())
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if not isinstance(error, HttpError):
+        return False
+    return error.resp.status == 429 or (
+        error.resp.status == 403 and http_error_reason(error) in RATE_LIMIT_REASONS
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    """Return True for errors worth retrying: quota, server and network errors."""
+    if not isinstance(error, HttpError):
+        return True
+    return is_rate_limited(error) or error.resp.status >= 500
+
+
+def retry_reason(error: Exception) -> str:
+    """Return the metrics label for why a fetch is retried."""
+    if is_rate_limited(error):
+        return "rate_limited"
+    return "server" if isinstance(error, HttpError) else "network"
+
+
 # CODEX: Added helper to fetch message details using Gmail batch requests
 def batch_get_messages(
     service,
     ids,
     *,
+    user_id: str,
     fmt="full",
     metadata_headers=None,
-    batch_size=20,
-    max_attempts=20,
-):
-    """Return message details for given ids using batch requests with retries."""
+    max_attempts=GMAIL_MAX_ATTEMPTS,
+) -> tuple[dict, list[str]]:
+    """Fetch message details for ``ids`` with batch requests.
+
+    Requests are paced by the user's quota limiter and only sub-requests that
+    failed with a retryable error are sent again, after a capped, jittered
+    backoff. Returns the details keyed by id and the ids that could not be
+    fetched.
+    """
     headers = metadata_headers or []
+    limiter = get_quota_limiter(user_id)
     remaining = list(ids)
     results = {}
-    attempt = 1
-
-    while remaining and attempt < max_attempts:
-        failed = []
-        for i in range(0, len(remaining), batch_size):
-            chunk = remaining[i : i + batch_size]  # noqa: E203
-            failed_chunk = []
-
-            def callback(request_id, response, exception, fc=failed_chunk):
+    failed_ids = []
+    attempt = 0
+
+    while remaining:
+        retry = []
+        retry_after = 0.0
+        rate_limited = False
+        start = 0
+        while start < len(remaining):
+            # CODEX: the limiter shrinks or grows the batch between chunks
+            end = start + limiter.batch_size
+            chunk = remaining[start:end]
+            start = end
+            errors = {}
+
+            def callback(request_id, response, exception, errors=errors):
                 if exception:
-                    logger.warning(
-                        "Batch fetch error for %s: %s", request_id, exception
-                    )
-                    fc.append(request_id)
+                    errors[request_id] = exception
                 else:
                     results[request_id] = response
 
@@ -346,44 +944,144 @@ def batch_get_messages(
                     )
                 )
                 batch.add(req, request_id=msg_id, callback=callback)
+            limiter.acquire(len(chunk) * GMAIL_QUOTA_UNITS["messages.get"])
+            metrics.GMAIL_BATCH_MESSAGES.inc(len(chunk), format=fmt)
             try:
-                logger.debug("Gmail batch request: get %d messages", len(chunk))
-                batch.execute()
+                with limiter.slot(), metrics.GMAIL_BATCH_SECONDS.time(format=fmt):
+                    logger.debug("Gmail batch request: get %d messages", len(chunk))
+                    batch.execute()
                 logger.debug(
                     "Gmail batch response received with %d results", len(results)
                 )
-            except HttpError as e:
-                if e.resp.status == 429:
-                    logger.warning("Batch execution rate limited: %s", e)
-                    failed_chunk.extend(chunk)
+            except Exception as e:
+                # CODEX: a failed envelope fails every request in the chunk
+                errors.update({msg_id: e for msg_id in chunk if msg_id not in results})
+
+            chunk_limited = False
+            for msg_id, error in errors.items():
+                if is_rate_limited(error):
+                    chunk_limited = True
+                    retry_after = max(retry_after, retry_after_seconds(error) or 0.0)
+                if is_retryable(error):
+                    retry.append(msg_id)
+                    metrics.GMAIL_FETCH_RETRIES.inc(reason=retry_reason(error))
                 else:
-                    logger.error("Failed to execute batch: %s", e)
-            failed.extend(failed_chunk)
-
-        remaining = failed
-        if remaining:
-            sleep = 2**attempt  # exponential backoff
-            logger.info(
-                "Retrying %d failed message fetches in %d seconds",
-                len(remaining),
-                sleep,
-            )
-            time.sleep(sleep)
+                    logger.warning("Fetching message %s failed: %s", msg_id, error)
+                    failed_ids.append(msg_id)
+            if chunk_limited:
+                rate_limited = True
+                limiter.throttled_by_server(retry_after)
+            elif not errors:
+                limiter.succeeded()
+
+        remaining = retry
+        if not remaining:
+            break
         attempt += 1
+        if attempt >= max_attempts:
+            failed_ids.extend(remaining)
+            break
+        delay = backoff_delay(attempt, GMAIL_BACKOFF_BASE, GMAIL_BACKOFF_CAP)
+        if rate_limited:
+            delay = max(delay, retry_after)
+        logger.info(
+            "Retrying %d failed message fetches in %.1f seconds",
+            len(remaining),
+            delay,
+        )
+        time.sleep(delay)
 
-    if remaining:
+    if failed_ids:
+        metrics.GMAIL_FETCH_FAILURES.inc(len(failed_ids))
         logger.error(
             "Failed to fetch %d messages after %d attempts",
-            len(remaining),
-            attempt,
+            len(failed_ids),
+            attempt + 1,
         )
 
-    return results
+    return results, failed_ids
+
+
+class LabelBatcher:
+    """Collect label changes and apply them with ``messages.batchModify``.
+
+    Messages with the same label changes are grouped so each group costs one
+    request per ``MAX_IDS`` messages instead of one request per message.
+    """
+
+    MAX_IDS = 1000
+
+    def __init__(self, service, user_id: str):
+        self.service = service
+        self.user_id = user_id
+        self.groups: dict[tuple[tuple[str, ...], tuple[str, ...]], list[str]] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(ids) for ids in self.groups.values())
+
+    def add(self, msg_id: str, add_labels: list[str], remove_labels: list[str]) -> None:
+        key = (tuple(add_labels), tuple(remove_labels))
+        self.groups.setdefault(key, []).append(msg_id)
+
+    def changes(self) -> list:
+        """Return pending changes as ``[add_labels, remove_labels, ids]`` lists."""
+        return [[list(a), list(r), list(ids)] for (a, r), ids in self.groups.items()]
+
+    def restore(self, changes: list) -> None:
+        """Queue changes returned by :meth:`changes` again."""
+        for add_labels, remove_labels, ids in changes:
+            for msg_id in ids:
+                self.add(msg_id, add_labels, remove_labels)
+
+    def flush(self) -> set[str]:
+        """Apply all pending label changes and return the ids that failed."""
+        failed = set()
+        groups, self.groups = self.groups, {}
+        for (add_labels, remove_labels), ids in groups.items():
+            for i in range(0, len(ids), self.MAX_IDS):
+                chunk = ids[i : i + self.MAX_IDS]  # noqa: E203
+                logger.debug(
+                    "Gmail request: batchModify %d messages add=%s remove=%s",
+                    len(chunk),
+                    add_labels,
+                    remove_labels,
+                )
+                get_quota_limiter(self.user_id).acquire(
+                    GMAIL_QUOTA_UNITS["messages.batchModify"]
+                )
+                try:
+                    execute_gmail_change(
+                        "messages.batchModify",
+                        self.service.users()
+                        .messages()
+                        .batchModify(
+                            userId="me",
+                            body={
+                                "ids": chunk,
+                                "addLabelIds": list(add_labels),
+                                "removeLabelIds": list(remove_labels),
+                            },
+                        ),
+                    )
+                except HttpError as e:
+                    if e.resp.status == 404:
+                        # a cached label may have been deleted
+                        invalidate_label_cache(self.user_id)
+                    logger.error(
+                        "Failed to update labels for %d messages: %s", len(chunk), e
+                    )
+                    failed.update(chunk)
+        return failed
 
 
 # Recursively extract the text or html body from a message payload.
-def extract_email_body(payload):
-    """Return decoded plain text body prioritising HTML."""
+def extract_email_body(payload, max_words: int | None = None):
+    """Return decoded plain text body prioritising HTML.
+
+    Only the chosen part is decoded, a chunk at a time, and with ``max_words``
+    decoding stops once that many words have been found.
+    """
 
     def collect_parts(part, results):
         if (
@@ -393,39 +1091,321 @@ def extract_email_body(payload):
         ):
             data = part["body"].get("data")
             if data:
-                text = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
-                results.append((text, part.get("mimeType")))
+                results.append((data, part.get("mimeType")))
         for sub in part.get("parts", []):
             collect_parts(sub, results)
 
-    def html_to_plain_text(html: str) -> str:
-        """Convert HTML to plain text stripping formatting and links."""
-        soup = BeautifulSoup(html, "html.parser")
-        for a in soup.find_all("a"):
-            a.replace_with(a.get_text())
-        text = soup.get_text(separator=" ")
-        text = re.sub(r"\s+", " ", text)
-        return text.strip()
-
     parts = []
     collect_parts(payload, parts)
 
-    html_part = next((t for t, m in parts if m == "text/html"), None)
+    # CODEX: stream the HTML through a parser instead of building a soup
+    html_part = next((d for d, m in parts if m == "text/html"), None)
     if html_part:
-        body = html_to_plain_text(html_part)
+        with metrics.EXTRACT_SECONDS.time(mime_type="text/html"):
+            body = html_to_text(decode_base64_chunks(html_part), max_words)
         logger.debug(f"body is html: {body}")
         return body, "text/html"
 
-    text_part = next((t for t, m in parts if m == "text/plain"), None)
+    text_part = next((d for d, m in parts if m == "text/plain"), None)
     if text_part:
-        text_part = re.sub(r"https?://\S+", "", text_part)
-        text_part = re.sub(r"\s+", " ", text_part).strip()
-        logger.debug(f"body is plaintext: {text_part}")
-        return text_part, "text/plain"
+        with metrics.EXTRACT_SECONDS.time(mime_type="text/plain"):
+            body = plain_to_text(decode_base64_chunks(text_part), max_words)
+        logger.debug(f"body is plaintext: {body}")
+        return body, "text/plain"
 
     return "", ""
 
 
+# number of message ids fetched and stored together when refreshing senders
+SENDER_FETCH_BATCH = 100
+
+# words of each email body sent to the LLM
+BODY_PREVIEW_WORDS = 500
+
+# CODEX: scan pipeline settings. Messages are fetched from Gmail in batches
+# of SCAN_FETCH_BATCH and each stage holds at most SCAN_QUEUE_SIZE waiting items
+SCAN_FETCH_BATCH = 25
+SCAN_FETCH_WORKERS = int(os.environ.get("SCAN_FETCH_WORKERS", "2"))
+SCAN_EXTRACT_WORKERS = int(os.environ.get("SCAN_EXTRACT_WORKERS", "2"))
+SCAN_QUEUE_SIZE = int(os.environ.get("SCAN_QUEUE_SIZE", "100"))
+
+# headers requested by the metadata pass of a scan
+SCAN_METADATA_HEADERS = ["From", "Subject", "Date"]
+
+
+def message_header(message: dict, name: str) -> str:
+    """Return the first header called ``name`` from a Gmail message."""
+    headers = message.get("payload", {}).get("headers", [])
+    return next((h["value"] for h in headers if h["name"].lower() == name.lower()), "")
+
+
+llm_client = LLMClient(
+    OPENROUTER_BASE_URL,
+    pool_size=max(10, LLM_CONCURRENCY),
+    connect_timeout=LLM_CONNECT_TIMEOUT,
+    read_timeout=LLM_READ_TIMEOUT,
+    max_attempts=LLM_MAX_ATTEMPTS,
+    backoff_base=LLM_BACKOFF_BASE,
+    backoff_cap=LLM_BACKOFF_CAP,
+    failure_threshold=LLM_CIRCUIT_THRESHOLD,
+    reset_after=LLM_CIRCUIT_RESET,
+    logger=logger,
+)
+
+
+def get_openrouter_key() -> str:
+    """Return the OpenRouter key from the environment or key file."""
+    openrouter_key = os.environ.get("OPENROUTER_API_KEY", "")
+    if not openrouter_key and os.path.exists(OPENROUTER_KEY_FILE):
+        with open(OPENROUTER_KEY_FILE) as f:
+            openrouter_key = f.read().strip()
+    return openrouter_key
+
+
+def build_system_prompt(prompt: str) -> str:
+    """Return the full system prompt sent with each email."""
+    return prompt + (
+        " Start your response with "
+        "<RESULT>YES</RESULT> or "
+        "<RESULT>NO</RESULT> followed by "
+        "the justification for "
+        "your answer."
+    )
+
+
+def llm_cache_key(prompt: str, text_md: str, batched: bool = False) -> str:
+    """Return the verdict cache key for an email classified with a prompt.
+
+    Verdicts from multi-email requests are keyed by the batch system prompt
+    that was actually sent, apart from those of single-email requests.
+    """
+    if batched:
+        raw = json.dumps(
+            [OPENROUTER_MODEL, "batch", build_batch_system_prompt(prompt), text_md]
+        )
+    else:
+        raw = json.dumps([OPENROUTER_MODEL, build_system_prompt(prompt), text_md])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def request_completion(
+    system_prompt: str, content: str, openrouter_key: str
+) -> str | None:
+    """Send one chat completion request to OpenRouter.
+
+    Returns the model's answer, or None if the request failed.
+    """
+    try:
+        return llm_client.chat(
+            OPENROUTER_MODEL,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content},
+            ],
+            openrouter_key,
+        )
+    except LLMError as e:
+        logger.error("%s", e)
+        return None
+
+
+def classify_email(prompt: str, text_md: str, openrouter_key: str) -> str | None:
+    """Ask the LLM whether an email matches the prompt.
+
+    Returns the model's answer, or None if the request failed.
+    """
+    return request_completion(build_system_prompt(prompt), text_md, openrouter_key)
+
+
+RESULT_RE = re.compile(r"<RESULT>\s*(YES|NO)\s*</RESULT>", re.IGNORECASE)
+BATCH_RESULT_RE = re.compile(
+    r"<RESULT\s+id\s*=\s*[\"']?([^\"'>\s]+)[\"']?\s*>\s*(YES|NO)\s*</RESULT>",
+    re.IGNORECASE,
+)
+
+
+def verdict_status(answer: str) -> str:
+    """Return ``spam`` or ``not_spam`` for an LLM answer."""
+    match = RESULT_RE.search(answer)
+    if match:
+        return "spam" if match.group(1).upper() == "YES" else "not_spam"
+    return "spam" if "yes" in answer.lower() else "not_spam"
+
+
+def build_batch_system_prompt(prompt: str) -> str:
+    """Return the system prompt sent with several emails at once."""
+    return prompt + (
+        " You will be given several emails. Each starts with a line "
+        '<EMAIL id="..."> and ends with </EMAIL>. Answer every email in '
+        "the order given, each on a new line starting with "
+        '<RESULT id="...">YES</RESULT> or <RESULT id="...">NO</RESULT>, '
+        "using the email's id, followed by a one sentence justification."
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def format_batch_email(msg_id: str, text_md: str) -> str:
+    return f'<EMAIL id="{msg_id}">\n{text_md}\n</EMAIL>'
+
+
+def pack_llm_batches(emails: list[tuple[str, str]], prompt: str) -> list[list]:
+    """Group ``(id, text)`` pairs into requests within the batch limits.
+
+    Emails keep their order. A group ends once another email would take it
+    past ``LLM_BATCH_MAX_EMAILS`` or the ``LLM_BATCH_TOKENS`` estimate, and an
+    email too big for the budget is sent on its own.
+    """
+    budget = LLM_BATCH_TOKENS - estimate_tokens(build_batch_system_prompt(prompt))
+    groups = []
+    group, used = [], 0
+    for msg_id, text_md in emails:
+        tokens = estimate_tokens(format_batch_email(msg_id, text_md))
+        if group and (len(group) >= LLM_BATCH_MAX_EMAILS or used + tokens > budget):
+            groups.append(group)
+            group, used = [], 0
+        group.append((msg_id, text_md))
+        used += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def parse_batch_verdicts(answer: str, ids) -> dict[str, str]:
+    """Split a multi-email answer into one answer per email id.
+
+    Each email's answer is its verdict followed by the text up to the next
+    verdict. Ids that weren't asked about are ignored and only the first
+    verdict for an id counts.
+    """
+    wanted = set(ids)
+    matches = list(BATCH_RESULT_RE.finditer(answer))
+    verdicts = {}
+    for n, match in enumerate(matches):
+        msg_id = match.group(1)
+        if msg_id not in wanted or msg_id in verdicts:
+            continue
+        end = matches[n + 1].start() if n + 1 < len(matches) else len(answer)
+        reason = answer[match.end() : end].strip()  # noqa: E203
+        verdicts[msg_id] = f"<RESULT>{match.group(2).upper()}</RESULT> {reason}".strip()
+    return verdicts
+
+
+def classify_emails(
+    prompt: str, emails: list[tuple[str, str]], openrouter_key: str
+) -> tuple[dict[str, str], set[str]]:
+    """Classify ``(id, text)`` pairs with one request and return answers by id.
+
+    Emails missing from the answer, or all of them if the request failed,
+    are sent again one at a time. Emails that still have no answer are left
+    out of the result. Also returns the ids answered by the multi-email
+    request rather than on their own.
+    """
+    if len(emails) == 1:
+        answer = classify_email(prompt, emails[0][1], openrouter_key)
+        return ({emails[0][0]: answer} if answer is not None else {}), set()
+    content = "\n\n".join(format_batch_email(i, text) for i, text in emails)
+    answer = request_completion(
+        build_batch_system_prompt(prompt), content, openrouter_key
+    )
+    answers = parse_batch_verdicts(answer, [i for i, _ in emails]) if answer else {}
+    missing = [(i, text) for i, text in emails if i not in answers]
+    batched = set(answers)
+    metrics.LLM_BATCH_EMAILS.inc(len(emails) - len(missing), outcome="answered")
+    if missing:
+        metrics.LLM_BATCH_EMAILS.inc(len(missing), outcome="retried")
+        logger.warning(
+            "LLM answer covered %d of %d emails, sending the rest one at a time",
+            len(emails) - len(missing),
+            len(emails),
+        )
+    for msg_id, text_md in missing:
+        single = classify_email(prompt, text_md, openrouter_key)
+        if single is not None:
+            answers[msg_id] = single
+    return answers, batched
+
+
+def _learn_statuses(model: NaiveBayes, user_id: str, emails, previous) -> None:
+    examples = []
+    for email in emails:
+        spam = email["status"] == "spam"
+        old = previous.get(email["id"])
+        if old is not None:
+            if old["spam"] == spam:
+                continue
+            model.learn(old["features"], old["spam"], -1)
+        features = email_features(email["subject"], email["sender"])
+        if not features:
+            continue
+        model.learn(features, spam)
+        examples.append(
+            {
+                "id": email["id"],
+                "sender": email["sender"],
+                "spam": spam,
+                "features": features,
+            }
+        )
+    database.save_classifier_examples(user_id, examples)
+
+
+def classifier_trusted(user_id: str) -> bool:
+    """Whether the LLM agrees often enough with the user's local classifier."""
+    checks = database.get_classifier_checks(user_id)
+    if checks["checked"] < CLASSIFIER_MIN_CHECKS:
+        return True
+    return checks["agreed"] / checks["checked"] >= CLASSIFIER_MIN_AGREEMENT
+
+
+def get_classifier(user_id: str) -> NaiveBayes:
+    """Return the user's local spam classifier, loading it on first use.
+
+    The model is rebuilt from its stored examples, then learns any confirmed
+    emails it hasn't seen, such as those confirmed before it existed.
+    """
+    with classifiers_lock:
+        model = classifiers.get(user_id)
+        if model is None:
+            model = NaiveBayes()
+            for example in database.get_classifier_examples(user_id).values():
+                model.learn(example["features"], example["spam"])
+            _learn_statuses(
+                model, user_id, database.get_untrained_confirmed_emails(user_id), {}
+            )
+            classifiers[user_id] = model
+            logger.info("Loaded local classifier: %s", model.stats())
+        return model
+
+
+def train_classifier(user_id: str, email_ids: list[str]) -> None:
+    """Teach the user's classifier the stored status of ``email_ids``.
+
+    Emails it learned with a different status are taken back out first.
+    """
+    if not email_ids:
+        return
+    model = get_classifier(user_id)
+    with classifiers_lock:
+        _learn_statuses(
+            model,
+            user_id,
+            database.get_emails_for_training(user_id, email_ids),
+            database.get_classifier_examples(user_id, email_ids),
+        )
+
+
+def forget_classifier_sender(user_id: str, sender: str) -> None:
+    """Remove a sender's emails from the user's classifier."""
+    model = get_classifier(user_id)
+    with classifiers_lock:
+        for example in database.delete_classifier_examples(user_id, sender):
+            model.learn(example["features"], example["spam"], -1)
+
+
 def fetch_label_senders(
     service,
     user_id,
@@ -445,38 +1425,581 @@ def fetch_label_senders(
         # CODEX: Skip messages already stored in the database
         ids = [i for i in ids if i not in existing_ids]
     update_task(task_id, stage=fetch_stage, progress=0, total=len(ids))
-    if not ids:
-        return
-    details = batch_get_messages(
-        service, ids, fmt="metadata", metadata_headers=["From"]
+    # CODEX: fetch and store senders one chunk at a time so each chunk is
+    # written in a single transaction
+    for start in range(0, len(ids), SENDER_FETCH_BATCH):
+        chunk = ids[start : start + SENDER_FETCH_BATCH]  # noqa: E203
+        details, failed = batch_get_messages(
+            service, chunk, user_id=user_id, fmt="metadata", metadata_headers=["From"]
+        )
+        if failed:
+            # CODEX: unstored messages are fetched again by the next refresh
+            logger.warning("Skipped %d %s messages that failed", len(failed), status)
+        senders = {}
+        statuses = []
+        for msg_id in chunk:
+            md = details.get(msg_id)
+            if not md:
+                continue
+            sender = next(
+                (
+                    h["value"]
+                    for h in md["payload"]["headers"]
+                    if h["name"].lower() == "from"
+                ),
+                "",
+            )
+            senders[sender] = status
+            statuses.append({"id": msg_id, "status": status, "sender": sender})
+        database.save_senders_bulk(user_id, list(senders.items()))
+        database.save_email_statuses_bulk(user_id, statuses, only_if_absent=True)
+        update_task(task_id, progress=start + len(chunk))
+
+
+def store_scan_results(
+    task_id: str, user_id: str, emails: list[dict], cursor: int, unprocessed: int
+) -> None:
+    """Store scanned emails and move the scan's checkpoint past them."""
+    # CODEX: store the whole batch in one transaction
+    database.save_email_statuses_bulk(
+        user_id,
+        [
+            {
+                "id": e["id"],
+                "status": e["status"],
+                "subject": e["subject"],
+                "sender": e["sender"],
+                "date": e["date"],
+            }
+            for e in emails
+        ],
     )
-    for idx, msg_id in enumerate(ids):
-        update_task(task_id, progress=idx + 1)
-        md = details.get(msg_id)
-        if not md:
-            continue
-        sender = next(
-            (
-                h["value"]
-                for h in md["payload"]["headers"]
-                if h["name"].lower() == "from"
-            ),
-            "",
+    add_task_emails(task_id, emails)
+    database.advance_scan_checkpoint(task_id, cursor, unprocessed)
+
+
+def pipeline_moves(stats: dict | None) -> dict:
+    """Return the queued, active and processed counts of each pipeline stage."""
+    return {
+        name: (stage.get("queued"), stage.get("active"), stage.get("processed"))
+        for name, stage in (stats or {}).items()
+    }
+
+
+def run_scan_job(job: dict) -> None:
+    """Scan a user's unread inbox emails from the last ``days`` days."""
+    user_id = job["user_id"]
+    task_id = job["task_id"]
+    prompt = job["payload"]["prompt"]
+    days = job["payload"]["days"]
+    date_after = datetime.datetime.now() - datetime.timedelta(days=days)
+    creds = get_credentials(user_id)
+    if not creds:
+        raise RuntimeError(f"No Gmail credentials for user {user_id}")
+    load_task(task_id, user_id)
+
+    token = user_context.set(user_id)
+    try:
+        # CODEX: rules match on the normalised address or domain, so a
+        # changed display name still hits
+        rules = SenderRules(database.get_sender_rules(user_id))
+        confirmed_ids = set(database.get_confirmed_emails(user_id))
+        service = build("gmail", "v1", credentials=creds)
+        label_ids = get_label_ids(service, user_id)
+        spam_label = label_ids["shopify-spam"]
+        whitelist_label = label_ids["whitelist"]
+        ignore_label = label_ids["spam-filter-ignore"]
+        # CODEX: sender lists are fetched separately so skip downloading them here
+        update_task(task_id, stage="fetching")
+
+        existing_unconfirmed = database.get_unconfirmed_emails(user_id, date_after)
+        # CODEX: avoid adding the same email twice if status polling ran before the worker
+        task_info = tasks.get(task_id, {})
+        known_ids = {e["id"] for e in task_info.get("emails", [])}
+        fresh = [e for e in existing_unconfirmed if e["id"] not in known_ids]
+        add_task_emails(task_id, fresh)
+        skip_ids = set(e["id"] for e in task_info.get("emails", [])).union(
+            confirmed_ids
         )
-        database.save_sender(user_id, sender, status)
-        database.save_email_status_if_absent(
-            user_id,
-            msg_id,
-            status,
-            confirmed=False,
-            sender=sender,
+        update_task(
+            task_id,
+            progress=len(existing_unconfirmed),
+        )
+
+        checkpoint = database.load_scan_checkpoint(task_id)
+        if checkpoint:
+            # CODEX: an interrupted scan continues from its checkpoint without
+            # listing again or fetching messages whose results are stored
+            history_id = checkpoint["history_id"]
+            synced_after = checkpoint["synced_after"]
+            offset = checkpoint["cursor"]
+            unprocessed = checkpoint["unprocessed"]
+            for flush in checkpoint["pending"]:
+                labels = LabelBatcher(service, user_id)
+                labels.restore(flush["labels"])
+                failed = labels.flush()
+                offset = flush["cursor"]
+                unprocessed = flush["unprocessed"] + len(failed)
+                store_scan_results(
+                    task_id,
+                    user_id,
+                    [e for e in flush["emails"] if e["id"] not in failed],
+                    offset,
+                    unprocessed,
+                )
+            messages = [{"id": i} for i in checkpoint["message_ids"][offset:]]
+            logger.info(
+                "Resuming scan task %s at message %d of %d",
+                task_id,
+                offset,
+                len(checkpoint["message_ids"]),
+            )
+        else:
+            query = f"after:{date_after.strftime('%Y-%m-%d')} in:inbox is:unread label:inbox"
+
+            # CODEX: only list messages added since the last scan when possible
+            messages, history_id, synced_after = list_new_messages(
+                service, user_id, date_after, query
+            )
+            messages = [m for m in messages if m["id"] not in skip_ids]
+            offset = 0
+            unprocessed = 0
+            database.save_scan_checkpoint(
+                task_id,
+                user_id,
+                prompt,
+                days,
+                [m["id"] for m in messages],
+                history_id,
+                synced_after,
+            )
+
+        update_task(task_id, total=len(messages) + len(existing_unconfirmed))
+        logger.info(
+            "messages length is currently %d ",
+            tasks.get(task_id, {}).get("total", 0),
         )
+        openrouter_key = get_openrouter_key()
+        model = get_classifier(user_id)
+        use_model = model.ready(CLASSIFIER_MIN_EXAMPLES)
+        trusted = None
+        trusted_lock = threading.Lock()
+
+        # CODEX: run the scan as a pipeline so Gmail fetches, body
+        # extraction and LLM requests overlap. Labels are applied in
+        # message order by a single worker.
+        local = threading.local()
+
+        def gmail():
+            # googleapiclient services aren't thread safe
+            if not hasattr(local, "service"):
+                local.service = build("gmail", "v1", credentials=creds)
+            return local.service
+
+        def list_batches():
+            for start in range(0, len(messages), SCAN_FETCH_BATCH):
+                end = start + SCAN_FETCH_BATCH
+                yield {"seq": start, "msgs": messages[start:end]}
+
+        def check_classifier():
+            """Follow the classifier's agreement with the LLM as checks come in."""
+            nonlocal trusted
+            now_trusted = classifier_trusted(user_id)
+            # fetch workers run this concurrently; one of them reports a change
+            with trusted_lock:
+                if now_trusted == trusted:
+                    return
+                trusted = now_trusted
+            record_local_classifier(task_id, enabled=now_trusted)
+            if not now_trusted:
+                logger.warning(
+                    "Local classifier agrees too rarely with the LLM, checking "
+                    "all of its verdicts"
+                )
+
+        def fetch(batch, emit):
+            if use_model:
+                check_classifier()
+            ids = [m["id"] for m in batch["msgs"]]
+            # CODEX: headers and labels settle rule matches, so only
+            # download full bodies for emails the LLM reads
+            msg_meta, failed = batch_get_messages(
+                gmail(),
+                ids,
+                user_id=user_id,
+                fmt="metadata",
+                metadata_headers=SCAN_METADATA_HEADERS,
+            )
+            update_task(task_id, stage="processing")
+            items = []
+            needs_body = []
+            skipped_bytes = 0
+            settled = uncertain = shadowed = 0
+            rule_hits = dict.fromkeys(RULE_KINDS, 0)
+            for offset, msg in enumerate(batch["msgs"]):
+                item = {"seq": batch["seq"] + offset, "msg": msg, "status": None}
+                items.append(item)
+                meta = msg_meta.get(msg["id"])
+                if not meta:
+                    if msg["id"] not in failed:
+                        logger.error("No details returned for %s", msg["id"])
+                    item["missing"] = True
+                    continue
+                label_ids = meta.get("labelIds", [])
+                item["subject"] = message_header(meta, "Subject")
+                item["sender"] = sender = message_header(meta, "From")
+                item["date"] = message_header(meta, "Date")
+                rule = rules.match(sender)
+                rule_status = None
+                if rule is not None:
+                    rule_status, kind = rule
+                    rule_hits[kind] += 1
+                if (
+                    msg["id"] in confirmed_ids
+                    or rule_status == "spam"
+                    or spam_label in label_ids
+                ):
+                    item["status"] = "spam"
+                elif ignore_label in label_ids or rule_status == "ignore":
+                    item["status"] = "ignore"
+                elif whitelist_label in label_ids or rule_status == "whitelist":
+                    item["status"] = "whitelist"
+                elif use_model:
+                    # CODEX: the local classifier reads headers only, so
+                    # emails it is sure about need no body or LLM request
+                    p = model.spam_probability(email_features(item["subject"], sender))
+                    guess = None
+                    if p >= CLASSIFIER_CONFIDENCE:
+                        guess = "spam"
+                    elif p <= 1 - CLASSIFIER_CONFIDENCE:
+                        guess = "not_spam"
+                    if guess is None:
+                        uncertain += 1
+                    elif not openrouter_key or (
+                        trusted and random.random() >= CLASSIFIER_SHADOW_RATE
+                    ):
+                        item["status"] = guess
+                        item["local"] = True
+                        settled += 1
+                    else:
+                        # CODEX: checked against the LLM, which decides it
+                        item["shadow"] = guess
+                        shadowed += 1
+                if item["status"] is None:
+                    if openrouter_key:
+                        needs_body.append(msg["id"])
+                    else:
+                        item["status"] = "not_spam"
+                if item["status"] is not None:
+                    skipped_bytes += meta.get("sizeEstimate", 0)
+            record_fetch_savings(
+                task_id, len(msg_meta) - len(needs_body), skipped_bytes
+            )
+            if settled or uncertain or shadowed:
+                record_local_classifier(
+                    task_id, settled=settled, uncertain=uncertain, shadowed=shadowed
+                )
+            record_sender_rule_hits(task_id, len(msg_meta), rule_hits)
+            msg_details = (
+                batch_get_messages(gmail(), needs_body, user_id=user_id)[0]
+                if needs_body
+                else {}
+            )
+            for item in items:
+                if item["status"] is None and not item.get("missing"):
+                    item["payload"] = msg_details.get(item["msg"]["id"], {}).get(
+                        "payload"
+                    )
+            # CODEX: items stay together until classify so the emails of a
+            # fetch batch can share LLM requests
+            emit(items)
+
+        def extract(items, emit):
+            for item in items:
+                if item["status"] is not None or item.get("missing"):
+                    continue
+                if item["payload"] is None:
+                    logger.error("No body returned for %s", item["msg"]["id"])
+                    item["missing"] = True
+                    continue
+                body, _ = extract_email_body(
+                    item.pop("payload"), max_words=BODY_PREVIEW_WORDS
+                )
+                item["text_md"] = (
+                    f"Subject: {item['subject']}\nFrom: {item['sender']}" f"\n\n{body}"
+                )
+                # CODEX: reuse verdicts for identical emails and prompts
+                item["cached"] = database.get_cached_verdict(
+                    llm_cache_key(prompt, item["text_md"]), LLM_CACHE_TTL
+                )
+                if item["cached"] is None and LLM_BATCH_MAX_EMAILS > 1:
+                    item["cached"] = database.get_cached_verdict(
+                        llm_cache_key(prompt, item["text_md"], batched=True),
+                        LLM_CACHE_TTL,
+                    )
+                record_llm_cache_lookup(task_id, hit=item["cached"] is not None)
+            emit(items)
+
+        def classify(items, emit):
+            pending = {
+                item["msg"]["id"]: item
+                for item in items
+                if "text_md" in item and item["cached"] is None
+            }
+            for group in pack_llm_batches(
+                [(msg_id, item["text_md"]) for msg_id, item in pending.items()],
+                prompt,
+            ):
+                answers, batched = classify_emails(prompt, group, openrouter_key)
+                for msg_id, _ in group:
+                    item = pending[msg_id]
+                    answer = answers.get(msg_id)
+                    if answer is None:
+                        # CODEX: left for the next scan rather than guessed
+                        item["missing"] = True
+                        continue
+                    status = verdict_status(answer)
+                    item["verdict"] = {"answer": answer, "status": status}
+                    key = llm_cache_key(prompt, item["text_md"], msg_id in batched)
+                    database.save_cached_verdict(key, answer, status)
+            for item in items:
+                emit(item)
+
+        applied = []
+
+        last_seq = -1
+
+        def apply(item, emit):
+            nonlocal unprocessed, last_seq
+            msg = item["msg"]
+            last_seq = item["seq"]
+            if item.get("missing"):
+                unprocessed += 1
+                return
+            if not hasattr(local, "labels"):
+                local.labels = LabelBatcher(gmail(), user_id)
+            status = item["status"] or "not_spam"
+            text_md = item.get("text_md", "")
+            verdict = item.get("cached") or item.get("verdict")
+            llm_sent = verdict is not None
+            answer = None
+            if llm_sent:
+                answer = verdict["answer"]
+                status = verdict["status"]
+                add_task_log(
+                    task_id,
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": text_md},
+                    {"role": "assistant", "content": answer},
+                )
+
+            logger.debug("Email %s classified as %s", msg["id"], status)
+            if item.get("cached"):
+                source = "cache"
+            elif llm_sent:
+                source = "llm"
+            elif item.get("local"):
+                source = "local"
+            else:
+                source = "rule"
+            if llm_sent and "shadow" in item:
+                agreed = (item["shadow"] == "spam") == (status == "spam")
+                metrics.LOCAL_CLASSIFIER_COMPARISONS.inc(agreed=str(agreed).lower())
+                record_local_classifier(task_id, compared=1, agreed=int(agreed))
+                database.record_classifier_check(
+                    user_id, agreed, CLASSIFIER_CHECK_WINDOW
+                )
+            metrics.CLASSIFICATIONS.inc(status=status, source=source)
+
+            if status == "spam":
+                local.labels.add(msg["id"], [spam_label], [whitelist_label])
+            elif status == "whitelist":
+                local.labels.add(msg["id"], [whitelist_label], [spam_label])
+            elif status == "ignore":
+                local.labels.add(
+                    msg["id"],
+                    [ignore_label],
+                    [spam_label, whitelist_label],
+                )
+
+            applied.append(
+                {
+                    "id": msg["id"],
+                    "subject": item["subject"],
+                    "sender": item["sender"],
+                    "date": item["date"],
+                    "status": status,
+                    "request": text_md if llm_sent else "",
+                    "response": answer if llm_sent else "",
+                    "llm_sent": llm_sent,
+                    "cached": bool(item.get("cached")),
+                    "local": bool(item.get("local")),
+                }
+            )
+            if len(applied) >= SCAN_FETCH_BATCH:
+                flush_labels(emit)
+
+        def flush_labels(emit):
+            nonlocal unprocessed
+            if not applied:
+                return
+            # CODEX: only report emails once their labels are applied;
+            # failed ones are left for the next scan. The changes are
+            # recorded first so a resumed scan can send them again.
+            cursor = offset + last_seq + 1
+            database.save_pending_label_flush(
+                task_id,
+                cursor,
+                {
+                    "cursor": cursor,
+                    "labels": local.labels.changes(),
+                    "emails": applied,
+                    "unprocessed": unprocessed,
+                },
+            )
+            failed = local.labels.flush()
+            unprocessed += len(failed)
+            emit(
+                {
+                    "emails": [e for e in applied if e["id"] not in failed],
+                    "cursor": cursor,
+                    "unprocessed": unprocessed,
+                }
+            )
+            applied.clear()
+
+        persisted = 0
+
+        def persist(batch, emit):
+            nonlocal persisted
+            store_scan_results(
+                task_id,
+                user_id,
+                batch["emails"],
+                batch["cursor"],
+                batch["unprocessed"],
+            )
+            persisted += len(batch["emails"])
+            publish_stats()
+            update_task(task_id, progress=len(existing_unconfirmed) + persisted)
+
+        def publish_stats():
+            stats = scan.stats()
+            with tasks_lock:
+                info = tasks.get(task_id)
+                # CODEX: rates and busy time drift every tick, so only new
+                # work moving through the stages makes a new task version
+                if info is not None and pipeline_moves(
+                    info.get("pipeline")
+                ) != pipeline_moves(stats):
+                    info["pipeline"] = stats
+                    bump_task_version(info)
+
+        scan = Pipeline("list")
+        scan.add_stage(
+            "fetch",
+            fetch,
+            workers=SCAN_FETCH_WORKERS,
+            queue_size=SCAN_FETCH_WORKERS,
+        )
+        # fetch batches travel whole until classify, so queue fewer of them
+        batch_queue_size = max(1, SCAN_QUEUE_SIZE // SCAN_FETCH_BATCH)
+        scan.add_stage(
+            "extract",
+            extract,
+            workers=SCAN_EXTRACT_WORKERS,
+            queue_size=batch_queue_size,
+        )
+        scan.add_stage(
+            "classify",
+            classify,
+            workers=LLM_CONCURRENCY,
+            queue_size=batch_queue_size,
+        )
+        scan.add_stage(
+            "apply",
+            apply,
+            queue_size=SCAN_QUEUE_SIZE,
+            ordered=True,
+            finish=flush_labels,
+        )
+        scan.add_stage("persist", persist, queue_size=SCAN_QUEUE_SIZE)
+        scan.run(list_batches(), on_tick=publish_stats)
+        publish_stats()
+
+        if unprocessed:
+            # CODEX: keep the previous history id so skipped messages are
+            # listed again by the next scan
+            logger.warning(
+                "%d messages were not processed, sync state not advanced",
+                unprocessed,
+            )
+        else:
+            database.save_sync_state(user_id, history_id, synced_after)
+        database.delete_scan_checkpoint(task_id)
+        # CODEX: trimmed once per scan rather than counted on every insert
+        trimmed = database.trim_llm_cache(LLM_CACHE_MAX_ENTRIES)
+        if trimmed:
+            logger.info("Evicted %d least recently used LLM verdicts", trimmed)
+        cache = tasks.get(task_id, {}).get("llm_cache")
+        if cache:
+            logger.info(
+                "LLM verdict cache: %d hits, %d misses",
+                cache["hits"],
+                cache["misses"],
+            )
+        rule_stats = tasks.get(task_id, {}).get("sender_rules")
+        if rule_stats:
+            logger.info(
+                "Sender rules matched %d of %d emails (%s)",
+                rule_stats["hits"],
+                rule_stats["checked"],
+                ", ".join(f"{k}: {v}" for k, v in rule_stats["by_kind"].items()),
+            )
+        local_stats = tasks.get(task_id, {}).get("local_classifier")
+        if local_stats:
+            logger.info(
+                "Local classifier settled %d emails (skip rate %.1f%%), "
+                "the LLM agreed with %d of %d checked verdicts",
+                local_stats["settled"],
+                local_stats["skip_rate"] * 100,
+                local_stats["agreed"],
+                local_stats["compared"],
+            )
+        savings = tasks.get(task_id, {}).get("fetch_savings")
+        if savings:
+            logger.info(
+                "Metadata pass avoided %d full fetches (~%d bytes)",
+                savings["full_fetches_avoided"],
+                savings["bytes_avoided"],
+            )
+        update_task(
+            task_id,
+            stage="done",
+            progress=tasks.get(task_id, {}).get("total", 0),
+        )
+    except Exception:
+        import traceback
+
+        logger.error(
+            "Exception occurred during scan task: %s - %s",
+            task_id,
+            traceback.format_exc(),
+            exc_info=True,
+        )
+
+        print(traceback.format_exc())
+        update_task(task_id, stage="failed")
+        raise
+    finally:
+        task_summaries[task_id] = {"message": "Scan completed"}
+        user_context.reset(token)
 
 
 @app.route("/scan-emails", methods=["POST"])
 def scan_emails():
-    """Start a background scan task and return its id"""
-    creds = get_credentials()
+    """Queue a background scan task and return its id"""
+    creds = get_credentials(g.user_id)
     if not creds:
         return jsonify({"error": "Not authenticated"}), 401
 
@@ -485,20 +2008,9 @@ def scan_emails():
     # CODEX: Save the prompt for future sessions
     save_last_prompt(prompt)
     days = int(data.get("days", 3))  # CODEX: scan 3 days by default
-    date_after = datetime.datetime.now() - datetime.timedelta(days=days)
 
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {
-        "id": task_id,
-        "user_id": g.user_id,
-        "stage": "queued",
-        "progress": 0,
-        "total": 0,
-        "emails": [],
-        "log": [],
-        "kind": "scan",
-    }
-    database.save_task(
+    register_task(
         {
             "id": task_id,
             "user_id": g.user_id,
@@ -508,277 +2020,96 @@ def scan_emails():
             "emails": [],
             "log": [],
             "kind": "scan",
+            "created": time.time(),
         }
     )
-    logger.info("Starting scan task %s for last %s days", task_id, days)
-
-    user_id = g.user_id
-
-    def worker():
-        token = user_context.set(user_id)
-        try:
-            whitelist = set(database.get_senders(user_id, "whitelist"))
-            ignorelist = set(database.get_senders(user_id, "ignore"))
-            spamlist = set(database.get_senders(user_id, "spam"))
-            confirmed_ids = set(database.get_confirmed_emails(user_id))
-            service = build("gmail", "v1", credentials=creds)
-            spam_label = get_label_id(service, "shopify-spam")
-            whitelist_label = get_label_id(service, "whitelist")
-            ignore_label = get_label_id(service, "spam-filter-ignore")
-            # CODEX: sender lists are fetched separately so skip downloading them here
-            update_task(task_id, stage="fetching")
-
-            existing_unconfirmed = database.get_unconfirmed_emails(user_id, date_after)
-            # CODEX: avoid adding the same email twice if status polling ran before the worker
-            task_info = tasks.get(task_id, {})
-            known_ids = {e["id"] for e in task_info.get("emails", [])}
-            fresh = [e for e in existing_unconfirmed if e["id"] not in known_ids]
-            if task_id in tasks:
-                tasks[task_id]["emails"].extend(fresh)
-            skip_ids = set(e["id"] for e in task_info.get("emails", [])).union(
-                confirmed_ids
-            )
-            update_task(
-                task_id,
-                progress=len(existing_unconfirmed),
-            )
-
-            query = f"after:{date_after.strftime('%Y-%m-%d')} in:inbox is:unread label:inbox"
-
-            messages = list_all_messages(service, q=query)
-            messages = [m for m in messages if m["id"] not in skip_ids]
-
-            update_task(task_id, total=len(messages) + len(existing_unconfirmed))
-            logger.info(
-                "messages length is currently %d ",
-                tasks.get(task_id, {}).get("total", 0),
-            )
-            openrouter_key = os.environ.get("OPENROUTER_API_KEY", "")
-            if not openrouter_key and os.path.exists(OPENROUTER_KEY_FILE):
-                with open(OPENROUTER_KEY_FILE) as f:
-                    openrouter_key = f.read().strip()
-
-            # CODEX: Fetch and process messages in batches to minimize waiting
-            BATCH_SIZE = 25
-            for start in range(0, len(messages), BATCH_SIZE):
-                msg_batch = messages[start : start + BATCH_SIZE]  # noqa: E203
-                ids = [m["id"] for m in msg_batch]
-                msg_details = batch_get_messages(
-                    service,
-                    ids,
-                    fmt="full",
-                )
+    database.save_task(tasks[task_id])
+    logger.info("Queueing scan task %s for last %s days", task_id, days)
+    return enqueue_task_job(task_id, "scan", {"prompt": prompt, "days": days})
 
-                for offset, msg in enumerate(msg_batch):
-                    idx = start + offset
-                    update_task(
-                        task_id,
-                        stage="processing",
-                        progress=len(existing_unconfirmed) + idx,
-                    )
-                    msg_detail = msg_details.get(msg["id"])
-                    if not msg_detail:
-                        logger.error("No details returned for %s", msg["id"])
-                        continue
-                    payload = msg_detail.get("payload", {})
-                    headers = payload.get("headers", [])
-                    subject = next(
-                        (h["value"] for h in headers if h["name"].lower() == "subject"),
-                        "",
-                    )
-                    sender = next(
-                        (h["value"] for h in headers if h["name"].lower() == "from"),
-                        "",
-                    )
-                    date = next(
-                        (h["value"] for h in headers if h["name"].lower() == "date"),
-                        "",
-                    )
-                    label_ids = msg_detail.get("labelIds", [])
-
-                    body, _ = extract_email_body(payload)
-                    words = body.split()
-                    body_preview = " ".join(words[:500])
-                    text_md = f"Subject: {subject}\nFrom: {sender}\n\n{body_preview}"
-
-                    status = "not_spam"
-                    llm_sent = False
-                    answer = ""
-                    if (
-                        msg["id"] in confirmed_ids
-                        or sender in spamlist
-                        or spam_label in label_ids
-                    ):
-                        status = "spam"
-                    elif ignore_label in label_ids or sender in ignorelist:
-                        status = "ignore"
-                    elif whitelist_label in label_ids or sender in whitelist:
-                        status = "whitelist"
-                    else:
-                        if openrouter_key:
-                            data = {
-                                "model": "deepseek/deepseek-chat-v3-0324:free",
-                                "messages": [
-                                    {
-                                        "role": "system",
-                                        "content": (
-                                            prompt
-                                            + (
-                                                " Start your response with "
-                                                "<RESULT>YES</RESULT> or "
-                                                "<RESULT>NO</RESULT> followed by "
-                                                "the justification for "
-                                                "your answer."
-                                            )
-                                        ),
-                                    },
-                                    {"role": "user", "content": text_md},
-                                ],
-                            }
-                            headers_req = {"Authorization": f"Bearer {openrouter_key}"}
-                            try:
-                                logger.debug("OpenRouter request: %s", data)
-                                start_time = time.time()
-                                resp = requests.post(
-                                    "https://openrouter.ai/api/v1/" "chat/completions",
-                                    json=data,
-                                    headers=headers_req,
-                                )
-                                logger.debug(
-                                    "OpenRouter response %s: %s",
-                                    resp.status_code,
-                                    resp.text,
-                                )
-                                logger.info(
-                                    "OpenRouter response %s received %d characters after %.2f seconds",
-                                    resp.status_code,
-                                    len(resp.text),
-                                    time.time() - start_time,
-                                )
-                                if resp.status_code == 200:
-                                    answer = resp.json()["choices"][0]["message"][
-                                        "content"
-                                    ]
-                                    if task_id in tasks:
-                                        tasks[task_id]["log"].append(
-                                            {"role": "system", "content": prompt}
-                                        )
-                                        tasks[task_id]["log"].append(
-                                            {"role": "user", "content": text_md}
-                                        )
-                                        tasks[task_id]["log"].append(
-                                            {
-                                                "role": "assistant",
-                                                "content": answer,
-                                            }
-                                        )
-                                    if "yes" in answer.lower():
-                                        status = "spam"
-                                    llm_sent = True
-                                else:
-                                    logger.error(
-                                        "OpenRouter error: %s - %s",
-                                        resp.status_code,
-                                        resp.text,
-                                    )
-                            except Exception:
-                                pass
-
-                    logger.debug("Email %s classified as %s", msg["id"], status)
-
-                    if status == "spam":
-                        logger.debug("Gmail request: add spam label to %s", msg["id"])
-                        service.users().messages().modify(
-                            userId="me",
-                            id=msg["id"],
-                            body={
-                                "addLabelIds": [spam_label],
-                                "removeLabelIds": [whitelist_label],
-                            },
-                        ).execute()
-                    elif status == "whitelist":
-                        logger.debug(
-                            "Gmail request: add whitelist label to %s",
-                            msg["id"],
-                        )
-                        service.users().messages().modify(
-                            userId="me",
-                            id=msg["id"],
-                            body={
-                                "addLabelIds": [whitelist_label],
-                                "removeLabelIds": [spam_label],
-                            },
-                        ).execute()
-                    elif status == "ignore":
-                        logger.debug("Gmail request: add ignore label to %s", msg["id"])
-                        service.users().messages().modify(
-                            userId="me",
-                            id=msg["id"],
-                            body={
-                                "addLabelIds": [ignore_label],
-                                "removeLabelIds": [
-                                    spam_label,
-                                    whitelist_label,
-                                ],
-                            },
-                        ).execute()
-
-                    if task_id in tasks:
-                        tasks[task_id]["emails"].append(
-                            {
-                                "id": msg["id"],
-                                "subject": subject,
-                                "sender": sender,
-                                "date": date,
-                                "status": status,
-                                "request": text_md if llm_sent else "",
-                                "response": answer if llm_sent else "",
-                                "llm_sent": llm_sent,
-                            }
-                        )
-                    database.save_email_status(
-                        user_id,
-                        msg["id"],
-                        status,
-                        subject=subject,
-                        sender=sender,
-                        date=date,
-                    )
-                    if task_id in tasks:
-                        database.save_task(tasks[task_id])
 
-            update_task(
-                task_id,
-                stage="done",
-                progress=tasks.get(task_id, {}).get("total", 0),
-            )
-        except Exception:
-            import traceback
+def sync_task_emails(task_id: str, user_id: str) -> None:
+    """Merge unconfirmed emails from earlier scans into a task once.
 
-            logger.error(
-                "Exception occurred during scan task: %s - %s",
-                task_id,
-                traceback.format_exc(),
-                exc_info=True,
-            )
+    Later changes reach the task through the workers and endpoints, so status
+    polls don't need to reload every unconfirmed email.
+    """
+    if task_id in task_synced:
+        return
+    existing = database.get_unconfirmed_emails(user_id, datetime.datetime(1970, 1, 1))
+    with tasks_lock:
+        info = tasks.get(task_id)
+        if not info:
+            return
+        # CODEX: remove any accidental duplicates in the task email list
+        unique = {}
+        for email in info["emails"]:
+            unique[email["id"]] = email
+        info["emails"] = list(unique.values())
+        # CODEX: statuses may have changed while the task was out of memory
+        for email in existing:
+            known = unique.get(email["id"])
+            if known is not None and known.get("status") != email.get("status"):
+                known["status"] = email["status"]
+                known["version"] = bump_task_version(info)
+        # CODEX: drop any emails that have been confirmed already
+        unconfirmed_ids = {e["id"] for e in existing}
+        remove_task_emails(task_id, [i for i in unique if i not in unconfirmed_ids])
+        add_task_emails(
+            task_id, [e for e in existing if e["id"] not in unique], persist=False
+        )
+        task_synced.add(task_id)
 
-            print(traceback.format_exc())
-        finally:
-            task_summaries[task_id] = {"message": "Scan completed"}
-            user_context.reset(token)
 
-    threading.Thread(target=worker).start()
-    return jsonify({"task_id": task_id})
+def _email_dt(email):
+    try:
+        dt = parsedate_to_datetime(email["date"])
+        if dt.tzinfo:
+            dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return dt
+    except Exception:
+        return datetime.datetime.min
+
+
+def is_resumable(task: dict) -> bool:
+    """Whether a task failed and left a scan checkpoint to resume from."""
+    return task.get("stage") == "failed" and database.has_scan_checkpoint(task["id"])
+
+
+def task_snapshot(task: dict, since: int | None = None) -> dict:
+    """Return a task for JSON responses.
+
+    With ``since`` only emails changed after that version are included, along
+    with the ids of removed emails, and the LLM log is left out.
+    """
+    with tasks_lock:
+        data = {k: v for k, v in task.items() if k != "emails"}
+        # CODEX: interrupted scans keep a checkpoint and can be resumed
+        data["resumable"] = task.get("resumable", False)
+        if since is None:
+            # CODEX: Sort emails by date so reused entries are merged in order
+            data["emails"] = sorted(task["emails"], key=_email_dt, reverse=True)
+            return data
+        data.pop("log", None)
+        data["delta"] = True
+        data["since"] = since
+        data["emails"] = [e for e in task["emails"] if e.get("version", 0) > since]
+        data["removed"] = [
+            email_id
+            for email_id, version in task_removed.get(task["id"], {}).items()
+            if version > since
+        ]
+        return data
 
 
 @app.route("/scan-status/<task_id>")
 def scan_status(task_id):
-    task = tasks.get(task_id)
-    if not task:
-        db_tasks = {t["id"]: t for t in database.load_tasks(g.user_id)}
-        task = db_tasks.get(task_id)
-        if task:
-            tasks[task_id] = task
+    """Return task progress and emails.
+
+    Pass ``since=<version>`` to get only emails changed after that version.
+    Responses carry an ETag so unchanged tasks can be answered with 304.
+    """
+    task = load_task(task_id, g.user_id)
     if not task:
         summary = task_summaries.pop(task_id, None)
         if summary:
@@ -788,37 +2119,104 @@ def scan_status(task_id):
     # already part of this task. This ensures emails from previous scans are
     # still visible even when the current scan only fetches new messages.
     try:
-        existing = database.get_unconfirmed_emails(
-            g.user_id, datetime.datetime(1970, 1, 1)
-        )
-        known = {e["id"] for e in task.get("emails", [])}
-        for email in existing:
-            if email["id"] not in known:
-                task.setdefault("emails", []).append(email)
-        # CODEX: remove any accidental duplicates in the task email list
-        unique = {}
-        for email in task.get("emails", []):
-            unique[email["id"]] = email
-        task["emails"] = list(unique.values())
-        # CODEX: drop any emails that have been confirmed already
-        unconfirmed_ids = {e["id"] for e in existing}
-        task["emails"] = [e for e in task["emails"] if e["id"] in unconfirmed_ids]
-        tasks[task_id]["emails"] = task["emails"]
+        sync_task_emails(task_id, g.user_id)
+    except Exception:
+        logger.error("Failed to load extra unconfirmed emails", exc_info=True)
 
-        # CODEX: Sort emails by date so reused entries are merged in order
-        def _email_dt(email):
-            try:
-                dt = parsedate_to_datetime(email["date"])
-                if dt.tzinfo:
-                    dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
-                return dt
-            except Exception:
-                return datetime.datetime.min
-
-        task["emails"] = sorted(task.get("emails", []), key=_email_dt, reverse=True)
+    etag = f"{task_id}-{task['version']}"
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+    since = request.args.get("since", type=int)
+    if since is not None and since > task["version"]:
+        # the client's version is from before a restart so send everything
+        since = None
+    resp = jsonify(task_snapshot(task, since))
+    resp.set_etag(etag)
+    return resp
+
+
+def sse_event(event: str, data, event_id: int | None = None) -> str:
+    """Format one Server-Sent Events message."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@app.route("/tasks/<task_id>/events")
+def task_event_stream(task_id):
+    """Stream task progress, email changes and log lines as Server-Sent Events.
+
+    The first event is a full ``snapshot`` unless the client resumes with a
+    ``Last-Event-ID`` header, in which case it gets a ``delta`` since that
+    version. Event ids are task versions. A comment is sent every
+    ``SSE_HEARTBEAT`` seconds while nothing changes.
+    """
+    user_id = g.user_id
+    task = load_task(task_id, user_id)
+    if not task:
+        summary = task_summaries.pop(task_id, None)
+        if summary:
+            return Response(
+                sse_event("closed", {"stage": "closed", "summary": summary}),
+                mimetype="text/event-stream",
+            )
+        return jsonify({"error": "not found"}), 404
+    try:
+        sync_task_emails(task_id, user_id)
     except Exception:
         logger.error("Failed to load extra unconfirmed emails", exc_info=True)
-    return jsonify(task)
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+
+    def stream():
+        since = last_event_id
+        if since is not None and since > task["version"]:
+            since = None
+        with task_events:
+            log_count = user_log_counts.get(user_id, 0)
+        while True:
+            # an evicted task is loaded again, a forgotten one has closed
+            info = load_task(task_id, user_id)
+            if info is None:
+                summary = task_summaries.pop(task_id, None) or {}
+                yield sse_event("closed", {"stage": "closed", "summary": summary})
+                return
+            if since is None or info["version"] > since:
+                data = task_snapshot(info, since)
+                yield sse_event(
+                    "delta" if since is not None else "snapshot",
+                    data,
+                    data["version"],
+                )
+                since = data["version"]
+            with task_events:
+                new_logs = user_log_counts.get(user_id, 0) - log_count
+                log_count += new_logs
+            # the count restarts if the user's log buffer was evicted
+            if new_logs > 0:
+                lines = user_logs.get(user_id, [])[-new_logs:]
+                lines = filter_log_lines(lines)
+                if lines:
+                    yield sse_event("log", {"lines": lines})
+            # a task forgotten or evicted meanwhile gets a new version too,
+            # so the store needn't be consulted while holding task_events
+            with task_events:
+                changed = task_events.wait_for(
+                    lambda: info["version"] > since
+                    or user_log_counts.get(user_id, 0) != log_count,
+                    timeout=SSE_HEARTBEAT,
+                )
+            if not changed:
+                yield ": heartbeat\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # CODEX: Endpoint to list active scan tasks
@@ -830,110 +2228,141 @@ def scan_tasks():
         for info in tasks.values()
         if info.get("user_id") == g.user_id and info.get("stage") != "closed"
     ]
-    if active:
-        return jsonify({"tasks": [active[-1]]})
+    # CODEX: the task store is in least recently used order, so pick the
+    # newest task by when it was created; tasks loaded back from an older
+    # run without that time count as oldest
+    task = (
+        max(active, key=lambda t: t.get("created", 0))
+        if active
+        else database.load_latest_task(g.user_id)
+    )
+    if not task:
+        return jsonify({"tasks": []})
+    if not active:
+        register_task(task)
+    return jsonify({"tasks": [task_snapshot(task)]})
+
+
+@app.route("/resume-scan", methods=["POST"])
+def resume_scan():
+    """Queue an interrupted scan again to continue from its checkpoint."""
+    creds = get_credentials(g.user_id)
+    if not creds:
+        return jsonify({"error": "Not authenticated"}), 401
+    task_id = (request.get_json() or {}).get("task_id")
+    task = load_task(task_id, g.user_id) if task_id else None
+    if not task or task.get("user_id") != g.user_id:
+        return jsonify({"error": "not found"}), 404
+    checkpoint = database.load_scan_checkpoint(task_id)
+    if task.get("stage") != "failed" or not checkpoint:
+        return jsonify({"error": "task can't be resumed"}), 409
+    update_task(task_id, stage="queued")
+    logger.info("Resuming scan task %s", task_id)
+    job_queue.enqueue(
+        g.user_id,
+        "scan",
+        {"prompt": checkpoint["prompt"], "days": checkpoint["days"], "resume": task_id},
+        task_id,
+    )
+    return jsonify({"task_id": task_id})
 
-    db_task = database.load_latest_task(g.user_id)
-    if db_task:
-        tasks[db_task["id"]] = db_task
-        return jsonify({"tasks": [db_task]})
-    return jsonify({"tasks": []})
+
+def run_refresh_job(job: dict) -> None:
+    """Fetch a user's whitelist, ignore and spam senders from Gmail labels."""
+    user_id = job["user_id"]
+    task_id = job["task_id"]
+    creds = get_credentials(user_id)
+    if not creds:
+        raise RuntimeError(f"No Gmail credentials for user {user_id}")
+    load_task(task_id, user_id)
+
+    token = user_context.set(user_id)
+    try:
+        service = build("gmail", "v1", credentials=creds)
+        existing = set(database.get_all_email_ids(user_id))
+        fetch_label_senders(
+            service,
+            user_id,
+            "label:whitelist",
+            "whitelist",
+            task_id,
+            "listing whitelist emails",
+            "fetching whitelist emails",
+            existing,
+        )
+        fetch_label_senders(
+            service,
+            user_id,
+            "label:spam-filter-ignore",
+            "ignore",
+            task_id,
+            "listing ignore emails",
+            "fetching ignore emails",
+            existing,
+        )
+        fetch_label_senders(
+            service,
+            user_id,
+            "label:shopify-spam",
+            "spam",
+            task_id,
+            "listing spam emails",
+            "fetching spam emails",
+            existing,
+        )
+    except Exception:
+        import traceback
+
+        logger.error(traceback.format_exc())
+        raise
+    finally:
+        update_task(task_id, stage="closed")
+        forget_task(task_id)
+        task_summaries[task_id] = {"message": "Refresh completed"}
+        user_context.reset(token)
 
 
 @app.route("/refresh-senders", methods=["POST"])
 def refresh_senders():
-    """Fetch whitelist, ignore and spam senders in a background task."""
-    creds = get_credentials()
+    """Queue a background task fetching whitelist, ignore and spam senders."""
+    creds = get_credentials(g.user_id)
     if not creds:
         return jsonify({"error": "Not authenticated"}), 401
 
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {
-        "id": task_id,
-        "user_id": g.user_id,
-        "stage": "queued",
-        "progress": 0,
-        "total": 0,
-        "emails": [],
-        "log": [],
-        "kind": "refresh",
-    }
+    register_task(
+        {
+            "id": task_id,
+            "user_id": g.user_id,
+            "stage": "queued",
+            "progress": 0,
+            "total": 0,
+            "emails": [],
+            "log": [],
+            "kind": "refresh",
+            "created": time.time(),
+        }
+    )
     database.save_task(tasks[task_id])
-
-    user_id = g.user_id
-
-    def worker():
-        token = user_context.set(user_id)
-        try:
-            service = build("gmail", "v1", credentials=creds)
-            existing = set(database.get_all_email_ids(user_id))
-            fetch_label_senders(
-                service,
-                user_id,
-                "label:whitelist",
-                "whitelist",
-                task_id,
-                "listing whitelist emails",
-                "fetching whitelist emails",
-                existing,
-            )
-            fetch_label_senders(
-                service,
-                user_id,
-                "label:spam-filter-ignore",
-                "ignore",
-                task_id,
-                "listing ignore emails",
-                "fetching ignore emails",
-                existing,
-            )
-            fetch_label_senders(
-                service,
-                user_id,
-                "label:shopify-spam",
-                "spam",
-                task_id,
-                "listing spam emails",
-                "fetching spam emails",
-                existing,
-            )
-        except Exception:
-            import traceback
-
-            logger.error(traceback.format_exc())
-        finally:
-            update_task(task_id, stage="closed")
-            tasks.pop(task_id, None)
-            database.delete_task(task_id)
-            task_summaries[task_id] = {"message": "Refresh completed"}
-            user_context.reset(token)
-
-    threading.Thread(target=worker).start()
-    return jsonify({"task_id": task_id})
+    return enqueue_task_job(task_id, "refresh", {})
 
 
 @app.route("/update-status", methods=["POST"])
 def update_status():
-    creds = get_credentials()
+    creds = get_credentials(g.user_id)
     if not creds:
         return jsonify({"error": "Not authenticated"}), 401
     service = build("gmail", "v1", credentials=creds)
     msg_id = request.json["id"]
     status = request.json["status"]
-    spam_label = get_label_id(service, "shopify-spam")
-    whitelist_label = get_label_id(service, "whitelist")
-    ignore_label = get_label_id(service, "spam-filter-ignore")
     logger.info("Update status request for %s -> %s", msg_id, status)
-    if status == "spam":
-        logger.debug("Gmail request: add spam label to %s", msg_id)
-        service.users().messages().modify(
-            userId="me",
-            id=msg_id,
-            body={
-                "addLabelIds": [spam_label],
-                "removeLabelIds": [whitelist_label, ignore_label],
-            },
-        ).execute()
+    # CODEX: label ids come from the per-user cache so this is one Gmail call
+    label = STATUS_LABELS.get(status)
+    add = [label] if label else []
+    remove = [name for name in FILTER_LABELS if name != label]
+    logger.debug("Gmail request: add %s remove %s on %s", add, remove, msg_id)
+    modify_message_labels(service, g.user_id, msg_id, add, remove)
+    if label:
         sender = next(
             (
                 e["sender"]
@@ -944,69 +2373,151 @@ def update_status():
             "",
         )
         if sender:
-            database.save_sender(g.user_id, sender, "spam")
-        database.save_email_status(g.user_id, msg_id, "spam")
-    elif status == "whitelist":
-        logger.debug("Gmail request: add whitelist label to %s", msg_id)
-        service.users().messages().modify(
-            userId="me",
-            id=msg_id,
-            body={
-                "addLabelIds": [whitelist_label],
-                "removeLabelIds": [spam_label, ignore_label],
-            },
-        ).execute()
-        sender = next(
-            (
-                e["sender"]
-                for t in tasks.values()
-                for e in t.get("emails", [])
-                if e["id"] == msg_id
+            database.save_sender(g.user_id, sender, status)
+    database.save_email_status(g.user_id, msg_id, status)
+    update_task_email_status(msg_id, status)
+    train_classifier(g.user_id, [msg_id])
+    return ("", 204)
+
+
+def create_sender_filter(service, sender: str, spam_label: str) -> bool:
+    """Create a Gmail filter labelling a sender's emails as spam.
+
+    Returns True if the filter exists afterwards.
+    """
+    logger.debug("Gmail request: create filter for %s", sender)
+    try:
+        execute_gmail_change(
+            "filters.create",
+            service.users()
+            .settings()
+            .filters()
+            .create(
+                userId="me",
+                body={
+                    "criteria": {"from": sender},
+                    "action": {
+                        "addLabelIds": [spam_label],
+                        "removeLabelIds": ["INBOX"],
+                    },
+                },
             ),
-            "",
         )
-        if sender:
-            database.save_sender(g.user_id, sender, "whitelist")
-        database.save_email_status(g.user_id, msg_id, "whitelist")
-    elif status == "ignore":
-        logger.debug("Gmail request: add ignore label to %s", msg_id)
-        service.users().messages().modify(
-            userId="me",
-            id=msg_id,
-            body={
-                "addLabelIds": [ignore_label],
-                "removeLabelIds": [spam_label, whitelist_label],
-            },
-        ).execute()
-        sender = next(
-            (
-                e["sender"]
-                for t in tasks.values()
-                for e in t.get("emails", [])
-                if e["id"] == msg_id
-            ),
-            "",
+        return True
+    except Exception as e:
+        if "already exists" in str(e).lower():
+            return True
+        logger.error("Failed to create filter for %s: %s", sender, e)
+        return False
+
+
+def run_confirm_job(job: dict) -> None:
+    """Confirm reviewed emails, creating filters and labels for spam senders.
+
+    Works in phases over the whole set: stored statuses and senders are read
+    in one query, missing senders are fetched in batches, one filter is
+    created per spam sender, labels are changed with ``batchModify`` and the
+    results are written in one transaction.
+    """
+    user_id = job["user_id"]
+    ids = job["payload"]["ids"]
+    task_id = job["payload"]["task_id"]
+    creds = get_credentials(user_id)
+    if not creds:
+        raise RuntimeError(f"No Gmail credentials for user {user_id}")
+    if task_id:
+        load_task(task_id, user_id)
+
+    def phase(stage: str, progress: int, total: int) -> None:
+        if task_id and task_id in tasks:
+            update_task(
+                task_id, stage=f"confirming: {stage}", progress=progress, total=total
+            )
+
+    token = user_context.set(user_id)
+    try:
+        service = build("gmail", "v1", credentials=creds)
+        spam_label = get_label_id(service, "shopify-spam", user_id)
+
+        phase("loading statuses", 0, len(ids))
+        stored = database.get_email_statuses(user_id, ids)
+        spam_ids = [i for i in ids if stored.get(i, {}).get("status") == "spam"]
+        spam_set = set(spam_ids)
+        other_ids = [i for i in ids if i not in spam_set]
+        senders = {i: stored[i]["sender"] for i in spam_ids if stored[i]["sender"]}
+
+        # CODEX: the sender is usually stored by the scan, so Gmail is only
+        # asked for the ones that are missing
+        missing = [i for i in spam_ids if i not in senders]
+        phase("fetching senders", 0, len(missing))
+        if missing:
+            details, failed = batch_get_messages(
+                service,
+                missing,
+                user_id=user_id,
+                fmt="metadata",
+                metadata_headers=["From"],
+            )
+            for msg_id, msg in details.items():
+                sender = message_header(msg, "From")
+                if sender:
+                    senders[msg_id] = sender
+            if failed:
+                logger.warning(
+                    "Skipped %d spam emails whose sender couldn't be fetched",
+                    len(failed),
+                )
+        phase("fetching senders", len(missing), len(missing))
+        spam_ids = [i for i in spam_ids if i in senders]
+
+        distinct = sorted(set(senders.values()))
+        filtered = database.get_senders_with_filters(user_id, distinct)
+        todo = [sender for sender in distinct if sender not in filtered]
+        phase("creating filters", 0, len(todo))
+        for n, sender in enumerate(todo, start=1):
+            if create_sender_filter(service, sender, spam_label):
+                filtered.add(sender)
+            phase("creating filters", n, len(todo))
+
+        # CODEX: spam emails are confirmed once their label change has been
+        # applied by batchModify
+        phase("applying labels", 0, len(spam_ids))
+        labels = LabelBatcher(service, user_id)
+        for msg_id in spam_ids:
+            labels.add(msg_id, [spam_label], ["INBOX"])
+        failed = labels.flush()
+        spam_ids = [i for i in spam_ids if i not in failed]
+        phase("applying labels", len(spam_ids), len(spam_ids))
+
+        phase("saving", 0, len(ids))
+        confirmed = other_ids + spam_ids
+        database.confirm_emails_bulk(
+            user_id,
+            confirmed,
+            [i for i in spam_ids if senders[i] in filtered],
+            {i: senders[i] for i in spam_ids},
         )
-        if sender:
-            database.save_sender(g.user_id, sender, "ignore")
-        database.save_email_status(g.user_id, msg_id, "ignore")
-    else:
-        logger.debug(
-            "Gmail request: clear spam/whitelist/ignore labels from %s", msg_id
+        remove_emails_from_tasks(user_id, confirmed)
+        # CODEX: confirmed statuses are the user's own labels
+        train_classifier(user_id, confirmed)
+        logger.info(
+            "Confirmed %d emails, %d as spam from %d senders",
+            len(confirmed),
+            len(spam_ids),
+            len(distinct),
         )
-        service.users().messages().modify(
-            userId="me",
-            id=msg_id,
-            body={"removeLabelIds": [spam_label, whitelist_label, ignore_label]},
-        ).execute()
-        database.save_email_status(g.user_id, msg_id, status)
-    update_task_email_status(msg_id, status)
-    return ("", 204)
+
+    finally:
+        if task_id and task_id in tasks:
+            update_task(task_id, stage="closed", progress=len(ids))
+            forget_task(task_id)
+            task_summaries[task_id] = {"message": "Confirmation complete"}
+        user_context.reset(token)
 
 
 @app.route("/confirm", methods=["POST"])
 def confirm():
-    creds = get_credentials()
+    creds = get_credentials(g.user_id)
     if not creds:
         return jsonify({"error": "Not authenticated"}), 401
     ids = request.json.get("ids", [])
@@ -1015,87 +2526,7 @@ def confirm():
     if task_id and task_id in tasks:
         # CODEX: indicate confirmation progress
         update_task(task_id, stage="confirming", progress=0, total=len(ids))
-
-    user_id = g.user_id
-
-    def worker():
-        token = user_context.set(user_id)
-        try:
-            service = build("gmail", "v1", credentials=creds)
-            spam_label = get_label_id(service, "shopify-spam")
-            for idx, msg_id in enumerate(ids):
-                status = database.get_email_status(user_id, msg_id) or "not_spam"
-                if status == "spam":
-                    logger.debug(
-                        "Gmail request: get message %s for confirmation", msg_id
-                    )
-                    msg = (
-                        service.users()
-                        .messages()
-                        .get(
-                            userId="me",
-                            id=msg_id,
-                            format="metadata",
-                            metadataHeaders=["From"],
-                        )
-                        .execute()
-                    )
-                    logger.debug("Gmail response: %s", msg)
-                    sender = next(
-                        (
-                            h["value"]
-                            for h in msg["payload"]["headers"]
-                            if h["name"].lower() == "from"
-                        ),
-                        "",
-                    )
-                    try:
-                        if not database.has_filter_for_sender(user_id, sender):
-                            logger.debug("Gmail request: create filter for %s", sender)
-                            service.users().settings().filters().create(
-                                userId="me",
-                                body={
-                                    "criteria": {"from": sender},
-                                    "action": {
-                                        "addLabelIds": [spam_label],
-                                        "removeLabelIds": ["INBOX"],
-                                    },
-                                },
-                            ).execute()
-                            database.set_filter_created(user_id, msg_id)
-                        else:
-                            database.set_filter_created(user_id, msg_id)
-                    except Exception as e:
-                        if "already exists" in str(e).lower():
-                            database.set_filter_created(user_id, msg_id)
-                        else:
-                            import traceback
-
-                            logger.error(traceback.format_exc())
-                    logger.debug("Gmail request: label %s as shopify-spam", msg_id)
-                    service.users().messages().modify(
-                        userId="me",
-                        id=msg_id,
-                        body={
-                            "addLabelIds": [spam_label],
-                            "removeLabelIds": ["INBOX"],
-                        },
-                    ).execute()
-                    update_task_email_status(msg_id, "spam")
-                    database.save_sender(user_id, sender, "spam")
-                database.confirm_email(user_id, msg_id)
-                if task_id and task_id in tasks:
-                    update_task(task_id, progress=idx + 1)
-
-        finally:
-            if task_id and task_id in tasks:
-                update_task(task_id, stage="closed", progress=len(ids))
-                tasks.pop(task_id, None)
-                database.delete_task(task_id)
-                task_summaries[task_id] = {"message": "Confirmation complete"}
-            user_context.reset(token)
-
-    threading.Thread(target=worker).start()
+    job_queue.enqueue(g.user_id, "confirm", {"ids": ids, "task_id": task_id}, task_id)
     return ("", 202)
 
 
@@ -1106,6 +2537,20 @@ def list_senders():
     return jsonify({"senders": senders})
 
 
+@app.route("/senders", methods=["POST"])
+def add_sender():
+    """Add a sender rule for an address, ``@domain``, ``domain`` or ``*.domain``."""
+    sender = (request.json.get("sender") or "").strip()
+    status = request.json.get("status")
+    if status not in STATUS_LABELS:
+        return jsonify({"error": "invalid status"}), 400
+    rule = normalise_sender(sender)
+    if rule["kind"] is None:
+        return jsonify({"error": "not an address or domain"}), 400
+    database.save_sender(g.user_id, sender, status)
+    return jsonify({"sender": sender, "status": status, **rule}), 201
+
+
 @app.route("/reset-sender", methods=["POST"])
 def reset_sender():
     """Remove a sender from spam/whitelist/ignore lists."""
@@ -1113,6 +2558,18 @@ def reset_sender():
     if not sender:
         return jsonify({"error": "missing sender"}), 400
     database.clear_sender(g.user_id, sender)
+    forget_classifier_sender(g.user_id, sender)
+    # CODEX: their email statuses are gone so drop them from open tasks too
+    remove_emails_from_tasks(
+        g.user_id,
+        [
+            e["id"]
+            for t in list(tasks.values())
+            if t.get("user_id") == g.user_id
+            for e in t.get("emails", [])
+            if e.get("sender") == sender
+        ],
+    )
     return ("", 204)
 
 
@@ -1120,7 +2577,11 @@ def reset_sender():
 def user_logs_endpoint():
     """Return recent log lines for the current user."""
     # CODEX: filter out request and response logs for this endpoint
-    lines = user_logs.get(g.user_id, [])
+    return jsonify({"logs": filter_log_lines(user_logs.get(g.user_id, []))})
+
+
+def filter_log_lines(lines: list[str]) -> list[str]:
+    """Drop request and response logs for the log viewer itself."""
     filtered = []
     for line in lines:
         if "/logs" in line:
@@ -1128,7 +2589,7 @@ def user_logs_endpoint():
         if "Response payload" in line and "logs" in line:
             continue
         filtered.append(line)
-    return jsonify({"logs": filtered})
+    return filtered
 
 
 @app.route("/clear-task", methods=["POST"])
@@ -1137,10 +2598,109 @@ def clear_task():
     task_id = request.json.get("task_id")
     if not task_id:
         return jsonify({"error": "missing task"}), 400
-    tasks.pop(task_id, None)
-    database.delete_task(task_id)
+    # CODEX: a task that hasn't started yet never will
+    database.cancel_task_jobs(task_id)
+    forget_task(task_id)
     return ("", 204)
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Return timings and counters for all users in the Prometheus text format."""
+    # CODEX: task counts are read at scrape time so finished stages drop out
+    active = {}
+    with tasks_lock:
+        for task in tasks.values():
+            key = (task.get("stage", ""), task.get("kind", "scan"))
+            active[key] = active.get(key, 0) + 1
+    metrics.ACTIVE_TASKS.clear()
+    for (stage, kind), count in active.items():
+        metrics.ACTIVE_TASKS.set(count, stage=stage, kind=kind)
+    metrics.JOBS.clear()
+    for status, count in database.count_jobs().items():
+        metrics.JOBS.set(count, status=status)
+    metrics.LLM_CIRCUIT_OPEN.set(int(llm_client.breaker.state != "closed"))
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def process_memory() -> dict:
+    """Return the process's current and peak resident memory in MB."""
+    current = None
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        current = round(pages * resource.getpagesize() / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"rss_mb": current, "peak_rss_mb": round(peak, 1)}
+
+
+@app.route("/memory")
+def memory_report():
+    """Return process memory and the size of in-memory state for all users."""
+    tasks.prune()
+    task_summaries.prune()
+    held = tasks.values()
+    with tasks_lock:
+        task_stats = {
+            "in_memory": len(held),
+            "running": sum(
+                t.get("stage") not in database.FINISHED_TASK_STAGES for t in held
+            ),
+            "emails": sum(len(t.get("emails", [])) for t in held),
+            "log_entries": sum(len(t.get("log", [])) for t in held),
+            "json_bytes": sum(len(json.dumps(t, default=str)) for t in held),
+            "evicted": tasks.evictions,
+        }
+    logs = user_logs.values()
+    return jsonify(
+        {
+            **process_memory(),
+            "tasks": task_stats,
+            "task_summaries": len(task_summaries),
+            "user_logs": {
+                "users": len(logs),
+                "lines": sum(len(lines) for lines in logs),
+                "evicted": user_logs.evictions,
+            },
+            "classifiers": len(classifiers),
+            "quota_limiters": len(quota_limiters),
+            "label_cache": len(label_cache),
+        }
+    )
+
+
+@app.route("/llm-stats")
+def llm_stats():
+    """Return OpenRouter call counts, errors, latency and circuit state."""
+    return jsonify(llm_client.stats())
+
+
+# CODEX: scans, sender refreshes and confirmations run as jobs stored in
+# SQLite on a fixed pool of JOB_WORKERS threads, at most
+# JOB_USER_CONCURRENCY at a time per user
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_USER_CONCURRENCY = int(os.environ.get("JOB_USER_CONCURRENCY", "1"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+job_queue = JobQueue(
+    workers=JOB_WORKERS,
+    per_user=JOB_USER_CONCURRENCY,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    on_failure=fail_job_task,
+)
+job_queue.register("scan", run_scan_job)
+job_queue.register("refresh", run_refresh_job)
+job_queue.register("confirm", run_confirm_job)
+
+
+@app.before_request
+def start_job_workers():
+    # started on the first request rather than at import so the debug
+    # reloader's parent process never runs jobs
+    job_queue.start()
+
+
 if __name__ == "__main__":
     app.run(debug=True, ssl_context="adhoc")
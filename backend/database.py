@@ -1,28 +1,173 @@
 import os
 import json
+import math
+import queue
 import sqlite3
 import datetime
 import re
+import time
+from contextlib import contextmanager
 from email.utils import parsedate_to_datetime
 
+from metrics import DB_SECONDS, timed
+from sender_rules import normalise_sender
+
 DB_PATH = os.path.join(os.path.dirname(__file__), "data.db")
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
 
+# CODEX: connection pool settings, overridable through the environment
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL").upper()
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", "30"))
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))
 
-def get_connection():
-    conn = sqlite3.connect(DB_PATH)
+if DB_SYNCHRONOUS not in {"OFF", "NORMAL", "FULL", "EXTRA"}:
+    raise ValueError(f"Invalid DB_SYNCHRONOUS value: {DB_SYNCHRONOUS}")
+
+# idle connections keyed by database path
+_pools: dict[str, queue.LifoQueue] = {}
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        timeout=DB_BUSY_TIMEOUT,
+        cached_statements=DB_CACHED_STATEMENTS,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
     return conn
 
 
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection and run the block in a transaction.
+
+    Connections use WAL journaling and are returned to the pool afterwards so
+    their prepared statement cache is reused by later calls.
+    """
+    path = DB_PATH
+    pool = _pools.setdefault(path, queue.LifoQueue(maxsize=DB_POOL_SIZE))
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_connection(path)
+    try:
+        with conn:
+            yield conn
+    except BaseException:
+        conn.close()
+        raise
+    try:
+        pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+
+def close_connections() -> None:
+    """Close all idle pooled connections."""
+    for pool in _pools.values():
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _date_epoch(date: str | None) -> int | None:
+    """Return an RFC 2822 date as a UTC epoch, or None if it can't be parsed."""
+    if not date:
+        return None
+    try:
+        dt = parsedate_to_datetime(date)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
+
+
+def _add_date_epoch(conn) -> None:
+    """Add the indexed ``date_epoch`` column and backfill it from ``date``."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(email_status)")}
+    if "date_epoch" not in columns:
+        conn.execute("ALTER TABLE email_status ADD COLUMN date_epoch INTEGER")
+    rows = conn.execute(
+        "SELECT user_id, email_id, date FROM email_status "
+        "WHERE date_epoch IS NULL AND date IS NOT NULL"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE email_status SET date_epoch = ? WHERE user_id = ? AND email_id = ?",
+        [(_date_epoch(r["date"]), r["user_id"], r["email_id"]) for r in rows],
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_email_status_confirmed_date "
+        "ON email_status (user_id, confirmed, date_epoch)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_email_status_sender "
+        "ON email_status (user_id, sender)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user_stage ON tasks (user_id, stage)"
+    )
+
+
+def _sender_row(user_id: str, sender: str, status: str) -> tuple:
+    rule = normalise_sender(sender)
+    return (user_id, sender, status, rule["kind"], rule["pattern"], rule["domain"])
+
+
+def _normalise_senders(conn) -> None:
+    """Add the normalised rule columns to ``senders`` and backfill them."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(senders)")}
+    for column in ("kind", "pattern", "domain"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE senders ADD COLUMN {column} TEXT")
+    rows = conn.execute(
+        "SELECT user_id, sender, status FROM senders WHERE kind IS NULL"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE senders SET kind = ?, pattern = ?, domain = ? "
+        "WHERE user_id = ? AND sender = ?",
+        [
+            (*_sender_row(r["user_id"], r["sender"], r["status"])[3:], r[0], r[1])
+            for r in rows
+        ],
+    )
+
+
+def _add_task_extra(conn) -> None:
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(tasks)")}
+    if "extra_json" not in columns:
+        conn.execute("ALTER TABLE tasks ADD COLUMN extra_json TEXT")
+
+
+# CODEX: schema changes that CREATE IF NOT EXISTS can't express, applied in
+# order and tracked with PRAGMA user_version
+MIGRATIONS = [_add_date_epoch, _normalise_senders, _add_task_extra]
+
+
+def _migrate(conn) -> None:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        migration(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+
+
+@timed(DB_SECONDS)
 def init_db():
     if not os.path.exists(DB_PATH):
         open(DB_PATH, "a").close()
     with get_connection() as conn, open(SCHEMA_PATH) as f:
         conn.executescript(f.read())
+        _migrate(conn)
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def save_token(user_id: str, token: str) -> None:
     with get_connection() as conn:
         conn.execute(
@@ -32,6 +177,7 @@ def save_token(user_id: str, token: str) -> None:
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def load_token(user_id: str):
     with get_connection() as conn:
         row = conn.execute(
@@ -41,6 +187,7 @@ def load_token(user_id: str):
         return row["token"] if row else None
 
 
+@timed(DB_SECONDS)
 def save_user_email(user_id: str, email: str) -> None:
     """Store mapping of Gmail address to user id."""
     with get_connection() as conn:
@@ -51,6 +198,7 @@ def save_user_email(user_id: str, email: str) -> None:
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def get_user_id_for_email(email: str):
     """Return user id associated with the given Gmail address."""
     with get_connection() as conn:
@@ -61,21 +209,24 @@ def get_user_id_for_email(email: str):
         return row["user_id"] if row else None
 
 
+@timed(DB_SECONDS)
 def save_task(task: dict) -> None:
+    """Insert or update the task row with its stage and progress.
+
+    Emails and log entries are stored separately with ``append_task_emails``
+    and ``append_task_log`` so this write stays small.
+    """
     with get_connection() as conn:
         # CODEX: Use UPSERT to avoid creating extra rows during updates
         conn.execute(
             """
-            INSERT INTO tasks (
-                id, user_id, stage, progress, total, emails_json, log_json
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO tasks (id, user_id, stage, progress, total)
+            VALUES (?, ?, ?, ?, ?)
             ON CONFLICT(id) DO UPDATE SET
                 user_id=excluded.user_id,
                 stage=excluded.stage,
                 progress=excluded.progress,
-                total=excluded.total,
-                emails_json=excluded.emails_json,
-                log_json=excluded.log_json
+                total=excluded.total
             """,
             (
                 task.get("id"),
@@ -83,35 +234,120 @@ def save_task(task: dict) -> None:
                 task.get("stage"),
                 task.get("progress"),
                 task.get("total"),
-                json.dumps(task.get("emails", [])),
-                json.dumps(task.get("log", [])),
             ),
         )
         conn.commit()
 
 
+@timed(DB_SECONDS)
+def save_task_extra(task_id: str, extra: dict) -> None:
+    """Store task fields other than the row columns, emails and log."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE tasks SET extra_json = ? WHERE id = ?",
+            (json.dumps(extra), task_id),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def append_task_emails(task_id: str, emails: list[dict]) -> None:
+    """Append emails to a task, ignoring ids that are already stored."""
+    if not emails:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            (
+                "INSERT INTO task_emails (task_id, email_id, status, email_json) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT(task_id, email_id) DO NOTHING"
+            ),
+            [(task_id, e["id"], e.get("status"), json.dumps(e)) for e in emails],
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def set_task_email_status(task_id: str, email_id: str, status: str) -> None:
+    """Update the status of an email already stored for a task."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE task_emails SET status = ? WHERE task_id = ? AND email_id = ?",
+            (status, task_id, email_id),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def append_task_log(task_id: str, entries: list[dict]) -> None:
+    """Append log entries to a task."""
+    if not entries:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO task_log (task_id, entry_json) VALUES (?, ?)",
+            [(task_id, json.dumps(e)) for e in entries],
+        )
+        conn.commit()
+
+
+def _task_from_row(conn, row) -> dict:
+    """Rebuild a task dict from its row and appended emails and log entries."""
+    # CODEX: emails_json/log_json only hold data written before tasks were
+    # split into rows, so merge them ahead of the appended entries
+    emails = {e["id"]: e for e in json.loads(row["emails_json"] or "[]")}
+    for r in conn.execute(
+        "SELECT status, email_json FROM task_emails WHERE task_id = ? ORDER BY rowid",
+        (row["id"],),
+    ):
+        email = json.loads(r["email_json"])
+        if r["status"] is not None:
+            email["status"] = r["status"]
+        emails[email["id"]] = email
+    log = json.loads(row["log_json"] or "[]")
+    log.extend(
+        json.loads(r["entry_json"])
+        for r in conn.execute(
+            "SELECT entry_json FROM task_log WHERE task_id = ? ORDER BY rowid",
+            (row["id"],),
+        )
+    )
+    task = json.loads(row["extra_json"] or "{}")
+    task.update(
+        {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "total": row["total"],
+            "emails": list(emails.values()),
+            "log": log,
+        }
+    )
+    return task
+
+
+@timed(DB_SECONDS)
 def load_tasks(user_id: str):
     with get_connection() as conn:
         rows = conn.execute(
             "SELECT * FROM tasks WHERE user_id = ?",
             (user_id,),
         ).fetchall()
-        result = []
-        for r in rows:
-            result.append(
-                {
-                    "id": r["id"],
-                    "user_id": r["user_id"],
-                    "stage": r["stage"],
-                    "progress": r["progress"],
-                    "total": r["total"],
-                    "emails": json.loads(r["emails_json"] or "[]"),
-                    "log": json.loads(r["log_json"] or "[]"),
-                }
-            )
-        return result
+        return [_task_from_row(conn, r) for r in rows]
 
 
+@timed(DB_SECONDS)
+def load_user_task(user_id: str, task_id: str):
+    """Return one of a user's tasks, or None if there is no such task."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM tasks WHERE id = ? AND user_id = ?",
+            (task_id, user_id),
+        ).fetchone()
+        return _task_from_row(conn, row) if row else None
+
+
+@timed(DB_SECONDS)
 def load_latest_task(user_id: str):
     """Return the most recent task that is not closed."""
     with get_connection() as conn:
@@ -121,15 +357,9 @@ def load_latest_task(user_id: str):
         ).fetchone()
         if not row:
             return None
-        task = {
-            "id": row["id"],
-            "user_id": row["user_id"],
-            "stage": row["stage"],
-            "progress": row["progress"],
-            "total": row["total"],
-            "emails": json.loads(row["emails_json"] or "[]"),
-            "log": json.loads(row["log_json"] or "[]"),
-        }
+        task = _task_from_row(conn, row)
+        if "kind" in task:
+            return task
         if re.search(r"whitelist|spam emails|ignore emails", task["stage"], re.I):
             task["kind"] = "refresh"
         else:
@@ -137,21 +367,45 @@ def load_latest_task(user_id: str):
         return task
 
 
+@timed(DB_SECONDS)
 def delete_task(task_id: str) -> None:
     with get_connection() as conn:
         conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        conn.execute("DELETE FROM task_emails WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM task_log WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM scan_checkpoints WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM scan_pending_labels WHERE task_id = ?", (task_id,))
         conn.commit()
 
 
+# REPLACE gives a saved sender a new rowid, which get_sender_rules orders by
+SAVE_SENDER_SQL = (
+    "REPLACE INTO senders (user_id, sender, status, kind, pattern, domain) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+@timed(DB_SECONDS)
 def save_sender(user_id: str, sender: str, status: str) -> None:
     with get_connection() as conn:
-        conn.execute(
-            "REPLACE INTO senders (user_id, sender, status) VALUES (?, ?, ?)",
-            (user_id, sender, status),
+        conn.execute(SAVE_SENDER_SQL, _sender_row(user_id, sender, status))
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def save_senders_bulk(user_id: str, senders: list[tuple[str, str]]) -> None:
+    """Insert or update many ``(sender, status)`` pairs in one transaction."""
+    if not senders:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            SAVE_SENDER_SQL,
+            [_sender_row(user_id, sender, status) for sender, status in senders],
         )
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def get_senders(user_id: str, status: str):
     with get_connection() as conn:
         rows = conn.execute(
@@ -161,6 +415,80 @@ def get_senders(user_id: str, status: str):
         return [r["sender"] for r in rows]
 
 
+@timed(DB_SECONDS)
+def get_sender_rules(user_id: str) -> list[tuple[str, str, str]]:
+    """Return a user's ``(kind, pattern, status)`` sender rules.
+
+    Rules are in the order they were last saved, so when two senders
+    normalise to the same pattern the later one wins once compiled.
+    """
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT kind, pattern, status FROM senders "
+            "WHERE user_id = ? AND kind IS NOT NULL ORDER BY rowid",
+            (user_id,),
+        ).fetchall()
+        return [(r["kind"], r["pattern"], r["status"]) for r in rows]
+
+
+@timed(DB_SECONDS)
+def save_email_statuses_bulk(
+    user_id: str, emails: list[dict], *, only_if_absent: bool = False
+) -> None:
+    """Insert or update many email statuses in one transaction.
+
+    Each dict needs ``id`` and ``status`` and may include ``confirmed``,
+    ``subject``, ``sender``, ``date`` and ``filter_created``. Missing details
+    keep their stored values. With ``only_if_absent`` existing rows are left
+    untouched.
+    """
+    if not emails:
+        return
+    if only_if_absent:
+        conflict = "DO NOTHING"
+    else:
+        conflict = """DO UPDATE SET
+            status=excluded.status,
+            confirmed=excluded.confirmed,
+            subject=COALESCE(excluded.subject, email_status.subject),
+            sender=COALESCE(excluded.sender, email_status.sender),
+            date=COALESCE(excluded.date, email_status.date),
+            date_epoch=COALESCE(excluded.date_epoch, email_status.date_epoch),
+            filter_created=COALESCE(?, email_status.filter_created)"""
+    params = []
+    for e in emails:
+        filter_created = e.get("filter_created")
+        if filter_created is not None:
+            filter_created = int(filter_created)
+        row = [
+            user_id,
+            e["id"],
+            e["status"],
+            int(e.get("confirmed", False)),
+            e.get("subject"),
+            e.get("sender"),
+            e.get("date"),
+            _date_epoch(e.get("date")),
+            filter_created,
+        ]
+        if not only_if_absent:
+            row.append(filter_created)
+        params.append(row)
+    with get_connection() as conn:
+        conn.executemany(
+            f"""
+            INSERT INTO email_status (
+                user_id, email_id, status, confirmed, subject, sender, date,
+                date_epoch, filter_created
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, 0))
+            ON CONFLICT(user_id, email_id) {conflict}
+            """,
+            params,
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
 def save_email_status(
     user_id: str,
     email_id: str,
@@ -173,36 +501,23 @@ def save_email_status(
     filter_created: bool | None = None,
 ) -> None:
     """Insert or update email status details."""
-    with get_connection() as conn:
-        row = conn.execute(
-            "SELECT subject, sender, date, filter_created FROM email_status WHERE user_id = ? AND email_id = ?",
-            (user_id, email_id),
-        ).fetchone()
-        if row:
-            subject = subject if subject is not None else row["subject"]
-            sender = sender if sender is not None else row["sender"]
-            date = date if date is not None else row["date"]
-            if filter_created is None:
-                filter_created = row["filter_created"]
-        conn.execute(
-            (
-                "REPLACE INTO email_status (user_id, email_id, status, confirmed, "
-                "subject, sender, date, filter_created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
-            ),
-            (
-                user_id,
-                email_id,
-                status,
-                int(confirmed),
-                subject,
-                sender,
-                date,
-                int(filter_created or 0),
-            ),
-        )
-        conn.commit()
+    save_email_statuses_bulk(
+        user_id,
+        [
+            {
+                "id": email_id,
+                "status": status,
+                "confirmed": confirmed,
+                "subject": subject,
+                "sender": sender,
+                "date": date,
+                "filter_created": filter_created,
+            }
+        ],
+    )
 
 
+@timed(DB_SECONDS)
 def save_email_status_if_absent(
     user_id: str,
     email_id: str,
@@ -215,32 +530,24 @@ def save_email_status_if_absent(
     filter_created: bool | None = None,
 ) -> None:
     """Insert email status details only if the record does not already exist."""
-    with get_connection() as conn:
-        row = conn.execute(
-            "SELECT 1 FROM email_status WHERE user_id = ? AND email_id = ?",
-            (user_id, email_id),
-        ).fetchone()
-        if row:
-            return
-        conn.execute(
-            (
-                "INSERT INTO email_status (user_id, email_id, status, confirmed, "
-                "subject, sender, date, filter_created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
-            ),
-            (
-                user_id,
-                email_id,
-                status,
-                int(confirmed),
-                subject,
-                sender,
-                date,
-                int(filter_created or 0),
-            ),
-        )
-        conn.commit()
+    save_email_statuses_bulk(
+        user_id,
+        [
+            {
+                "id": email_id,
+                "status": status,
+                "confirmed": confirmed,
+                "subject": subject,
+                "sender": sender,
+                "date": date,
+                "filter_created": filter_created,
+            }
+        ],
+        only_if_absent=True,
+    )
 
 
+@timed(DB_SECONDS)
 def confirm_email(user_id: str, email_id: str) -> None:
     with get_connection() as conn:
         conn.execute(
@@ -250,6 +557,7 @@ def confirm_email(user_id: str, email_id: str) -> None:
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def set_filter_created(user_id: str, email_id: str) -> None:
     """Mark an email's filter as created."""
     with get_connection() as conn:
@@ -260,6 +568,7 @@ def set_filter_created(user_id: str, email_id: str) -> None:
         conn.commit()
 
 
+@timed(DB_SECONDS)
 def has_filter_for_sender(user_id: str, sender: str) -> bool:
     """Return True if any email from this sender has a filter created."""
     with get_connection() as conn:
@@ -270,6 +579,7 @@ def has_filter_for_sender(user_id: str, sender: str) -> bool:
         return bool(row)
 
 
+@timed(DB_SECONDS)
 def get_confirmed_emails(user_id: str):
     with get_connection() as conn:
         rows = conn.execute(
@@ -279,44 +589,39 @@ def get_confirmed_emails(user_id: str):
         return [r["email_id"] for r in rows]
 
 
+@timed(DB_SECONDS)
 def get_unconfirmed_emails(user_id: str, after: datetime.datetime):
-    """Return emails not yet confirmed that were received on or after the given date."""
+    """Return emails not yet confirmed that were received on or after the given date.
+
+    Emails are ordered newest first. Naive datetimes are treated as UTC.
+    """
+    if after.tzinfo is None:
+        after = after.replace(tzinfo=datetime.timezone.utc)
     with get_connection() as conn:
         rows = conn.execute(
-            "SELECT * FROM email_status WHERE user_id = ? AND confirmed = 0",
-            (user_id,),
+            (
+                "SELECT * FROM email_status WHERE user_id = ? AND confirmed = 0 "
+                "AND date_epoch >= ? ORDER BY date_epoch DESC"
+            ),
+            (user_id, math.ceil(after.timestamp())),
         ).fetchall()
-    if after.tzinfo is not None:
-        after_cmp = after.astimezone(datetime.timezone.utc).replace(tzinfo=None)
-    else:
-        after_cmp = after
-
-    emails = []
-    for r in rows:
-        try:
-            r_dt = parsedate_to_datetime(r["date"])
-            if r_dt and r_dt.tzinfo is not None:
-                r_dt = r_dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
-        except Exception:
-            r_dt = None
-
-        if r_dt and r_dt >= after_cmp:
-            emails.append(
-                {
-                    "id": r["email_id"],
-                    "subject": r["subject"] or "",
-                    "sender": r["sender"] or "",
-                    "date": r["date"] or "",
-                    "status": r["status"],
-                    "request": "",
-                    "response": "",
-                    "llm_sent": False,
-                    "filter_created": bool(r["filter_created"]),
-                }
-            )
-    return emails
+    return [
+        {
+            "id": r["email_id"],
+            "subject": r["subject"] or "",
+            "sender": r["sender"] or "",
+            "date": r["date"] or "",
+            "status": r["status"],
+            "request": "",
+            "response": "",
+            "llm_sent": False,
+            "filter_created": bool(r["filter_created"]),
+        }
+        for r in rows
+    ]
 
 
+@timed(DB_SECONDS)
 def get_email_status(user_id: str, email_id: str):
     """Return stored status for a specific email id."""
     with get_connection() as conn:
@@ -327,6 +632,7 @@ def get_email_status(user_id: str, email_id: str):
         return row["status"] if row else None
 
 
+@timed(DB_SECONDS)
 def get_all_email_ids(user_id: str):
     """Return all email ids stored for this user."""
     with get_connection() as conn:
@@ -337,16 +643,26 @@ def get_all_email_ids(user_id: str):
         return [r["email_id"] for r in rows]
 
 
+@timed(DB_SECONDS)
 def list_senders(user_id: str):
     """Return all senders and their status for the given user."""
     with get_connection() as conn:
         rows = conn.execute(
-            "SELECT sender, status FROM senders WHERE user_id = ?",
+            "SELECT sender, status, kind, pattern FROM senders WHERE user_id = ?",
             (user_id,),
         ).fetchall()
-        return [{"sender": r["sender"], "status": r["status"]} for r in rows]
+        return [
+            {
+                "sender": r["sender"],
+                "status": r["status"],
+                "kind": r["kind"],
+                "pattern": r["pattern"],
+            }
+            for r in rows
+        ]
 
 
+@timed(DB_SECONDS)
 def clear_sender(user_id: str, sender: str) -> None:
     """Remove sender from list and delete related email statuses."""
     with get_connection() as conn:
@@ -359,3 +675,550 @@ def clear_sender(user_id: str, sender: str) -> None:
             (user_id, sender),
         )
         conn.commit()
+
+
+@timed(DB_SECONDS)
+def get_cached_verdict(key: str, max_age: float):
+    """Return the cached LLM answer and status for a key if still fresh."""
+    now = time.time()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT answer, status, created_at FROM llm_cache WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if not row:
+            return None
+        if row["created_at"] < now - max_age:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return {"answer": row["answer"], "status": row["status"]}
+
+
+@timed(DB_SECONDS)
+def save_cached_verdict(key: str, answer: str, status: str) -> None:
+    """Store an LLM verdict."""
+    now = time.time()
+    with get_connection() as conn:
+        conn.execute(
+            (
+                "REPLACE INTO llm_cache (key, answer, status, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)"
+            ),
+            (key, answer, status, now, now),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def trim_llm_cache(max_entries: int) -> int:
+    """Evict the least recently used verdicts beyond the cap; return how many."""
+    with get_connection() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count <= max_entries:
+            return 0
+        conn.execute(
+            (
+                "DELETE FROM llm_cache WHERE key IN "
+                "(SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)"
+            ),
+            (count - max_entries,),
+        )
+        conn.commit()
+        return count - max_entries
+
+
+@timed(DB_SECONDS)
+def get_sync_state(user_id: str):
+    """Return the stored Gmail history id and covered start date for a user."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT history_id, synced_after FROM sync_state WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        return dict(row) if row else None
+
+
+@timed(DB_SECONDS)
+def save_sync_state(user_id: str, history_id: str, synced_after: str) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "REPLACE INTO sync_state (user_id, history_id, synced_after) VALUES (?, ?, ?)",
+            (user_id, str(history_id), synced_after),
+        )
+        conn.commit()
+
+
+# stages of tasks that are finished or can't make progress any more
+FINISHED_TASK_STAGES = ("done", "closed", "failed")
+
+
+def _job_from_row(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job.pop("payload_json"))
+    return job
+
+
+@timed(DB_SECONDS)
+def enqueue_job(job: dict) -> tuple[dict, bool]:
+    """Store a pending job unless an identical one is pending or running.
+
+    Returns the stored job, which is the existing one for a duplicate, and
+    whether it was created.
+    """
+    with get_connection() as conn:
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, kind, task_id, payload_json, "
+                "dedupe_key, status, created_at) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)",
+                (
+                    job["id"],
+                    job["user_id"],
+                    job["kind"],
+                    job.get("task_id"),
+                    json.dumps(job["payload"]),
+                    job["dedupe_key"],
+                    time.time(),
+                ),
+            )
+            conn.commit()
+            return dict(job, status="pending", attempts=0), True
+        except sqlite3.IntegrityError:
+            conn.rollback()
+        # CODEX: the partial unique index only covers pending and running jobs
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ('pending', 'running')",
+            (job["dedupe_key"],),
+        ).fetchone()
+        if row is None:
+            # the duplicate finished in the meantime
+            return enqueue_job(job)
+        return _job_from_row(row), False
+
+
+@timed(DB_SECONDS)
+def claim_job(per_user: int):
+    """Mark the oldest runnable pending job as running and return it.
+
+    Jobs of users who already have ``per_user`` jobs running are skipped.
+    Returns None if nothing can run.
+    """
+    with get_connection() as conn:
+        row = conn.execute(
+            """
+            SELECT * FROM jobs
+            WHERE status = 'pending' AND user_id NOT IN (
+                SELECT user_id FROM jobs WHERE status = 'running'
+                GROUP BY user_id HAVING COUNT(*) >= ?
+            )
+            ORDER BY created_at LIMIT 1
+            """,
+            (per_user,),
+        ).fetchone()
+        if row is None:
+            return None
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+            "started_at = ? WHERE id = ? AND status = 'pending'",
+            (time.time(), row["id"]),
+        )
+        conn.commit()
+        if not cur.rowcount:
+            return None
+        job = _job_from_row(row)
+        job["status"] = "running"
+        job["attempts"] += 1
+        return job
+
+
+@timed(DB_SECONDS)
+def finish_job(job_id: str, status: str, error: str | None = None) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def cancel_task_jobs(task_id: str) -> int:
+    """Cancel the pending jobs of a task and return how many there were."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE task_id = ? AND status = 'pending'",
+            (time.time(), task_id),
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+@timed(DB_SECONDS)
+def recover_jobs(max_attempts: int, keep_seconds: float) -> tuple[int, int]:
+    """Tidy up after a process that stopped with jobs in progress.
+
+    Jobs left running are queued again, or failed once they have been tried
+    ``max_attempts`` times. Tasks in an unfinished stage with no pending or
+    running job are marked failed, and finished jobs older than
+    ``keep_seconds`` are deleted. Returns the jobs re-queued and failed.
+    """
+    now = time.time()
+    with get_connection() as conn:
+        failed = conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'interrupted', finished_at = ? "
+            "WHERE status = 'running' AND attempts >= ?",
+            (now, max_attempts),
+        ).rowcount
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'pending', started_at = NULL "
+            "WHERE status = 'running'"
+        ).rowcount
+        conn.execute(
+            f"""
+            UPDATE tasks SET stage = 'failed'
+            WHERE stage NOT IN ({", ".join("?" for _ in FINISHED_TASK_STAGES)})
+            AND id NOT IN (
+                SELECT task_id FROM jobs
+                WHERE status IN ('pending', 'running') AND task_id IS NOT NULL
+            )
+            """,
+            FINISHED_TASK_STAGES,
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status NOT IN ('pending', 'running') "
+            "AND finished_at < ?",
+            (now - keep_seconds,),
+        )
+        conn.commit()
+        return requeued, failed
+
+
+@timed(DB_SECONDS)
+def count_jobs() -> dict[str, int]:
+    """Return the number of stored jobs by status."""
+    with get_connection() as conn:
+        return {
+            r["status"]: r["n"]
+            for r in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+            )
+        }
+
+
+@timed(DB_SECONDS)
+def save_scan_checkpoint(
+    task_id: str,
+    user_id: str,
+    prompt: str,
+    days: int,
+    message_ids: list[str],
+    history_id: str,
+    synced_after: str,
+) -> None:
+    """Start a scan checkpoint with the full list of messages to process."""
+    with get_connection() as conn:
+        conn.execute(
+            "REPLACE INTO scan_checkpoints (task_id, user_id, prompt, days, "
+            "message_ids_json, history_id, synced_after) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                task_id,
+                user_id,
+                prompt,
+                days,
+                json.dumps(message_ids),
+                str(history_id),
+                synced_after,
+            ),
+        )
+        conn.execute("DELETE FROM scan_pending_labels WHERE task_id = ?", (task_id,))
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def load_scan_checkpoint(task_id: str):
+    """Return a scan's checkpoint with its pending label flushes, or None."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT * FROM scan_checkpoints WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        checkpoint = dict(row)
+        checkpoint["message_ids"] = json.loads(checkpoint.pop("message_ids_json"))
+        checkpoint["pending"] = [
+            json.loads(r["flush_json"])
+            for r in conn.execute(
+                "SELECT flush_json FROM scan_pending_labels WHERE task_id = ? "
+                "ORDER BY cursor",
+                (task_id,),
+            )
+        ]
+        return checkpoint
+
+
+@timed(DB_SECONDS)
+def has_scan_checkpoint(task_id: str) -> bool:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM scan_checkpoints WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return row is not None
+
+
+@timed(DB_SECONDS)
+def save_pending_label_flush(task_id: str, cursor: int, flush: dict) -> None:
+    """Record label changes about to be sent for messages before ``cursor``."""
+    with get_connection() as conn:
+        conn.execute(
+            "REPLACE INTO scan_pending_labels (task_id, cursor, flush_json) "
+            "VALUES (?, ?, ?)",
+            (task_id, cursor, json.dumps(flush)),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def advance_scan_checkpoint(task_id: str, cursor: int, unprocessed: int) -> None:
+    """Move a scan's cursor once results before it are stored."""
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE scan_checkpoints SET cursor = ?, unprocessed = ? WHERE task_id = ?",
+            (cursor, unprocessed, task_id),
+        )
+        conn.execute(
+            "DELETE FROM scan_pending_labels WHERE task_id = ? AND cursor <= ?",
+            (task_id, cursor),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def delete_scan_checkpoint(task_id: str) -> None:
+    with get_connection() as conn:
+        conn.execute("DELETE FROM scan_checkpoints WHERE task_id = ?", (task_id,))
+        conn.execute("DELETE FROM scan_pending_labels WHERE task_id = ?", (task_id,))
+        conn.commit()
+
+
+# ids per query when filtering with IN, well below SQLite's variable limit
+IN_CHUNK = 500
+
+
+@timed(DB_SECONDS)
+def get_email_statuses(user_id: str, email_ids: list[str]) -> dict[str, dict]:
+    """Return the stored status and sender of each known email id."""
+    result = {}
+    with get_connection() as conn:
+        for start in range(0, len(email_ids), IN_CHUNK):
+            chunk = email_ids[start : start + IN_CHUNK]  # noqa: E203
+            rows = conn.execute(
+                "SELECT email_id, status, sender FROM email_status "
+                f"WHERE user_id = ? AND email_id IN ({', '.join('?' for _ in chunk)})",
+                (user_id, *chunk),
+            )
+            for r in rows:
+                result[r["email_id"]] = {"status": r["status"], "sender": r["sender"]}
+    return result
+
+
+@timed(DB_SECONDS)
+def get_senders_with_filters(user_id: str, senders: list[str]) -> set[str]:
+    """Return which of ``senders`` already have a filter created."""
+    found = set()
+    with get_connection() as conn:
+        for start in range(0, len(senders), IN_CHUNK):
+            chunk = senders[start : start + IN_CHUNK]  # noqa: E203
+            rows = conn.execute(
+                "SELECT DISTINCT sender FROM email_status WHERE user_id = ? "
+                f"AND filter_created = 1 AND sender IN ({', '.join('?' for _ in chunk)})",
+                (user_id, *chunk),
+            )
+            found.update(r["sender"] for r in rows)
+    return found
+
+
+@timed(DB_SECONDS)
+def confirm_emails_bulk(
+    user_id: str,
+    email_ids: list[str],
+    filtered_ids: list[str],
+    spam_senders: dict[str, str],
+) -> None:
+    """Store the outcome of a confirmation in one transaction.
+
+    ``email_ids`` are marked confirmed and ``filtered_ids`` as having a filter.
+    ``spam_senders`` maps email ids to their senders, which are saved as spam
+    and stored on the emails whose sender wasn't known.
+    """
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE email_status SET confirmed = 1 WHERE user_id = ? AND email_id = ?",
+            [(user_id, i) for i in email_ids],
+        )
+        conn.executemany(
+            "UPDATE email_status SET filter_created = 1 WHERE user_id = ? AND email_id = ?",
+            [(user_id, i) for i in filtered_ids],
+        )
+        conn.executemany(
+            "UPDATE email_status SET sender = ? WHERE user_id = ? AND email_id = ? "
+            "AND (sender IS NULL OR sender = '')",
+            [(sender, user_id, i) for i, sender in spam_senders.items()],
+        )
+        conn.executemany(
+            SAVE_SENDER_SQL,
+            [_sender_row(user_id, s, "spam") for s in set(spam_senders.values())],
+        )
+        conn.commit()
+
+
+def _training_email(row) -> dict:
+    return {
+        "id": row["email_id"],
+        "status": row["status"],
+        "subject": row["subject"],
+        "sender": row["sender"],
+    }
+
+
+@timed(DB_SECONDS)
+def get_emails_for_training(user_id: str, email_ids: list[str]) -> list[dict]:
+    """Return the status, subject and sender of each known email id."""
+    result = []
+    with get_connection() as conn:
+        for start in range(0, len(email_ids), IN_CHUNK):
+            chunk = email_ids[start : start + IN_CHUNK]  # noqa: E203
+            rows = conn.execute(
+                "SELECT email_id, status, subject, sender FROM email_status "
+                f"WHERE user_id = ? AND email_id IN ({', '.join('?' for _ in chunk)})",
+                (user_id, *chunk),
+            )
+            result.extend(_training_email(r) for r in rows)
+    return result
+
+
+@timed(DB_SECONDS)
+def get_untrained_confirmed_emails(user_id: str) -> list[dict]:
+    """Return confirmed emails the local classifier hasn't learned from."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT s.email_id, s.status, s.subject, s.sender FROM email_status s "
+            "LEFT JOIN classifier_examples c "
+            "ON c.user_id = s.user_id AND c.email_id = s.email_id "
+            "WHERE s.user_id = ? AND s.confirmed = 1 AND c.email_id IS NULL",
+            (user_id,),
+        ).fetchall()
+        return [_training_email(r) for r in rows]
+
+
+def _example_from_row(row) -> dict:
+    return {
+        "id": row["email_id"],
+        "sender": row["sender"],
+        "spam": bool(row["spam"]),
+        "features": json.loads(row["features_json"]),
+    }
+
+
+@timed(DB_SECONDS)
+def get_classifier_examples(user_id: str, email_ids: list[str] | None = None):
+    """Return a user's classifier examples keyed by email id.
+
+    All of them are returned when ``email_ids`` is None.
+    """
+    query = (
+        "SELECT email_id, sender, spam, features_json FROM classifier_examples "
+        "WHERE user_id = ?"
+    )
+    with get_connection() as conn:
+        if email_ids is None:
+            rows = conn.execute(query, (user_id,)).fetchall()
+        else:
+            rows = []
+            for start in range(0, len(email_ids), IN_CHUNK):
+                chunk = email_ids[start : start + IN_CHUNK]  # noqa: E203
+                rows.extend(
+                    conn.execute(
+                        f"{query} AND email_id IN ({', '.join('?' for _ in chunk)})",
+                        (user_id, *chunk),
+                    )
+                )
+        return {r["email_id"]: _example_from_row(r) for r in rows}
+
+
+@timed(DB_SECONDS)
+def save_classifier_examples(user_id: str, examples: list[dict]) -> None:
+    """Insert or replace classifier examples."""
+    if not examples:
+        return
+    with get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO classifier_examples "
+            "(user_id, email_id, sender, spam, features_json) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id, email_id) DO UPDATE SET sender=excluded.sender, "
+            "spam=excluded.spam, features_json=excluded.features_json",
+            [
+                (
+                    user_id,
+                    e["id"],
+                    e["sender"],
+                    int(e["spam"]),
+                    json.dumps(e["features"]),
+                )
+                for e in examples
+            ],
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def record_classifier_check(user_id: str, agreed: bool, window: int) -> None:
+    """Count an LLM check of one of the local classifier's confident verdicts.
+
+    Once ``window`` checks are counted both counts are halved before adding,
+    so the agreement rate follows the classifier as it learns.
+    """
+    with get_connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO classifier_checks (user_id, checked, agreed)
+            VALUES (?, 1, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                checked = CASE WHEN checked >= ? THEN checked / 2 ELSE checked END
+                    + 1,
+                agreed = CASE WHEN checked >= ? THEN agreed / 2 ELSE agreed END
+                    + excluded.agreed
+            """,
+            (user_id, float(agreed), window, window),
+        )
+        conn.commit()
+
+
+@timed(DB_SECONDS)
+def get_classifier_checks(user_id: str) -> dict:
+    """Return the user's counts of checked and agreed local verdicts."""
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT checked, agreed FROM classifier_checks WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        return dict(row) if row else {"checked": 0.0, "agreed": 0.0}
+
+
+@timed(DB_SECONDS)
+def delete_classifier_examples(user_id: str, sender: str) -> list[dict]:
+    """Delete and return the classifier examples of a sender's emails."""
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT email_id, sender, spam, features_json FROM classifier_examples "
+            "WHERE user_id = ? AND sender = ?",
+            (user_id, sender),
+        ).fetchall()
+        conn.execute(
+            "DELETE FROM classifier_examples WHERE user_id = ? AND sender = ?",
+            (user_id, sender),
+        )
+        conn.commit()
+        return [_example_from_row(r) for r in rows]
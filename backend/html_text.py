@@ -0,0 +1,241 @@
+import base64
+import codecs
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+
+# tags whose text never reaches the output
+HIDDEN_TAGS = {"script", "style", "template"}
+# tags that can't have children, closed as soon as they open
+VOID_TAGS = {
+    "area",
+    "base",
+    "basefont",
+    "bgsound",
+    "br",
+    "col",
+    "command",
+    "embed",
+    "frame",
+    "hr",
+    "image",
+    "img",
+    "input",
+    "isindex",
+    "keygen",
+    "link",
+    "menuitem",
+    "meta",
+    "nextid",
+    "param",
+    "source",
+    "spacer",
+    "track",
+    "wbr",
+}
+# base64 characters decoded per step, a multiple of 4 so steps line up
+DECODE_CHUNK = 16 * 1024
+
+_DECIMAL_REFERENCE = re.compile("^([0-9]+)(.*)")
+_HEX_REFERENCE = re.compile("^([0-9a-f]+)(.*)")
+
+
+def numeric_reference(number: int) -> str:
+    """Return the character for ``&#number;`` following the HTML spec."""
+    if number == 0 or number > 0x10FFFF or 0xD800 <= number <= 0xDFFF:
+        return "\ufffd"
+    if 0x80 <= number <= 0x9F:
+        # C1 controls were usually meant as Windows-1252 characters
+        try:
+            return bytes([number]).decode("cp1252")
+        except UnicodeDecodeError:
+            pass
+    return chr(number)
+
+
+class TextExtractor(HTMLParser):
+    """Collect the words of an HTML document as ``BeautifulSoup`` sees them.
+
+    Produces the same words as parsing with ``html.parser``, replacing every
+    ``<a>`` with its text and calling ``get_text(separator=" ")``. Text in
+    ``<script>``, ``<style>`` and ``<template>`` and comments are skipped, and
+    the text of a link is joined without separators. No tree is built, and
+    callers can stop feeding once ``words`` holds enough.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.words: list[str] = []
+        self.stack: list[str] = []
+        self.data: list[str] = []
+        self.link: list[str] = []
+        self.links = 0
+        self.hidden = 0
+        self.closed_void: list[str] = []
+        self.stalled = False
+
+    def feed(self, data):
+        # CODEX: after a malformed "&#" reference html.parser stops parsing
+        # until close() when given the whole document at once. Buffer the
+        # rest the same way so chunked input gives the same text.
+        if self.stalled:
+            self.rawdata += data
+        else:
+            super().feed(data)
+
+    def _push(self, tag: str) -> None:
+        self.stack.append(tag)
+        if tag == "a":
+            self.links += 1
+        elif tag in HIDDEN_TAGS:
+            self.hidden += 1
+
+    def _pop_to(self, tag: str) -> None:
+        if tag not in self.stack:
+            return
+        while self.stack:
+            name = self.stack.pop()
+            if name == "a":
+                self.links -= 1
+                if not self.links:
+                    # CODEX: a whole link becomes one string
+                    self.words.extend("".join(self.link).split())
+                    self.link = []
+            elif name in HIDDEN_TAGS:
+                self.hidden -= 1
+            if name == tag:
+                return
+
+    def _end_data(self) -> None:
+        """Finish the current string, like ``BeautifulSoup.endData``."""
+        if not self.data:
+            return
+        text = "".join(self.data)
+        self.data = []
+        if self.links:
+            self.link.append(text)
+        elif not self.hidden:
+            self.words.extend(text.split())
+
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+        self._push(tag)
+        if tag in VOID_TAGS:
+            self._pop_to(tag)
+            self.closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._end_data()
+        self._push(tag)
+        self._pop_to(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            # CODEX: an end tag for a void element is ignored without even
+            # ending the current string, as BeautifulSoup does
+            self.closed_void.remove(tag)
+            return
+        self._end_data()
+        self._pop_to(tag)
+
+    def handle_data(self, data):
+        if data == "&#":
+            # only sent by html.parser when it gives up on a reference
+            self.stalled = True
+        if not self.hidden:
+            self.data.append(data)
+
+    def handle_entityref(self, name):
+        char = html5.get(name + ";")
+        self.handle_data(char if char is not None else f"&{name}")
+
+    def handle_charref(self, name):
+        prefix = ""
+        pattern = _DECIMAL_REFERENCE
+        digits = name
+        if name[:1] in ("x", "X"):
+            prefix, digits, pattern = "x", name[1:], _HEX_REFERENCE
+        extra = ""
+        base = 16 if prefix else 10
+        try:
+            number = int(digits, base)
+        except ValueError:
+            match = pattern.search(digits)
+            if match is None:
+                self.handle_data(digits)
+                return
+            digits, extra = match.groups()
+            number = int(digits, base)
+        self.handle_data(numeric_reference(number))
+        if extra:
+            self.handle_data(extra)
+
+    def handle_comment(self, data):
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+        if data.upper().startswith("CDATA["):
+            # CDATA sections count as text, declarations don't
+            self.handle_data(data[len("CDATA[") :])  # noqa: E203
+            self._end_data()
+
+    def close(self):
+        super().close()
+        self._end_data()
+        if self.stack:
+            self._pop_to(self.stack[0])
+
+
+def decode_base64_chunks(data: str, chunk_size: int = DECODE_CHUNK):
+    """Yield the UTF-8 text of a base64url Gmail body a chunk at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    for start in range(0, len(data), chunk_size):
+        raw = base64.urlsafe_b64decode(data[start : start + chunk_size])  # noqa: E203
+        yield decoder.decode(raw)
+    yield decoder.decode(b"", final=True)
+
+
+def html_to_text(chunks, max_words: int | None = None) -> str:
+    """Return the visible text of HTML fed as ``chunks``.
+
+    With ``max_words`` parsing stops once that many words are found and only
+    those words are returned.
+    """
+    parser = TextExtractor()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if max_words is not None and len(parser.words) >= max_words:
+            break
+    else:
+        parser.close()
+    words = parser.words if max_words is None else parser.words[:max_words]
+    return " ".join(words)
+
+
+def plain_to_text(chunks, max_words: int | None = None) -> str:
+    """Return plain text fed as ``chunks`` with URLs and extra spaces removed."""
+    text = ""
+    words = []
+    for chunk in chunks:
+        text += chunk
+        if max_words is None:
+            continue
+        # CODEX: only clean up to the last whitespace so no URL is cut short
+        cut = max(text.rfind(c) for c in " \t\r\n")
+        if cut <= 0:
+            continue
+        words += re.sub(r"https?://\S+", "", text[:cut]).split()
+        text = text[cut:]
+        if len(words) >= max_words:
+            return " ".join(words[:max_words])
+    words += re.sub(r"https?://\S+", "", text).split()
+    if max_words is not None:
+        words = words[:max_words]
+    return " ".join(words)
@@ -0,0 +1,234 @@
+import collections
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from quota import backoff_delay
+
+# responses worth trying again after a pause
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# request latencies kept for the percentiles in stats()
+LATENCY_WINDOW = 500
+
+
+class LLMError(Exception):
+    """A chat completion that failed after all of its attempts."""
+
+
+class CircuitOpenError(LLMError):
+    """Raised without sending anything while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to an endpoint that keeps failing.
+
+    After ``threshold`` failed calls in a row the circuit opens and calls are
+    rejected for ``reset_after`` seconds. Then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.trial or time.monotonic() - self.opened_at >= self.reset_after:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> tuple[bool, bool]:
+        """Return whether a call may go ahead now and whether it is the trial.
+
+        The caller of a trial call must end it with :meth:`release`.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True, False
+            if self.trial or time.monotonic() - self.opened_at < self.reset_after:
+                return False, False
+            self.trial = True
+            return True, True
+
+    def release(self) -> None:
+        """End the trial call, whatever became of it.
+
+        A trial that said nothing about the endpoint's health, such as one
+        rejected as a bad request, leaves the circuit as it was and the next
+        call becomes the trial.
+        """
+        with self.lock:
+            self.trial = False
+
+    def record(self, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class LLMClient:
+    """OpenRouter chat completions over a shared keep-alive connection pool.
+
+    Every request has connect and read timeouts. Network errors, 429s and
+    5xx responses are retried up to ``max_attempts`` times after a capped,
+    jittered backoff, or after ``Retry-After`` when the response sets it.
+    Calls that still fail count towards the circuit breaker, which then
+    fails calls at once instead of sending them.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 90.0,
+        max_attempts: int = 3,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 20.0,
+        failure_threshold: int = 5,
+        reset_after: float = 60.0,
+        logger: logging.Logger | None = None,
+    ):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+        self.logger = logger or logging.getLogger(__name__)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counts = {"calls": 0, "requests": 0, "retries": 0, "failures": 0}
+        self.errors: dict[str, int] = {}
+
+    def _record(self, seconds: float, status) -> None:
+        metrics.LLM_REQUEST_SECONDS.observe(seconds)
+        metrics.LLM_RESPONSES.inc(status=status)
+        with self.lock:
+            self.counts["requests"] += 1
+            self.latencies.append(seconds)
+            if status != 200:
+                self.errors[str(status)] = self.errors.get(str(status), 0) + 1
+
+    def chat(self, model: str, messages: list[dict], api_key: str) -> str:
+        """Return the answer to a chat completion request.
+
+        Raises :class:`LLMError` if no answer could be had, and
+        :class:`CircuitOpenError` if the circuit breaker is open.
+        """
+        with self.lock:
+            self.counts["calls"] += 1
+        allowed, trial = self.breaker.allow()
+        if not allowed:
+            metrics.LLM_RESPONSES.inc(status="circuit_open")
+            with self.lock:
+                self.counts["failures"] += 1
+            raise CircuitOpenError("OpenRouter circuit breaker is open")
+        try:
+            return self._send(model, messages, api_key)
+        finally:
+            # CODEX: a trial call must always end, or the circuit would never
+            # let another call through after e.g. a 400 on the trial. Other
+            # calls leave the trial alone so only one probe runs at a time
+            if trial:
+                self.breaker.release()
+
+    def _send(self, model: str, messages: list[dict], api_key: str) -> str:
+        url = f"{self.base_url.rstrip('/')}/chat/completions"
+        data = {"model": model, "messages": messages}
+        headers = {"Authorization": f"Bearer {api_key}"}
+        error = "no attempts made"
+        transient = True
+        for attempt in range(self.max_attempts):
+            self.logger.debug("OpenRouter request: %s", data)
+            start = time.perf_counter()
+            try:
+                resp = self.session.post(
+                    url, json=data, headers=headers, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                self._record(time.perf_counter() - start, "error")
+                error, transient, retry_after = f"{type(e).__name__}: {e}", True, None
+            else:
+                elapsed = time.perf_counter() - start
+                self._record(elapsed, resp.status_code)
+                self.logger.debug(
+                    "OpenRouter response %s: %s", resp.status_code, resp.text
+                )
+                self.logger.info(
+                    "OpenRouter response %s received %d characters after %.2f seconds",
+                    resp.status_code,
+                    len(resp.text),
+                    elapsed,
+                )
+                if resp.status_code == 200:
+                    try:
+                        answer = resp.json()["choices"][0]["message"]["content"]
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        error, transient = "malformed response", False
+                        break
+                    self.breaker.record(True)
+                    return answer
+                error = f"{resp.status_code} - {resp.text[:500]}"
+                transient = resp.status_code in RETRY_STATUSES
+                retry_after = resp.headers.get("Retry-After")
+            if not transient or attempt + 1 == self.max_attempts:
+                break
+            try:
+                delay = min(self.backoff_cap, float(retry_after))
+            except (TypeError, ValueError):
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+            reason = error.split(" ", 1)[0].rstrip(":")
+            metrics.LLM_RETRIES.inc(reason=reason)
+            with self.lock:
+                self.counts["retries"] += 1
+            self.logger.warning(
+                "OpenRouter attempt %d failed (%s), retrying in %.1fs",
+                attempt + 1,
+                error,
+                delay,
+            )
+            time.sleep(delay)
+        # CODEX: only failures that say the endpoint is unwell trip the
+        # breaker, not a request it rejected as bad
+        if transient:
+            self.breaker.record(False)
+        with self.lock:
+            self.counts["failures"] += 1
+        raise LLMError(f"OpenRouter error: {error}")
+
+    def stats(self) -> dict:
+        """Return call counts, error counts, latency percentiles and circuit state."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            data = dict(self.counts, errors=dict(self.errors))
+        if latencies:
+            data["latency_seconds"] = {
+                "mean": round(sum(latencies) / len(latencies), 3),
+                "p50": round(latencies[len(latencies) // 2], 3),
+                "p95": round(latencies[int(len(latencies) * 0.95)], 3),
+                "max": round(latencies[-1], 3),
+            }
+        data["circuit"] = self.breaker.state
+        return data
@@ -0,0 +1,258 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds, from fast SQLite calls to slow LLM requests
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+REGISTRY: list["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """A named family of values, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labels
+        self.lock = threading.Lock()
+        self.values: dict[tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...], extra: tuple = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def samples(self):
+        """Yield ``(suffix, labels, value)`` for every series."""
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in sorted(items):
+            yield "", self._labels(key), value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.values.clear()
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative ``le`` buckets with a sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the ``with`` block took, even if it raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(k, (list(c), s)) for k, (c, s) in self.values.items()]
+        for key, (counts, total) in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", self._labels(key, [("le", _number(bound))]), cumulative
+            yield "_sum", self._labels(key), total
+            yield "_count", self._labels(key), cumulative
+
+
+def timed(histogram: Histogram):
+    """Decorate a function to observe its run time labelled by its name."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(function=fn.__name__):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """Return every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# CODEX: metrics are module level so database.py and app.py share them
+GMAIL_LIST_PAGE_SECONDS = Histogram(
+    "gmail_list_page_seconds",
+    "Time to list one page of Gmail messages or history.",
+    ("source",),
+)
+GMAIL_BATCH_SECONDS = Histogram(
+    "gmail_batch_seconds",
+    "Time for one Gmail batch of message fetches.",
+    ("format",),
+)
+GMAIL_BATCH_MESSAGES = Counter(
+    "gmail_batch_messages_total",
+    "Messages requested in Gmail fetch batches.",
+    ("format",),
+)
+GMAIL_FETCH_RETRIES = Counter(
+    "gmail_fetch_retries_total",
+    "Message fetches sent again after a retryable error.",
+    ("reason",),
+)
+GMAIL_FETCH_FAILURES = Counter(
+    "gmail_fetch_failures_total",
+    "Message fetches given up on.",
+)
+GMAIL_REQUEST_SECONDS = Histogram(
+    "gmail_request_seconds",
+    "Time for Gmail label and filter changes.",
+    ("method",),
+)
+GMAIL_REQUEST_ERRORS = Counter(
+    "gmail_request_errors_total",
+    "Gmail label and filter changes that returned an error.",
+    ("method", "status"),
+)
+EXTRACT_SECONDS = Histogram(
+    "email_extract_seconds",
+    "Time to extract the text of an email body.",
+    ("mime_type",),
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds",
+    "Time for an OpenRouter chat completion request.",
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "OpenRouter requests sent again, by the status or error of the failed one.",
+    ("reason",),
+)
+LLM_CIRCUIT_OPEN = Gauge(
+    "llm_circuit_open",
+    "1 while the OpenRouter circuit breaker is open or half open.",
+)
+LLM_CACHE_LOOKUPS = Counter(
+    "llm_cache_lookups_total",
+    "LLM verdict cache lookups, by whether they hit or missed.",
+    ("result",),
+)
+LLM_BATCH_EMAILS = Counter(
+    "llm_batch_emails_total",
+    "Emails sent in multi-email LLM requests, by whether the answer covered "
+    "them or they were sent again on their own.",
+    ("outcome",),
+)
+LLM_RESPONSES = Counter(
+    "llm_responses_total",
+    "OpenRouter responses by HTTP status, or error when no response came.",
+    ("status",),
+)
+DB_SECONDS = Histogram(
+    "sqlite_call_seconds",
+    "Time spent in each database function.",
+    ("function",),
+)
+CLASSIFICATIONS = Counter(
+    "email_classifications_total",
+    "Scanned emails by outcome and by what decided it: rule, local, llm or cache.",
+    ("status", "source"),
+)
+SENDER_RULE_HITS = Counter(
+    "sender_rule_hits_total",
+    "Scanned emails matched by a sender rule, by the kind of rule.",
+    ("kind",),
+)
+LOCAL_CLASSIFIER_COMPARISONS = Counter(
+    "local_classifier_comparisons_total",
+    "LLM verdicts on a sample of the local classifier's confident verdicts, "
+    "by whether they agreed.",
+    ("agreed",),
+)
+ACTIVE_TASKS = Gauge(
+    "tasks_active",
+    "Tasks held in memory by stage and kind.",
+    ("stage", "kind"),
+)
+JOBS = Gauge(
+    "jobs",
+    "Stored background jobs by status.",
+    ("status",),
+)
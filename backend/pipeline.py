@@ -0,0 +1,223 @@
+import contextvars
+import heapq
+import queue
+import threading
+import time
+
+# seconds a stage worker waits on its queue before checking for shutdown
+POLL_INTERVAL = 0.1
+
+
+class Stage:
+    """A pipeline step run by one or more worker threads.
+
+    ``fn(item, emit)`` handles one item and calls ``emit`` for each item passed
+    on to the next stage. ``finish(emit)`` runs once after the last item.
+    Ordered stages receive items sorted by their ``seq`` key, which must count
+    up from 0 without gaps. Items more than ``queue_size`` ahead of the next
+    one due are held by their sender, so early items can't pile up while a
+    slow one is awaited.
+    """
+
+    def __init__(
+        self, name, fn, *, workers=1, queue_size=0, ordered=False, finish=None
+    ):
+        if ordered and workers != 1:
+            raise ValueError("Ordered stages must have a single worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.ordered = ordered
+        self.finish = finish
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.upstream_done = threading.Event()
+        self.lock = threading.Lock()
+        self.running = workers
+        self.active = 0
+        self.processed = 0
+        self.busy = 0.0
+        # seq of the next item an ordered stage will hand to its worker
+        self.expected = 0
+        self.reorder = threading.Condition()
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "active": self.active,
+            "processed": self.processed,
+            "per_second": round(self.processed / elapsed, 2) if elapsed else 0.0,
+            "busy_seconds": round(self.busy, 2),
+        }
+
+
+class Pipeline:
+    """Stages joined by bounded queues, fed from a source iterable.
+
+    A full queue blocks the stage writing to it, so a slow stage holds back
+    the ones before it instead of buffering the whole scan in memory. The first
+    exception raised by any stage stops the pipeline and is re-raised by
+    :meth:`run`.
+    """
+
+    def __init__(self, source_name: str = "source"):
+        self.source_name = source_name
+        self.source_processed = 0
+        self.stages: list[Stage] = []
+        self.abort = threading.Event()
+        self.error: BaseException | None = None
+        self.started = None
+
+    def add_stage(self, name, fn, **kwargs) -> Stage:
+        stage = Stage(name, fn, **kwargs)
+        self.stages.append(stage)
+        return stage
+
+    def stats(self) -> dict:
+        """Return queue depth and throughput for every stage."""
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        data = {
+            self.source_name: {
+                "workers": 1,
+                "queued": 0,
+                "processed": self.source_processed,
+                "per_second": (
+                    round(self.source_processed / elapsed, 2) if elapsed else 0.0
+                ),
+            }
+        }
+        for stage in self.stages:
+            data[stage.name] = stage.stats(elapsed)
+        return data
+
+    def run(self, source, *, on_tick=None, tick_interval: float = 1.0) -> None:
+        """Feed ``source`` through the stages and wait for them to finish.
+
+        ``on_tick`` is called from the calling thread every ``tick_interval``
+        seconds while the pipeline runs.
+        """
+        self.started = time.monotonic()
+        threads = [
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._feed, source),
+                name=f"pipeline-{self.source_name}",
+                daemon=True,
+            )
+        ]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(
+                    threading.Thread(
+                        # each worker gets its own copy of the caller's context
+                        target=contextvars.copy_context().run,
+                        args=(self._work, index),
+                        name=f"pipeline-{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(tick_interval)
+                if on_tick and thread.is_alive():
+                    on_tick()
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, exc: BaseException) -> None:
+        if self.error is None:
+            self.error = exc
+        self.abort.set()
+
+    def _put(self, stage: Stage, item) -> None:
+        window = stage.queue.maxsize
+        if stage.ordered and window:
+            with stage.reorder:
+                while (
+                    item["seq"] >= stage.expected + window and not self.abort.is_set()
+                ):
+                    stage.reorder.wait(POLL_INTERVAL)
+        while not self.abort.is_set():
+            try:
+                stage.queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def _emitter(self, index: int):
+        if index + 1 >= len(self.stages):
+            return lambda item: None
+        target = self.stages[index + 1]
+        return lambda item: self._put(target, item)
+
+    def _feed(self, source) -> None:
+        emit = self._emitter(-1)
+        try:
+            for item in source:
+                if self.abort.is_set():
+                    break
+                emit(item)
+                self.source_processed += 1
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            if self.stages:
+                self.stages[0].upstream_done.set()
+
+    def _items(self, stage: Stage):
+        """Yield queued items until the upstream stage has finished."""
+        while not self.abort.is_set():
+            try:
+                yield stage.queue.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if stage.upstream_done.is_set() and stage.queue.empty():
+                    return
+
+    def _ordered_items(self, stage: Stage):
+        """Yield items by ``seq``, holding back any that arrive early."""
+        waiting = []
+        expected = 0
+        for item in self._items(stage):
+            heapq.heappush(waiting, (item["seq"], id(item), item))
+            while waiting and waiting[0][0] == expected:
+                yield heapq.heappop(waiting)[2]
+                expected += 1
+                with stage.reorder:
+                    stage.expected = expected
+                    stage.reorder.notify_all()
+        # CODEX: only reached with gaps after an abort or a missing item
+        while waiting and not self.abort.is_set():
+            yield heapq.heappop(waiting)[2]
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        emit = self._emitter(index)
+        items = self._ordered_items(stage) if stage.ordered else self._items(stage)
+        try:
+            for item in items:
+                started = time.monotonic()
+                with stage.lock:
+                    stage.active += 1
+                try:
+                    stage.fn(item, emit)
+                finally:
+                    with stage.lock:
+                        stage.active -= 1
+                        stage.processed += 1
+                        stage.busy += time.monotonic() - started
+        except BaseException as exc:
+            self._fail(exc)
+        finally:
+            with stage.lock:
+                stage.running -= 1
+                last = stage.running == 0
+            if last:
+                try:
+                    if stage.finish and not self.abort.is_set():
+                        stage.finish(emit)
+                except BaseException as exc:
+                    self._fail(exc)
+                if index + 1 < len(self.stages):
+                    self.stages[index + 1].upstream_done.set()
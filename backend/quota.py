@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+class QuotaLimiter:
+    """Token bucket for one user's Gmail quota units with adaptive batching.
+
+    Tokens refill at ``rate`` units per second up to ``burst`` units, and a
+    request larger than the bucket may run once it is full, leaving a debt
+    that later requests wait out.
+    A rate limit response halves the rate, the batch size and the number of
+    batches allowed in flight, and pauses callers for any ``Retry-After``.
+    Each clean batch raises them again a step at a time, so throughput
+    settles just below the point where Gmail starts rejecting requests.
+    """
+
+    def __init__(
+        self,
+        units_per_second: float,
+        *,
+        batch_size: int = 20,
+        min_batch_size: int = 5,
+        max_batch_size: int = 50,
+        concurrency: int = 2,
+        max_concurrency: int = 4,
+        burst: float | None = None,
+    ):
+        self.ceiling = units_per_second
+        self.burst = burst or units_per_second / 10
+        self.min_rate = units_per_second / 16
+        self.rate = units_per_second
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.clean_batches = 0
+        self.units_used = 0
+        self.throttled = 0
+        self.cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, units: float) -> None:
+        """Block until ``units`` of quota are available and take them."""
+        needed = min(units, self.burst)
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= needed:
+                        self.tokens -= units
+                        self.units_used += units
+                        return
+                    wait = (needed - self.tokens) / self.rate
+                self.cond.wait(wait)
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the batches this user may have in flight."""
+        with self.cond:
+            while self.in_flight >= self.concurrency:
+                self.cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def throttled_by_server(self, retry_after: float | None = None) -> None:
+        """Back off after Gmail rejected requests for exceeding the quota."""
+        with self.cond:
+            now = time.monotonic()
+            self.throttled += 1
+            self.clean_batches = 0
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.concurrency = max(1, self.concurrency // 2)
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self.cond.notify_all()
+
+    def succeeded(self) -> None:
+        """Step the rate, batch size and concurrency back up after a clean batch."""
+        with self.cond:
+            self.clean_batches += 1
+            self.rate = min(self.ceiling, self.rate + self.ceiling / 10)
+            self.batch_size = min(self.max_batch_size, self.batch_size + 2)
+            if self.clean_batches % 5 == 0:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "rate": round(self.rate, 1),
+                "batch_size": self.batch_size,
+                "concurrency": self.concurrency,
+                "units_used": self.units_used,
+                "throttled": self.throttled,
+            }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Return a jittered exponential delay for ``attempt`` of at most ``cap``."""
+    delay = min(cap, base * 2**attempt)
+    return random.uniform(delay / 2, delay)
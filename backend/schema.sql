@@ -10,6 +10,8 @@ CREATE TABLE IF NOT EXISTS gmail_users (
     user_id TEXT NOT NULL
 );
 
+-- CODEX: extra_json holds the task's kind and scan statistics, written when a
+-- finished task is evicted from memory
 CREATE TABLE IF NOT EXISTS tasks (
     id TEXT PRIMARY KEY,
     user_id TEXT NOT NULL,
@@ -17,13 +19,37 @@ CREATE TABLE IF NOT EXISTS tasks (
     progress INTEGER,
     total INTEGER,
     emails_json TEXT,
-    log_json TEXT
+    log_json TEXT,
+    extra_json TEXT
 );
 
+-- CODEX: Task emails and log entries are appended as individual rows so
+-- progress updates never rewrite the whole task
+CREATE TABLE IF NOT EXISTS task_emails (
+    task_id TEXT NOT NULL,
+    email_id TEXT NOT NULL,
+    status TEXT,
+    email_json TEXT NOT NULL,
+    PRIMARY KEY (task_id, email_id)
+);
+
+CREATE TABLE IF NOT EXISTS task_log (
+    task_id TEXT NOT NULL,
+    entry_json TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_task_log_task ON task_log (task_id);
+
+-- CODEX: kind and pattern are the normalised rule a sender matches on (an
+-- address, a domain or a domain with its subdomains) and domain is its
+-- registrable domain
 CREATE TABLE IF NOT EXISTS senders (
     user_id TEXT NOT NULL,
     sender TEXT NOT NULL,
     status TEXT NOT NULL,
+    kind TEXT,
+    pattern TEXT,
+    domain TEXT,
     PRIMARY KEY (user_id, sender)
 );
 
@@ -35,6 +61,93 @@ CREATE TABLE IF NOT EXISTS email_status (
     subject TEXT,
     sender TEXT,
     date TEXT,
+    date_epoch INTEGER,
     filter_created INTEGER DEFAULT 0,
     PRIMARY KEY (user_id, email_id)
 );
+
+-- CODEX: Cached LLM verdicts keyed by a hash of model, system prompt and email
+-- text so identical emails are not sent to the LLM twice
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used);
+
+-- CODEX: Gmail history id reached by the last complete scan and the earliest
+-- date that scan covered, used for incremental syncs
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,
+    history_id TEXT NOT NULL,
+    synced_after TEXT NOT NULL
+);
+
+-- CODEX: background jobs for the worker pool. Pending and running jobs with
+-- the same dedupe_key are not queued twice
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    task_id TEXT,
+    payload_json TEXT NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_dedupe ON jobs (dedupe_key)
+    WHERE status IN ('pending', 'running');
+
+-- CODEX: progress of a scan so it can resume after a crash. cursor counts the
+-- listed messages whose results are stored; label changes already sent for
+-- later messages wait in scan_pending_labels until their results are stored
+CREATE TABLE IF NOT EXISTS scan_checkpoints (
+    task_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    days INTEGER NOT NULL,
+    message_ids_json TEXT NOT NULL,
+    history_id TEXT,
+    synced_after TEXT,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    unprocessed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS scan_pending_labels (
+    task_id TEXT NOT NULL,
+    cursor INTEGER NOT NULL,
+    flush_json TEXT NOT NULL,
+    PRIMARY KEY (task_id, cursor)
+);
+
+-- CODEX: emails the local classifier learned from, with the label and hashed
+-- features it learned so a later change of status can take them back out
+CREATE TABLE IF NOT EXISTS classifier_examples (
+    user_id TEXT NOT NULL,
+    email_id TEXT NOT NULL,
+    sender TEXT,
+    spam INTEGER NOT NULL,
+    features_json TEXT NOT NULL,
+    PRIMARY KEY (user_id, email_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_classifier_examples_sender
+    ON classifier_examples (user_id, sender);
+
+-- CODEX: how often the LLM agreed with a sample of the local classifier's
+-- confident verdicts, halved now and then so recent checks weigh most
+CREATE TABLE IF NOT EXISTS classifier_checks (
+    user_id TEXT PRIMARY KEY,
+    checked REAL NOT NULL,
+    agreed REAL NOT NULL
+);
@@ -0,0 +1,139 @@
+from email.utils import parseaddr
+
+# CODEX: common two-part public suffixes so ``shop.co.uk`` is registrable and
+# ``co.uk`` isn't; other domains use their last two labels
+MULTI_PART_SUFFIXES = {
+    "ac.uk",
+    "co.uk",
+    "gov.uk",
+    "ltd.uk",
+    "me.uk",
+    "org.uk",
+    "plc.uk",
+    "com.au",
+    "net.au",
+    "org.au",
+    "co.nz",
+    "org.nz",
+    "co.jp",
+    "ne.jp",
+    "or.jp",
+    "co.kr",
+    "co.in",
+    "co.za",
+    "com.br",
+    "com.cn",
+    "com.hk",
+    "com.mx",
+    "com.sg",
+    "com.tr",
+}
+RULE_KINDS = ("address", "domain", "subdomain")
+
+
+def sender_address(sender: str | None) -> str:
+    """Return the lower-cased address of a ``From`` header, or ``""``."""
+    address = parseaddr(sender or "")[1].strip().lower()
+    return address if "@" in address else ""
+
+
+def registrable_domain(domain: str) -> str:
+    """Return the part of ``domain`` an organisation registers.
+
+    ``mail.shop.co.uk`` gives ``shop.co.uk`` and ``news.shop.com`` gives
+    ``shop.com``.
+    """
+    labels = domain.strip(".").lower().split(".")
+    size = 3 if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES else 2
+    return ".".join(labels[-size:])
+
+
+def parse_rule(sender: str) -> tuple[str, str] | None:
+    """Return the ``(kind, pattern)`` a stored sender matches on.
+
+    A ``From`` header or bare address targets that address, ``@shop.com``
+    or ``shop.com`` the domain itself, and ``*.shop.com`` the domain and all
+    its subdomains. Returns None for text that is none of these, and for a
+    wildcard over a whole public suffix such as ``*.com`` or ``*.co.uk``.
+    """
+    text = (sender or "").strip().lower()
+    if text.startswith("*."):
+        domain = text[2:].strip(".")
+        if "." not in domain or domain in MULTI_PART_SUFFIXES:
+            return None
+        return "subdomain", domain
+    if text.startswith("@"):
+        domain = text[1:].strip(".")
+        return ("domain", domain) if "." in domain else None
+    address = sender_address(sender)
+    if address:
+        return "address", address
+    if "." in text and not any(c in text for c in " <>@,;"):
+        return "domain", text.strip(".")
+    return None
+
+
+def normalise_sender(sender: str) -> dict:
+    """Return the ``kind``, ``pattern`` and registrable ``domain`` of a sender.
+
+    All three are None when the sender can't be used as a rule.
+    """
+    rule = parse_rule(sender)
+    if rule is None:
+        return {"kind": None, "pattern": None, "domain": None}
+    kind, pattern = rule
+    domain = pattern.rpartition("@")[2]
+    return {"kind": kind, "pattern": pattern, "domain": registrable_domain(domain)}
+
+
+class SenderRules:
+    """Sender rules compiled for fast matching.
+
+    Address and exact domain rules are dictionary lookups. Subdomain rules
+    live in a trie keyed by domain labels from the right, so a sender is
+    matched by walking its domain once. The most specific rule wins: an
+    address rule, then an exact domain, then the longest wildcard.
+    """
+
+    def __init__(self, rules=()):
+        self.addresses: dict[str, str] = {}
+        self.domains: dict[str, str] = {}
+        self.trie: dict = {}
+        self.size = 0
+        for kind, pattern, status in rules:
+            self.add(kind, pattern, status)
+
+    def add(self, kind: str, pattern: str, status: str) -> None:
+        if kind == "address":
+            self.addresses[pattern] = status
+        elif kind == "domain":
+            self.domains[pattern] = status
+        elif kind == "subdomain":
+            node = self.trie
+            for label in reversed(pattern.split(".")):
+                node = node.setdefault(label, {})
+            node[None] = status
+        else:
+            raise ValueError(f"Unknown sender rule kind {kind!r}")
+        self.size += 1
+
+    def match(self, sender: str | None) -> tuple[str, str] | None:
+        """Return the ``(status, kind)`` of the rule matching a sender."""
+        address = sender_address(sender)
+        if not address:
+            return None
+        status = self.addresses.get(address)
+        if status is not None:
+            return status, "address"
+        domain = address.rpartition("@")[2]
+        status = self.domains.get(domain)
+        if status is not None:
+            return status, "domain"
+        found = None
+        node = self.trie
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(None, found)
+        return (found, "subdomain") if found is not None else None
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# seconds between expiry sweeps triggered by reads
+PRUNE_INTERVAL = 30.0
+
+
+class BoundedStore(MutableMapping):
+    """A dict that evicts entries by age and by least recent use.
+
+    Reading or writing a key counts as using it; iterating and ``in`` don't.
+    Entries unused for ``ttl`` seconds are dropped, as are the least
+    recently used ones beyond ``max_entries``. Only entries for which
+    ``evictable(value)`` is true are ever dropped, so live ones stay however
+    many there are. ``on_evict(key, value)`` runs for each dropped entry
+    after the store's lock is released, so it may take other locks; until it
+    returns the entry can still be read, but is no longer listed.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int | None = None,
+        ttl: float | None = None,
+        evictable=None,
+        on_evict=None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictable = evictable or (lambda value: True)
+        self.on_evict = on_evict
+        self.data: OrderedDict = OrderedDict()
+        self.used: dict = {}
+        # evicted entries whose on_evict hasn't returned yet
+        self.evicting: dict = {}
+        self.evictions = 0
+        self.pruned_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key not in self.data:
+                return self.evicting[key]
+            value = self.data[key]
+            self._touch(key)
+            due = time.monotonic() - self.pruned_at >= PRUNE_INTERVAL
+        if due:
+            self.prune()
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        with self.lock:
+            self.data[key] = value
+            self._touch(key)
+        self.prune()
+
+    def __delitem__(self, key) -> None:
+        with self.lock:
+            del self.data[key]
+            del self.used[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.data or key in self.evicting
+
+    def __iter__(self):
+        # a snapshot, so callers may change the store while looping
+        with self.lock:
+            return iter(list(self.data))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def items(self):
+        """Return a snapshot of the entries without counting them as used."""
+        with self.lock:
+            return list(self.data.items())
+
+    def values(self):
+        """Return a snapshot of the values without counting them as used."""
+        with self.lock:
+            return list(self.data.values())
+
+    def _touch(self, key) -> None:
+        self.data.move_to_end(key)
+        self.used[key] = time.monotonic()
+
+    def _evict(self, key) -> None:
+        self.evicting[key] = self.data.pop(key)
+        self.used.pop(key, None)
+        self.evictions += 1
+
+    def prune(self) -> int:
+        """Drop expired entries and any over the size limit; return how many."""
+        with self.lock:
+            now = time.monotonic()
+            self.pruned_at = now
+            # oldest first, as entries are moved to the end when used
+            candidates = [k for k, v in self.data.items() if self.evictable(v)]
+            evicted = []
+            if self.ttl is not None:
+                for key in candidates:
+                    if now - self.used[key] < self.ttl:
+                        break
+                    evicted.append(key)
+            if self.max_entries is not None:
+                excess = max(0, len(self.data) - len(evicted) - self.max_entries)
+                evicted += candidates[len(evicted) :][:excess]  # noqa: E203
+            for key in evicted:
+                self._evict(key)
+        try:
+            for key in evicted:
+                if self.on_evict:
+                    self.on_evict(key, self.evicting[key])
+        finally:
+            with self.lock:
+                for key in evicted:
+                    self.evicting.pop(key, None)
+        return len(evicted)
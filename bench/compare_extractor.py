@@ -0,0 +1,218 @@
+"""Check the streaming body extractor against the BeautifulSoup version.
+
+Builds a corpus of marketing-style emails, runs every message through the
+original BeautifulSoup extractor and through ``extract_email_body``, and
+reports mismatches and timings as JSON. The whole body and the 500-word scan
+preview must both match. Extra fixtures can be added with ``--fixtures``: a
+directory of ``.html`` or ``.txt`` bodies or ``.json`` Gmail payloads.
+
+    python bench/compare_extractor.py --messages 200 --fixtures ~/mail
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+import database  # noqa: E402
+
+# CODEX: importing app creates its database, so keep it out of backend/
+WORKDIR = tempfile.mkdtemp(prefix="compare-extractor-")
+database.DB_PATH = os.path.join(WORKDIR, "bench.db")
+
+import app  # noqa: E402
+
+app.PROMPT_FILE = os.path.join(WORKDIR, "last_prompt.json")
+
+WORDS = (
+    "sale basket checkout order shipping free your cart items waiting "
+    "discount exclusive offer today only café naïve déjà vu 🎉 ✓ "
+    "unsubscribe preferences privacy policy view browser"
+).split()
+
+SNIPPETS = [
+    "<style>.x{{color:red}} td{{padding:0}}</style>",
+    "<script>var t = '{w} <b>not text</b>';</script>",
+    "<!-- {w} hidden comment -->",
+    "<a href='https://shop.example.com/{w}'>{w} <span>{w}</span>now</a>",
+    "<a href='#'><img src='x.png' alt='{w}'>{w}</a>",
+    "<p>{w} &amp; {w}&nbsp;{w} &#8217;s &#147;{w}&#148; &copy; &pound;5</p>",
+    "<table><tr><td>{w}</td><td><b>{w}</b>{w}</td></tr></table>",
+    "<div>{w}<br>{w}</br>{w}<br/>{w}<hr>{w}</div>",
+    "<template><p>{w} template</p><a>{w}</a></template>",
+    "<p>{w}<a>{w}<a>{w}</a>{w}</a>{w}</p>",
+    "<ul><li>{w}<li>{w}</ul>",
+    "<div><span>{w}</div>{w}</span>",
+    "<![CDATA[{w} cdata]]>",
+    "<p>{w} &unknown; &#x1F600; &#0; &#12abc;</p>",
+    "<h1 style='font-size:20px'>{w}\n\t {w}</h1>",
+]
+
+
+def reference_body(payload):
+    """The BeautifulSoup extractor the scan used before the streaming one."""
+
+    def collect_parts(part, results):
+        if (
+            part.get("mimeType") in ("text/plain", "text/html")
+            and not part.get("filename")
+            and "body" in part
+        ):
+            data = part["body"].get("data")
+            if data:
+                text = base64.urlsafe_b64decode(data).decode("utf-8", errors="ignore")
+                results.append((text, part.get("mimeType")))
+        for sub in part.get("parts", []):
+            collect_parts(sub, results)
+
+    def html_to_plain_text(html: str) -> str:
+        soup = BeautifulSoup(html, "html.parser")
+        for a in soup.find_all("a"):
+            a.replace_with(a.get_text())
+        text = soup.get_text(separator=" ")
+        text = re.sub(r"\s+", " ", text)
+        return text.strip()
+
+    parts = []
+    collect_parts(payload, parts)
+    html_part = next((t for t, m in parts if m == "text/html"), None)
+    if html_part:
+        return html_to_plain_text(html_part)
+    text_part = next((t for t, m in parts if m == "text/plain"), None)
+    if text_part:
+        text_part = re.sub(r"https?://\S+", "", text_part)
+        return re.sub(r"\s+", " ", text_part).strip()
+    return ""
+
+
+def encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode()).decode()
+
+
+def part(mime: str, text: str) -> dict:
+    return {"mimeType": mime, "body": {"data": encode(text)}}
+
+
+def fake_html(rng: random.Random, size: int) -> str:
+    chunks = ["<!DOCTYPE html><html><head><title>Offer</title></head><body>"]
+    length = 0
+    while length < size:
+        snippet = rng.choice(SNIPPETS).format(w=rng.choice(WORDS))
+        chunks.append(snippet)
+        length += len(snippet)
+    chunks.append("</body></html>")
+    return "".join(chunks)
+
+
+def fake_plain(rng: random.Random, words: int) -> str:
+    out = []
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.05:
+            word = f"https://shop.example.com/{word}?utm=1"
+        out.append(word)
+        out.append(rng.choice([" ", "\n", "\t", "  "]))
+    return "".join(out)
+
+
+def corpus(messages: int, seed: int):
+    rng = random.Random(seed)
+    for n in range(messages):
+        kind = n % 4
+        size = rng.choice([500, 5_000, 50_000, 250_000])
+        if kind == 0:
+            yield f"html-{n}", part("text/html", fake_html(rng, size))
+        elif kind == 1:
+            yield f"multipart-{n}", {
+                "mimeType": "multipart/alternative",
+                "parts": [
+                    part("text/plain", fake_plain(rng, size // 10)),
+                    part("text/html", fake_html(rng, size)),
+                ],
+            }
+        elif kind == 2:
+            yield f"plain-{n}", part("text/plain", fake_plain(rng, size // 5))
+        else:
+            yield f"nested-{n}", {
+                "mimeType": "multipart/mixed",
+                "parts": [
+                    {
+                        "mimeType": "multipart/alternative",
+                        "parts": [part("text/html", fake_html(rng, size))],
+                    },
+                    dict(part("text/html", "<p>attachment</p>"), filename="a.html"),
+                ],
+            }
+
+
+def load_fixtures(path: str):
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        with open(full, encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+        if name.endswith(".json"):
+            yield name, json.loads(content)
+        elif name.endswith(".html"):
+            yield name, part("text/html", content)
+        elif name.endswith(".txt"):
+            yield name, part("text/plain", content)
+
+
+def run(messages: int, seed: int, fixtures: str | None, max_words: int) -> dict:
+    app.logger.setLevel("INFO")
+    samples = list(corpus(messages, seed))
+    if fixtures:
+        samples += list(load_fixtures(fixtures))
+    timings = {"reference": 0.0, "streaming": 0.0, "streaming_preview": 0.0}
+    mismatches = []
+    for name, payload in samples:
+        start = time.perf_counter()
+        expected = reference_body(payload)
+        timings["reference"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        full, _ = app.extract_email_body(payload)
+        timings["streaming"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        preview, _ = app.extract_email_body(payload, max_words=max_words)
+        timings["streaming_preview"] += time.perf_counter() - start
+
+        if full != expected:
+            mismatches.append({"message": name, "check": "full"})
+        if preview != " ".join(expected.split()[:max_words]):
+            mismatches.append({"message": name, "check": "preview"})
+    return {
+        "messages": len(samples),
+        "mismatches": mismatches,
+        "seconds": {k: round(v, 3) for k, v in timings.items()},
+        "speedup_preview": round(
+            timings["reference"] / timings["streaming_preview"], 1
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", help="directory of extra email bodies")
+    parser.add_argument("--max-words", type=int, default=app.BODY_PREVIEW_WORDS)
+    args = parser.parse_args()
+    result = run(args.messages, args.seed, args.fixtures, args.max_words)
+    print(json.dumps(result, indent=2))
+    if result["mismatches"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Measure SQLite throughput with concurrent scan workers and status pollers.
+
+Writers mimic the scan worker (email status, task emails and progress) while
+readers mimic ``/scan-status`` polling. Results are printed as JSON.
+
+    python bench/db_concurrency.py --writers 4 --pollers 8 --seconds 10
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import database  # noqa: E402
+
+
+def run(writers: int, pollers: int, seconds: float) -> dict:
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def bump(key: str, n: int = 1) -> None:
+        with lock:
+            counts[key] += n
+
+    def writer(n: int) -> None:
+        user_id = f"user-{n}"
+        task = {"id": f"task-{n}", "user_id": user_id, "stage": "processing"}
+        database.save_task(task)
+        i = 0
+        while not stop.is_set():
+            email = {
+                "id": f"{n}-{i}",
+                "subject": f"Subject {i}",
+                "sender": f"Shop {i % 50} <shop{i % 50}@example.com>",
+                "date": "Mon, 06 Oct 2025 10:00:00 +0000",
+                "status": "not_spam",
+            }
+            try:
+                database.save_email_status(
+                    user_id,
+                    email["id"],
+                    email["status"],
+                    subject=email["subject"],
+                    sender=email["sender"],
+                    date=email["date"],
+                )
+                database.append_task_emails(task["id"], [email])
+                task["progress"] = i
+                database.save_task(task)
+                bump("writes", 3)
+            except Exception:
+                bump("errors")
+            i += 1
+
+    def poller(n: int) -> None:
+        user_id = f"user-{n % max(writers, 1)}"
+        while not stop.is_set():
+            try:
+                database.load_tasks(user_id)
+                bump("reads")
+            except Exception:
+                bump("errors")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=poller, args=(n,)) for n in range(pollers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "writers": writers,
+        "pollers": pollers,
+        "seconds": round(elapsed, 3),
+        "synchronous": database.DB_SYNCHRONOUS,
+        "writes": counts["writes"],
+        "reads": counts["reads"],
+        "errors": counts["errors"],
+        "writes_per_sec": round(counts["writes"] / elapsed, 1),
+        "reads_per_sec": round(counts["reads"] / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--pollers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        result = run(args.writers, args.pollers, args.seconds)
+        database.close_connections()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""In-memory stand-in for the Gmail API ``service`` object.
+
+Implements the calls the backend makes: message list (with the label,
+``in:``, ``is:`` and ``after:`` query terms it uses), get, modify,
+batchModify, batch HTTP requests, labels, filters, history and profile.
+Messages are generated from a seed, so a corpus of any size costs little
+memory until bodies are fetched. Every call is counted and can be given
+an injected latency.
+
+    from fake_gmail import FakeGmail
+    service = FakeGmail(1000, latency=0.01)
+"""
+
+import base64
+import datetime
+import random
+import threading
+import time
+from email.utils import format_datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+SPAM_PHRASE = "abandoned basket"
+WORDS = (
+    "order shipped delivery tracking invoice receipt newsletter sale offer "
+    "discount free shipping account update password security meeting agenda "
+    "project report weekly summary invitation event ticket booking travel"
+).split()
+SYSTEM_LABELS = ["INBOX", "UNREAD", "SPAM", "TRASH", "SENT"]
+
+
+class Request:
+    """A prepared call, run by ``execute`` or as part of a batch."""
+
+    def __init__(self, service, name, fn):
+        self.service = service
+        self.name = name
+        self.fn = fn
+
+    def execute(self):
+        self.service.record(self.name)
+        return self.fn()
+
+
+class BatchRequest:
+    def __init__(self, service):
+        self.service = service
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self):
+        self.service.record("batch")
+        for request, callback, request_id in self.requests:
+            try:
+                response, error = request.fn(), None
+                self.service.record(request.name, http=False)
+            except HttpError as e:
+                response, error = None, e
+            if callback:
+                callback(request_id, response, error)
+
+
+def http_error(status: int, message: str) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), message.encode())
+
+
+class FakeGmail:
+    """A synthetic mailbox of ``messages`` emails.
+
+    ``spam_ratio`` of the emails mention the spam phrase the fake OpenRouter
+    server looks for, and ``labelled_ratio`` already carry one of the filter
+    labels so ``/refresh-senders`` has senders to find. Emails come from
+    ``senders`` distinct addresses and are dated within the last two days.
+    """
+
+    def __init__(
+        self,
+        messages: int,
+        *,
+        seed: int = 1,
+        senders: int = 200,
+        spam_ratio: float = 0.3,
+        labelled_ratio: float = 0.1,
+        body_words: int = 800,
+        latency: float = 0.0,
+    ):
+        self.seed = seed
+        self.body_words = body_words
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls: dict[str, int] = {}
+        self.label_map = {name: {"id": name, "name": name} for name in SYSTEM_LABELS}
+        self.filter_list = []
+        self.history_id = 1000
+        self.mailbox = {}
+        rng = random.Random(seed)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name in ("whitelist", "spam-filter-ignore", "shopify-spam"):
+            self._create_label(name)
+        filter_labels = ["whitelist", "spam-filter-ignore", "shopify-spam"]
+        for n in range(messages):
+            sender_no = rng.randrange(senders)
+            sent = now - datetime.timedelta(seconds=rng.randrange(2 * 86400))
+            labels = ["INBOX", "UNREAD"]
+            if rng.random() < labelled_ratio:
+                labels.append(self.label_map[rng.choice(filter_labels)]["id"])
+            self.mailbox[f"msg{n:06d}"] = {
+                "id": f"msg{n:06d}",
+                "threadId": f"thread{n:06d}",
+                "labelIds": labels,
+                "internalDate": str(int(sent.timestamp() * 1000)),
+                "spam": rng.random() < spam_ratio,
+                "headers": [
+                    {
+                        "name": "From",
+                        "value": f"Shop {sender_no} <shop{sender_no}@example.com>",
+                    },
+                    {"name": "Subject", "value": f"{rng.choice(WORDS).title()} #{n}"},
+                    {"name": "Date", "value": format_datetime(sent)},
+                ],
+            }
+
+    # bookkeeping -------------------------------------------------------
+
+    def record(self, name: str, http: bool = True) -> None:
+        if http and self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _create_label(self, name: str) -> dict:
+        label = {"id": f"Label_{len(self.label_map) + 1}", "name": name}
+        self.label_map[name] = label
+        return label
+
+    def _label_id(self, name: str) -> str | None:
+        for label in self.label_map.values():
+            if label["name"].lower() == name.lower():
+                return label["id"]
+        return None
+
+    def _matches(self, message: dict, query: str | None) -> bool:
+        for term in (query or "").split():
+            key, _, value = term.partition(":")
+            if key in ("in", "label"):
+                label_id = self._label_id(value)
+                if label_id is None or label_id not in message["labelIds"]:
+                    return False
+            elif key == "is" and value == "unread":
+                if "UNREAD" not in message["labelIds"]:
+                    return False
+            elif key == "after":
+                after = datetime.datetime.strptime(value, "%Y-%m-%d")
+                after = after.replace(tzinfo=datetime.timezone.utc)
+                if int(message["internalDate"]) < after.timestamp() * 1000:
+                    return False
+        return True
+
+    def _words(self, message: dict) -> list[str]:
+        rng = random.Random(f"{self.seed}-{message['id']}")
+        words = [rng.choice(WORDS) for _ in range(self.body_words)]
+        if message["spam"]:
+            words.insert(rng.randrange(50), SPAM_PHRASE)
+        return words
+
+    def _html(self, words: list[str]) -> str:
+        rows = "".join(
+            f"<tr><td style='padding:8px'><a href='https://shop.example.com/{i}'>"
+            f"{' '.join(words[i:i + 20])}</a></td></tr>"
+            for i in range(0, len(words), 20)
+        )
+        return (
+            "<html><head><style>td{font-family:Arial}</style></head><body>"
+            f"<table>{rows}</table><!-- tracking pixel -->"
+            "<img src='https://shop.example.com/open.gif'></body></html>"
+        )
+
+    def _payload(self, message: dict, fmt: str, headers) -> dict:
+        data = {k: v for k, v in message.items() if k not in ("headers", "spam")}
+        data["labelIds"] = list(message["labelIds"])
+        wanted = {h.lower() for h in headers or []}
+        payload_headers = [
+            h
+            for h in message["headers"]
+            if fmt != "metadata" or not wanted or h["name"].lower() in wanted
+        ]
+        if fmt == "metadata":
+            data["sizeEstimate"] = 40 * self.body_words
+            data["payload"] = {
+                "mimeType": "multipart/alternative",
+                "headers": payload_headers,
+            }
+            return data
+        words = self._words(message)
+        html = self._html(words)
+        text = " ".join(words)
+        data["sizeEstimate"] = len(html)
+        data["payload"] = {
+            "mimeType": "multipart/alternative",
+            "headers": payload_headers,
+            "parts": [
+                {
+                    "mimeType": "text/plain",
+                    "body": {"data": base64.urlsafe_b64encode(text.encode()).decode()},
+                },
+                {
+                    "mimeType": "text/html",
+                    "body": {"data": base64.urlsafe_b64encode(html.encode()).decode()},
+                },
+            ],
+        }
+        return data
+
+    # resources ---------------------------------------------------------
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Messages(self)
+
+    def labels(self):
+        return _Labels(self)
+
+    def settings(self):
+        return self
+
+    def filters(self):
+        return _Filters(self)
+
+    def history(self):
+        return _History(self)
+
+    def getProfile(self, userId):
+        return Request(
+            self,
+            "users.getProfile",
+            lambda: {
+                "emailAddress": "bench@example.com",
+                "historyId": str(self.history_id),
+            },
+        )
+
+    def new_batch_http_request(self):
+        return BatchRequest(self)
+
+
+class _Messages:
+    PAGE_SIZE = 100
+
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def list(self, userId, q=None, pageToken=None, maxResults=None, **kwargs):
+        def run():
+            size = maxResults or self.PAGE_SIZE
+            ids = [
+                m["id"]
+                for m in self.gmail.mailbox.values()
+                if self.gmail._matches(m, q)
+            ]
+            start = int(pageToken or 0)
+            page = ids[start : start + size]  # noqa: E203
+            resp = {"messages": [{"id": i, "threadId": i} for i in page]}
+            if start + size < len(ids):
+                resp["nextPageToken"] = str(start + size)
+            resp["resultSizeEstimate"] = len(ids)
+            return resp
+
+        return Request(self.gmail, "messages.list", run)
+
+    def get(self, userId, id, format="full", metadataHeaders=None):
+        def run():
+            message = self.gmail.mailbox.get(id)
+            if message is None:
+                raise http_error(404, '{"error": {"message": "Not Found"}}')
+            return self.gmail._payload(message, format, metadataHeaders)
+
+        return Request(self.gmail, f"messages.get.{format}", run)
+
+    def _apply(self, ids, body):
+        with self.gmail.lock:
+            for msg_id in ids:
+                message = self.gmail.mailbox.get(msg_id)
+                if message is None:
+                    continue
+                labels = message["labelIds"]
+                for label in body.get("removeLabelIds", []):
+                    if label in labels:
+                        labels.remove(label)
+                for label in body.get("addLabelIds", []):
+                    if label not in labels:
+                        labels.append(label)
+        return {}
+
+    def modify(self, userId, id, body):
+        return Request(self.gmail, "messages.modify", lambda: self._apply([id], body))
+
+    def batchModify(self, userId, body):
+        return Request(
+            self.gmail,
+            "messages.batchModify",
+            lambda: self._apply(body.get("ids", []), body),
+        )
+
+
+class _Labels:
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def list(self, userId):
+        return Request(
+            self.gmail,
+            "labels.list",
+            lambda: {"labels": list(self.gmail.label_map.values())},
+        )
+
+    def create(self, userId, body):
+        def run():
+            with self.gmail.lock:
+                return self.gmail._create_label(body["name"])
+
+        return Request(self.gmail, "labels.create", run)
+
+
+class _Filters:
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def create(self, userId, body):
+        def run():
+            with self.gmail.lock:
+                if any(
+                    f["criteria"] == body["criteria"] for f in self.gmail.filter_list
+                ):
+                    raise http_error(
+                        400, '{"error": {"message": "Filter already exists"}}'
+                    )
+                self.gmail.filter_list.append(body)
+            return dict(body, id=f"filter{len(self.gmail.filter_list)}")
+
+        return Request(self.gmail, "filters.create", run)
+
+
+class _History:
+    def __init__(self, gmail: FakeGmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId=None, **kwargs):
+        # nothing is delivered while a benchmark runs
+        return Request(
+            self.gmail,
+            "history.list",
+            lambda: {"historyId": str(self.gmail.history_id)},
+        )
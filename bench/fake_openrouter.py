@@ -0,0 +1,135 @@
+"""Local stand-in for the OpenRouter ``/chat/completions`` endpoint.
+
+Replies ``<RESULT>YES</RESULT>`` when the user message contains the spam
+keyword and ``<RESULT>NO</RESULT>`` otherwise, after an injected delay.
+A message holding several ``<EMAIL id="...">`` blocks gets one
+``<RESULT id="...">`` verdict per email, and ``--drop-every N`` leaves out
+every Nth of those so the backend's fallback to single requests can be
+tried. Point the backend at it with ``OPENROUTER_BASE_URL``.
+
+    python bench/fake_openrouter.py --port 8099 --latency 2.0
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SPAM_KEYWORD = "abandoned basket"
+EMAIL_RE = re.compile(r'<EMAIL id="([^"]+)">(.*?)</EMAIL>', re.DOTALL)
+
+
+class FakeOpenRouterServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, drop_every: int = 0):
+        super().__init__(address, FakeOpenRouterHandler)
+        self.latency = latency
+        self.drop_every = drop_every
+        self.requests = 0
+        self.emails = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+
+class FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            data = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            time.sleep(server.latency)
+            content = " ".join(
+                m.get("content", "")
+                for m in data.get("messages", [])
+                if m.get("role") == "user"
+            )
+            emails = EMAIL_RE.findall(content)
+            if emails:
+                lines = []
+                for msg_id, text in emails:
+                    with server.lock:
+                        server.emails += 1
+                        drop = (
+                            server.drop_every and server.emails % server.drop_every == 0
+                        )
+                        server.dropped += bool(drop)
+                    if not drop:
+                        verdict = "YES" if SPAM_KEYWORD in text.lower() else "NO"
+                        lines.append(
+                            f'<RESULT id="{msg_id}">{verdict}</RESULT> fake verdict'
+                        )
+                answer = "\n".join(lines)
+            else:
+                with server.lock:
+                    server.emails += 1
+                verdict = "YES" if SPAM_KEYWORD in content.lower() else "NO"
+                answer = f"<RESULT>{verdict}</RESULT> fake verdict"
+            body = json.dumps(
+                {
+                    "model": data.get("model"),
+                    "choices": [
+                        {
+                            "message": {
+                                "role": "assistant",
+                                "content": answer,
+                            }
+                        }
+                    ],
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def start(
+    port: int = 0, latency: float = 0.0, drop_every: int = 0
+) -> FakeOpenRouterServer:
+    """Start the fake server in a background thread and return it."""
+    server = FakeOpenRouterServer(
+        ("127.0.0.1", port), latency=latency, drop_every=drop_every
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--drop-every", type=int, default=0)
+    args = parser.parse_args()
+    server = FakeOpenRouterServer(
+        ("127.0.0.1", args.port), latency=args.latency, drop_every=args.drop_every
+    )
+    print(f"Fake OpenRouter listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
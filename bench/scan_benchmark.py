@@ -0,0 +1,267 @@
+"""End-to-end scan benchmark against fake Gmail and OpenRouter services.
+
+For each mailbox size a fresh process builds a synthetic mailbox and a
+temporary database. It then drives the real ``/refresh-senders``,
+``/scan-emails`` and ``/confirm`` workers through the Flask test client.
+Results are printed as JSON: wall time per phase, scan pipeline stage
+timings, database writes, Gmail calls, LLM requests and peak RSS. Pass
+``--baseline`` with an earlier result to fail when a phase gets slower than
+``--tolerance`` allows.
+
+    python bench/scan_benchmark.py --sizes 100,1000,10000 --llm-latency 0.05
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCH_DIR, "..", "backend")
+USER_ID = "bench-user"
+PROMPT = "Is this an abandoned basket reminder from an online shop?"
+
+
+def wait_for_task(client, task_id: str, timeout: float, summaries: dict) -> dict:
+    """Poll ``/scan-status`` until the task is done or closed.
+
+    Workers record a summary when they exit, even after an error, so a
+    summary without a finished stage means the task failed.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        finished = task_id in summaries
+        status = client.get(f"/scan-status/{task_id}").get_json()
+        if status.get("stage") in ("done", "closed") or "summary" in status:
+            return status
+        if finished or "error" in status:
+            raise RuntimeError(f"task {task_id} failed: {status}")
+        time.sleep(0.05)
+    raise TimeoutError(f"task {task_id} did not finish in {timeout}s")
+
+
+def run_size(messages: int, args) -> dict:
+    """Benchmark one mailbox size inside the current process."""
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    workdir = tempfile.mkdtemp(prefix="scan-bench-")
+
+    import database
+
+    database.DB_PATH = os.path.join(workdir, "bench.db")
+    writes = {"statements": 0}
+    open_connection = database._open_connection
+
+    def counting_connection(path):
+        conn = open_connection(path)
+
+        def trace(statement):
+            if statement.lstrip().split(" ", 1)[0].upper() in (
+                "INSERT",
+                "UPDATE",
+                "DELETE",
+                "REPLACE",
+            ):
+                writes["statements"] += 1
+
+        conn.set_trace_callback(trace)
+        return conn
+
+    database._open_connection = counting_connection
+
+    import app
+    from fake_gmail import FakeGmail
+
+    app.PROMPT_FILE = os.path.join(workdir, "last_prompt.json")
+    gmail = FakeGmail(messages, seed=args.seed, latency=args.gmail_latency)
+    # CODEX: hand every worker the fake mailbox instead of a real API client
+    app.build = lambda *a, **k: gmail
+    database.save_token(
+        USER_ID,
+        json.dumps(
+            {
+                "token": "bench",
+                "refresh_token": "bench",
+                "client_id": "bench",
+                "client_secret": "bench",
+            }
+        ),
+    )
+
+    client = app.app.test_client()
+    client.set_cookie("user_id", USER_ID)
+    phases = {}
+
+    writes["statements"] = 0
+    start = time.perf_counter()
+    task_id = client.post("/refresh-senders").get_json()["task_id"]
+    wait_for_task(client, task_id, args.timeout, app.task_summaries)
+    phases["refresh"] = {
+        "seconds": round(time.perf_counter() - start, 3),
+        "db_writes": writes["statements"],
+    }
+
+    writes["statements"] = 0
+    start = time.perf_counter()
+    task_id = client.post(
+        "/scan-emails", json={"prompt": PROMPT, "days": 3}
+    ).get_json()["task_id"]
+    status = wait_for_task(client, task_id, args.timeout, app.task_summaries)
+    phases["scan"] = {
+        "seconds": round(time.perf_counter() - start, 3),
+        "db_writes": writes["statements"],
+        "emails": len(status.get("emails", [])),
+        "stages": status.get("pipeline", {}),
+        "fetch_savings": status.get("fetch_savings", {}),
+        "llm_cache": status.get("llm_cache", {}),
+    }
+
+    ids = [e["id"] for e in status.get("emails", [])]
+    writes["statements"] = 0
+    start = time.perf_counter()
+    # the scan left its summary behind, confirmation records a new one
+    app.task_summaries.pop(task_id, None)
+    client.post("/confirm", json={"ids": ids, "task_id": task_id})
+    wait_for_task(client, task_id, args.timeout, app.task_summaries)
+    phases["confirm"] = {
+        "seconds": round(time.perf_counter() - start, 3),
+        "db_writes": writes["statements"],
+        "emails": len(ids),
+    }
+
+    return {
+        "messages": messages,
+        "wall_seconds": round(sum(p["seconds"] for p in phases.values()), 3),
+        "phases": phases,
+        "db_writes": sum(p["db_writes"] for p in phases.values()),
+        "gmail_calls": dict(sorted(gmail.calls.items())),
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def find_regressions(results: list[dict], baseline: dict, tolerance: float) -> list:
+    """Return the phases that are slower than the baseline by more than tolerance."""
+    previous = {r["messages"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result["messages"])
+        if not before:
+            continue
+        for phase, data in result["phases"].items():
+            old = before["phases"].get(phase, {}).get("seconds")
+            if old and data["seconds"] > old * (1 + tolerance):
+                regressions.append(
+                    {
+                        "messages": result["messages"],
+                        "phase": phase,
+                        "seconds": data["seconds"],
+                        "baseline_seconds": old,
+                    }
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--gmail-latency", type=float, default=0.0)
+    parser.add_argument(
+        "--llm-batch-emails",
+        type=int,
+        default=1,
+        help="emails per OpenRouter request (sets LLM_BATCH_MAX_EMAILS)",
+    )
+    parser.add_argument(
+        "--llm-drop-every",
+        type=int,
+        default=0,
+        help="leave every Nth email out of multi-email answers",
+    )
+    parser.add_argument(
+        "--gmail-quota",
+        type=float,
+        default=1e9,
+        help="Gmail quota units per second (250 mimics the real per-user limit)",
+    )
+    parser.add_argument("--timeout", type=float, default=3600)
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--verbose", action="store_true", help="show backend logs")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args)))
+        return
+
+    import fake_openrouter
+
+    server = fake_openrouter.start(
+        latency=args.llm_latency, drop_every=args.llm_drop_every
+    )
+    env = dict(
+        os.environ,
+        OPENROUTER_API_KEY="bench",
+        OPENROUTER_BASE_URL=server.base_url,
+        GMAIL_QUOTA_PER_SECOND=str(args.gmail_quota),
+        LLM_BATCH_MAX_EMAILS=str(args.llm_batch_emails),
+    )
+    results = []
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        before = server.requests
+        emails_before = server.emails
+        # CODEX: one process per size so peak RSS isn't carried over
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(size)]
+            + [
+                f"--seed={args.seed}",
+                f"--gmail-latency={args.gmail_latency}",
+                f"--timeout={args.timeout}",
+            ],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+            check=True,
+            text=True,
+        )
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result["llm_requests"] = server.requests - before
+        result["llm_emails"] = server.emails - emails_before
+        results.append(result)
+
+    output = {
+        "settings": {
+            "llm_latency": args.llm_latency,
+            "llm_batch_emails": args.llm_batch_emails,
+            "llm_drop_every": args.llm_drop_every,
+            "gmail_latency": args.gmail_latency,
+            "gmail_quota": args.gmail_quota,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        output["regressions"] = regressions
+    text = json.dumps(output, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
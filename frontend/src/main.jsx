@@ -3,6 +3,8 @@ import ReactDOM from "react-dom/client";
 import "./App.css";
 
 const DEFAULT_POLL_INTERVAL = Number(import.meta.env.VITE_POLL_INTERVAL || 1);
+// CODEX: task stages after which there is nothing more to poll for
+const FINISHED_STAGES = ["done", "closed", "failed"];
 
 const DEFAULT_PROMPT =
   "Identify shopify abandoned basket emails, or emails from US companies that mention dollar prices or a US postal address.";
@@ -17,6 +19,18 @@ function formatDate(str) {
   return d.toLocaleDateString([], { day: "2-digit", month: "short" });
 }
 
+// CODEX: apply a /scan-status delta to the current email list
+function mergeEmails(prev, incoming, removed) {
+  const removedIds = new Set(removed);
+  const byId = new Map(
+    prev.filter((e) => !removedIds.has(e.id)).map((e) => [e.id, e]),
+  );
+  incoming.forEach((e) => byId.set(e.id, e));
+  return [...byId.values()].sort(
+    (a, b) => (Date.parse(b.date) || 0) - (Date.parse(a.date) || 0),
+  );
+}
+
 function EmailRow({ email, onStatus }) {
   const [open, setOpen] = useState(false);
   const toggle = () => setOpen(!open);
@@ -92,6 +106,8 @@ function EmailRow({ email, onStatus }) {
 function ManageSenders({ onClose }) {
   const [senders, setSenders] = useState([]);
   const [filter, setFilter] = useState("all");
+  const [newRule, setNewRule] = useState("");
+  const [newStatus, setNewStatus] = useState("spam");
 
   useEffect(() => {
     fetch("/senders")
@@ -116,6 +132,25 @@ function ManageSenders({ onClose }) {
       .catch(() => {});
   };
 
+  // CODEX: rules may name an address, a domain or *.domain for subdomains
+  const addRule = () => {
+    fetch("/senders", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ sender: newRule, status: newStatus }),
+    })
+      .then((r) => r.json().then((d) => ({ ok: r.ok, d })))
+      .then(({ ok, d }) => {
+        if (ok) {
+          setSenders((prev) => [...prev.filter((s) => s.sender !== d.sender), d]);
+          setNewRule("");
+        } else {
+          alert(d.error || "Failed to add sender rule");
+        }
+      })
+      .catch(() => {});
+  };
+
   const filtered =
     filter === "all" ? senders : senders.filter((s) => s.status === filter);
 
@@ -147,12 +182,26 @@ function ManageSenders({ onClose }) {
         >
           Ignore
         </button>
+        <input
+          value={newRule}
+          onChange={(e) => setNewRule(e.target.value)}
+          placeholder="name@shop.com, shop.com or *.shop.com"
+        />
+        <select value={newStatus} onChange={(e) => setNewStatus(e.target.value)}>
+          <option value="spam">Spam</option>
+          <option value="whitelist">Whitelist</option>
+          <option value="ignore">Ignore</option>
+        </select>
+        <button onClick={addRule} disabled={!newRule.trim()}>
+          Add Rule
+        </button>
       </header>
       <div className="email-list">
         <table>
           <thead>
             <tr>
               <th>Sender</th>
+              <th>Matches</th>
               <th>Status</th>
               <th className="actions"></th>
             </tr>
@@ -161,6 +210,9 @@ function ManageSenders({ onClose }) {
             {filtered.map((s) => (
               <tr key={s.sender} className={`status-${s.status}`}>
                 <td className="email-cell">{s.sender}</td>
+                <td>
+                  {s.kind === "subdomain" ? `*.${s.pattern}` : s.pattern || ""}
+                </td>
                 <td>{s.status}</td>
                 <td className="actions">
                   <button className="trash-btn" onClick={() => reset(s.sender)}>
@@ -187,6 +239,9 @@ function App() {
   // CODEX: track ids recently updated by the user to ignore incoming status
   const pendingRef = useRef(pendingStatuses);
   const ignoreStatusRef = useRef(new Set());
+  const versionRef = useRef(null); // CODEX: last task version received
+  const streamingRef = useRef(false); // CODEX: task events are being streamed
+  const stageRef = useRef(null); // CODEX: latest known stage of the task
   const [showSpam, setShowSpam] = useState(true);
   const [logLines, setLogLines] = useState([]);
   const [showLogs, setShowLogs] = useState(false);
@@ -197,7 +252,10 @@ function App() {
   }, [pendingStatuses]);
   useEffect(() => {
     if (!showLogs) return undefined;
-    const id = setInterval(fetchLogs, 1000);
+    // CODEX: log lines arrive with task events while a task is streaming
+    const id = setInterval(() => {
+      if (!streamingRef.current) fetchLogs();
+    }, 1000);
     return () => clearInterval(id);
   }, [showLogs]);
   const [showNotSpam, setShowNotSpam] = useState(true);
@@ -340,17 +398,98 @@ function App() {
       });
   };
 
+  // CODEX: continue an interrupted scan from its checkpoint
+  const resumeScan = () => {
+    fetch("/resume-scan", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ task_id: task.id }),
+    })
+      .then((r) => {
+        if (!r.ok) {
+          alert("Failed to resume scan");
+          throw new Error("resume");
+        }
+        return r.json();
+      })
+      .then((data) => {
+        setTask({ id: data.task_id });
+      })
+      .catch(() => {});
+  };
+
+  stageRef.current = task?.stage;
+
+  // CODEX: one event stream (or poll loop) per task id. Stage changes,
+  // including a finished scan moving on to confirming, arrive through it
+  // rather than reopening it
   useEffect(() => {
     if (!task || !task.id) return;
-    if (task.stage === "done" || task.stage === "closed") return;
     const intervalMs = DEFAULT_POLL_INTERVAL * 1000;
     let interval;
+    let source;
+    versionRef.current = null;
+    const stop = () => {
+      clearInterval(interval);
+      if (source) source.close();
+      streamingRef.current = false;
+    };
+    const applyStatus = (d) => {
+      if (d.summary) {
+        stop();
+        alert(d.summary.message || "Task complete");
+        setTask(null);
+        setEmails([]);
+        return;
+      }
+      const { emails: incoming = [], removed = [], delta, ...info } = d;
+      if (d.version) versionRef.current = d.version;
+      if (d.stage) stageRef.current = d.stage;
+      // CODEX: Preserve task id so polling continues
+      setTask((prev) => ({ ...prev, ...info }));
+      setEmails((prev) => {
+        const updated = incoming.map((e) => {
+          const prevEmail = prev.find((p) => p.id === e.id) || e;
+          const locked = ignoreStatusRef.current.has(e.id);
+          const status = locked
+            ? prevEmail.status
+            : pendingRef.current[e.id] || e.status;
+          return { ...e, status };
+        });
+        return delta ? mergeEmails(prev, updated, removed) : updated;
+      });
+      setPendingStatuses((prev) => {
+        const remaining = { ...prev };
+        incoming.forEach((e) => {
+          if (prev[e.id] && prev[e.id] === e.status) {
+            delete remaining[e.id];
+          }
+        });
+        return remaining;
+      });
+      if (d.stage === "closed") {
+        stop();
+        setTask(null);
+        setEmails([]);
+      }
+    };
     const fetchStatus = () => {
-      fetch(`/scan-status/${task.id}`)
+      // CODEX: a finished task only changes again once the user acts on it,
+      // which sets its stage here before polling picks it up
+      if (
+        versionRef.current !== null &&
+        FINISHED_STAGES.includes(stageRef.current)
+      ) {
+        return;
+      }
+      // CODEX: after the first response only ask for changed emails
+      const since =
+        versionRef.current === null ? "" : `?since=${versionRef.current}`;
+      fetch(`/scan-status/${task.id}${since}`)
         .then((r) => {
           if (r.status === 404) {
             // CODEX: stop polling when the task no longer exists
-            clearInterval(interval);
+            stop();
             setTask(null);
             setEmails([]);
             return null;
@@ -362,50 +501,39 @@ function App() {
           return r.json();
         })
         .then((d) => {
-          if (!d) return;
-          if (d.summary) {
-            alert(d.summary.message || "Task complete");
-            setTask(null);
-            setEmails([]);
-            return;
-          }
-          // CODEX: Preserve task id so polling continues
-          setTask((prev) => ({ ...prev, ...d }));
-          const incoming = d.emails || [];
-          setEmails((prev) =>
-            incoming.map((e) => {
-              const prevEmail = prev.find((p) => p.id === e.id) || e;
-              const locked = ignoreStatusRef.current.has(e.id);
-              const status = locked
-                ? prevEmail.status
-                : pendingRef.current[e.id] || e.status;
-              return { ...e, status };
-            }),
-          );
-          setPendingStatuses((prev) => {
-            const remaining = { ...prev };
-            incoming.forEach((e) => {
-              if (prev[e.id] && prev[e.id] === e.status) {
-                delete remaining[e.id];
-              }
-            });
-            return remaining;
-          });
-          if (d.stage === "done" || d.stage === "closed") {
-            clearInterval(interval);
-            if (d.stage === "closed") {
-              setTask(null);
-              setEmails([]);
-            }
-          }
+          if (d) applyStatus(d);
         })
         .catch(() => {});
     };
-    // CODEX: immediately check status on load
-    fetchStatus();
-    interval = setInterval(fetchStatus, intervalMs);
-    return () => clearInterval(interval);
-  }, [task?.id, task?.stage]);
+    const startPolling = () => {
+      // CODEX: immediately check status on load
+      fetchStatus();
+      interval = setInterval(fetchStatus, intervalMs);
+    };
+    if (window.EventSource) {
+      // CODEX: prefer server-sent events and fall back to polling if the
+      // stream can't be opened
+      source = new EventSource(`/tasks/${task.id}/events`);
+      streamingRef.current = true;
+      const onData = (ev) => applyStatus(JSON.parse(ev.data));
+      source.addEventListener("snapshot", onData);
+      source.addEventListener("delta", onData);
+      source.addEventListener("closed", onData);
+      source.addEventListener("log", (ev) => {
+        const { lines } = JSON.parse(ev.data);
+        setLogLines((prev) => [...prev, ...lines].slice(-200));
+      });
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+          streamingRef.current = false;
+          startPolling();
+        }
+      };
+    } else {
+      startPolling();
+    }
+    return stop;
+  }, [task?.id]);
 
   const updateStatus = (id, status) => {
     setPendingStatuses((prev) => ({ ...prev, [id]: status }));
@@ -491,6 +619,9 @@ function App() {
         <button onClick={openManage}>Manage</button>
         <button onClick={viewLogs}>View Logs</button>
         {task && <button onClick={clearTask}>Clear Task</button>}
+        {task && task.resumable && (
+          <button onClick={resumeScan}>Resume Scan</button>
+        )}
         {task && task.stage !== "done" && (
           <div className="progress">
             <div>
@@ -47,6 +47,12 @@ export default defineConfig({
         secure: false,
         agent: httpsAgent,
       },
+      "/resume-scan": {
+        target: backend,
+        changeOrigin: true,
+        secure: false,
+        agent: httpsAgent,
+      },
       "/update-status": {
         target: backend,
         changeOrigin: true,
@@ -96,6 +102,12 @@ export default defineConfig({
         secure: false,
         agent: httpsAgent,
       },
+      "/tasks": {
+        target: backend,
+        changeOrigin: true,
+        secure: false,
+        agent: httpsAgent,
+      },
     },
   },
 });
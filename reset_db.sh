@@ -3,7 +3,7 @@
 # CODEX: Delete the SQLite database and reinitialize schema
 set -e
 
-rm -f backend/data.db
+rm -f backend/data.db backend/data.db-wal backend/data.db-shm
 python - <<'PY'
 import sys
 sys.path.insert(0, 'backend')
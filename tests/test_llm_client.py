@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_client import CircuitBreaker, CircuitOpenError, LLMClient, LLMError
+
+
+class FakeOpenRouter:
+    """Answers chat completions with queued status codes, holding on demand."""
+
+    def __init__(self):
+        self.statuses = []
+        self.hold = threading.Event()
+        self.hold.set()
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                fake.requests += 1
+                status = fake.statuses.pop(0) if fake.statuses else 200
+                fake.hold.wait(5)
+                body = b"error"
+                if status == 200:
+                    body = json.dumps(
+                        {"choices": [{"message": {"content": "NO"}}]}
+                    ).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+
+@pytest.fixture
+def fake():
+    server = FakeOpenRouter()
+    yield server
+    server.hold.set()
+    server.server.shutdown()
+
+
+def open_client(fake, reset_after=0.2):
+    """Return a client whose circuit has just opened after two 500s."""
+    client = LLMClient(
+        fake.url, max_attempts=1, failure_threshold=2, reset_after=reset_after
+    )
+    fake.statuses = [500, 500]
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            client.chat("m", [], "k")
+    assert client.breaker.state == "open"
+    return client
+
+
+def test_open_circuit_rejects_without_sending(fake):
+    client = open_client(fake, reset_after=60)
+    with pytest.raises(CircuitOpenError):
+        client.chat("m", [], "k")
+    assert fake.requests == 2
+
+
+def test_bad_request_on_trial_lets_next_call_probe(fake):
+    client = open_client(fake)
+    time.sleep(0.25)
+    fake.statuses = [400]
+    with pytest.raises(LLMError):
+        client.chat("m", [], "k")
+    assert client.breaker.state == "half_open"
+    assert client.chat("m", [], "k") == "NO"
+    assert client.breaker.state == "closed"
+
+
+def test_half_open_lets_one_concurrent_call_through(fake):
+    client = open_client(fake)
+    time.sleep(0.25)
+    fake.hold.clear()
+    results = {}
+
+    def trial():
+        results["trial"] = client.chat("m", [], "k")
+
+    thread = threading.Thread(target=trial)
+    thread.start()
+    while fake.requests < 3:
+        time.sleep(0.01)
+    # the trial is still waiting on its answer
+    with pytest.raises(CircuitOpenError):
+        client.chat("m", [], "k")
+    fake.hold.set()
+    thread.join(5)
+    assert results["trial"] == "NO"
+    assert fake.requests == 3
+    assert client.breaker.state == "closed"
+
+
+def test_call_admitted_before_opening_keeps_trial_single():
+    breaker = CircuitBreaker(threshold=1, reset_after=0)
+    assert breaker.allow() == (True, False)
+    breaker.record(False)
+    assert breaker.allow() == (True, True)
+    # the earlier call ends while the trial runs
+    breaker.record(False)
+    assert breaker.allow() == (False, False)
+    breaker.record(True)
+    breaker.release()
+    assert breaker.allow() == (True, False)
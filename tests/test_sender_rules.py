@@ -0,0 +1,39 @@
+import pytest
+
+from sender_rules import SenderRules, normalise_sender, parse_rule
+
+
+@pytest.mark.parametrize(
+    "rule", ["*.com", "*.uk", "*.co.uk", "*.com.au", "*.", "*.CO.UK"]
+)
+def test_wildcard_over_public_suffix_is_rejected(rule):
+    assert parse_rule(rule) is None
+    assert normalise_sender(rule)["kind"] is None
+
+
+@pytest.mark.parametrize(
+    "rule, expected",
+    [
+        ("*.shop.co.uk", ("subdomain", "shop.co.uk")),
+        ("*.example.com", ("subdomain", "example.com")),
+        ("@shop.com", ("domain", "shop.com")),
+        ("shop.com", ("domain", "shop.com")),
+        ('"Shop" <News@Shop.com>', ("address", "news@shop.com")),
+    ],
+)
+def test_parse_rule(rule, expected):
+    assert parse_rule(rule) == expected
+
+
+def test_most_specific_rule_wins():
+    rules = SenderRules(
+        [
+            ("subdomain", "shop.co.uk", "spam"),
+            ("domain", "mail.shop.co.uk", "ignore"),
+            ("address", "boss@mail.shop.co.uk", "whitelist"),
+        ]
+    )
+    assert rules.match("Boss <boss@mail.shop.co.uk>") == ("whitelist", "address")
+    assert rules.match("x@mail.shop.co.uk") == ("ignore", "domain")
+    assert rules.match("x@deals.shop.co.uk") == ("spam", "subdomain")
+    assert rules.match("x@other.co.uk") is None